@@ -12,6 +12,7 @@ main(int argc, char ** argv)
     Spats s(true);
     s.addTargets(argv[1]);
     s.process_pair_data(argv[2], argv[3]);
+    s.report_workers(stdout);
     s.store(argv[4]);
     return 0;
 }
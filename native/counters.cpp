@@ -14,6 +14,38 @@ Counters::aggregate(Counters * other)
         counters[i] += other->counters[i];
 }
 
+// copies out the fixed counts and the nonzero site counts (as
+// [mask, L, site, count] quads; sites_out must have room for
+// max_sites() of them), and resets everything to zero. returns the
+// number of site quads written.
+int
+Counters::drain(int * counts_out, int * sites_out)
+{
+    for (int i = 0; i < NUM_FIXED_COUNTS; ++i) {
+        counts_out[i] = counts[i];
+        counts[i] = 0;
+    }
+    int num_sites = 0;
+    for (int mask = MASK_TREATED; mask <= MASK_UNTREATED; ++mask) {
+        int * base = &counters[mask == 2 ? n2 : 0];
+        for (int L = 0; L < n; ++L) {
+            for (int site = 0; site <= L; ++site) {
+                int count = base[(n * L) + site];
+                if (0 == count)
+                    continue;
+                int * out = &sites_out[num_sites << 2];
+                out[0] = mask;
+                out[1] = L;
+                out[2] = site;
+                out[3] = count;
+                base[(n * L) + site] = 0;
+                ++num_sites;
+            }
+        }
+    }
+    return num_sites;
+}
+
 std::string
 Counters::count_json()
 {
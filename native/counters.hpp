@@ -15,6 +15,7 @@
 
 #define COUNTER(cstruct,counterName) (cstruct->counts[COUNT_INDEX_##counterName])
 #define INCR_COUNTER(cstruct,counterName) ++(cstruct->counts[COUNT_INDEX_##counterName])
+#define ADD_COUNTER(cstruct,counterName,m) (cstruct->counts[COUNT_INDEX_##counterName] += (m))
 
 class Counters
 {
@@ -29,13 +30,15 @@ public:
         for (int i = 0; i < NUM_FIXED_COUNTS; ++i)
             counts[i] = 0;
         counters = new int[n2 << 1];
-        memset(counters, 0, n2 << 1);
+        memset(counters, 0, (n2 << 1) * sizeof(int));
     }
     ~Counters() { delete [] counters; }
 
-    inline void register_site(int mask, int L, int site) { ++counters[(mask == 2 ? n2 : 0) + (n * L) + site]; }
+    inline void register_site(int mask, int L, int site, int m = 1) { counters[(mask == 2 ? n2 : 0) + (n * L) + site] += m; }
     inline int site_count(int mask, int L, int site) { return counters[(mask == 2 ? n2 : 0) + (n * L) + site]; }
+    int max_sites() const { return n2 << 1; }
     void aggregate(Counters * other);
+    int drain(int * counts_out, int * sites_out);
     std::string count_json();
     std::string site_json(int cotrans_min_length);
 };
@@ -0,0 +1,176 @@
+
+#include "engine.hpp"
+#include "spats.hpp"
+#include "lookup_engine.hpp"
+
+
+struct SpatsEngine
+{
+    Spats spats;
+    Counters * scratch;
+    SpatsEngine() : spats(true), scratch(NULL) { }
+    ~SpatsEngine() { delete scratch; }
+};
+
+
+void *
+spats_engine_new(int cotrans_minimum_length, const char * linker, const char * adapter_b, const char * adapter_t)
+{
+    SpatsEngine * e = new SpatsEngine();
+    Spats * s = &e->spats;
+    s->m_cotrans_minimum_length = cotrans_minimum_length;
+    delete s->m_linker;
+    s->m_linker = new Fragment(linker);
+    s->m_adapter_b = adapter_b;
+    s->m_adapter_t_rc = reverse_complement(adapter_t);
+    return e;
+}
+
+void
+spats_engine_free(void * engine)
+{
+    delete (SpatsEngine *)engine;
+}
+
+int
+spats_engine_add_target(void * engine, const char * name, const char * seq)
+{
+    Spats * s = &((SpatsEngine *)engine)->spats;
+    ATS_RETVAL_IF(NULL != s->m_r1l, -1);
+    s->m_targets.addTarget(new Target(s->m_targets.size(), name, seq));
+    s->m_cotrans_target = s->m_targets.target(0);
+    return s->m_targets.size();
+}
+
+int
+spats_engine_setup(void * engine, int pair_len)
+{
+    SpatsEngine * e = (SpatsEngine *)engine;
+    Spats * s = &e->spats;
+    // R1 (less the handle) must fit in the single word used for fast lookups
+    if (NULL != s->m_r1l  ||  NULL == s->m_cotrans_target  ||  pair_len <= 4  ||  ((pair_len - 4) << 1) > WORD_BITS)
+        return -1;
+    s->m_pair_len = pair_len;
+    s->setup();
+    e->scratch = new Counters(s->m_cotrans_target->n());
+    return 0;
+}
+
+int
+spats_engine_max_sites(void * engine)
+{
+    return ((SpatsEngine *)engine)->spats.counters()->max_sites();
+}
+
+// results gets [mask, L, site] for each pair (mask is MASK_NO_MATCH
+// if the pair wasn't kept). if accumulate is zero, the pairs aren't
+// added to the counters returned by spats_engine_drain().
+int
+spats_engine_process(void * engine, int num_pairs, const char ** r1s, const char ** r2s,
+                     const int * multiplicities, int * results, int accumulate)
+{
+    SpatsEngine * e = (SpatsEngine *)engine;
+    Spats * s = &e->spats;
+    Counters * counters = (accumulate ? s->counters() : e->scratch);
+    int pair_len = s->m_pair_len;
+    int num_kept = 0;
+    char handle[5] = { 0 };
+    Fragment r1_frag;
+    Fragment r2_frag;
+    Case c;
+
+    for (int i = 0; i < num_pairs; ++i) {
+        int * res = &results[3 * i];
+        c.mask = MASK_NO_MATCH;
+        c.L = c.site = -1;
+        c.multiplicity = (multiplicities ? multiplicities[i] : 1);
+        if ((int)strlen(r1s[i]) == pair_len  &&  (int)strlen(r2s[i]) == pair_len) {
+            memcpy(handle, r1s[i], 4);
+            r1_frag.parse(&r1s[i][4], pair_len - 4);
+            r2_frag.parse(r2s[i], pair_len);
+            s->spats_handler(&r1_frag, &r2_frag, handle, counters, &c);
+        }
+        else {
+            ADD_COUNTER(counters,TOTAL,c.multiplicity);
+        }
+        res[0] = c.mask;
+        res[1] = c.L;
+        res[2] = c.site;
+        if (c.valid())
+            ++num_kept;
+    }
+    return num_kept;
+}
+
+int
+spats_engine_drain(void * engine, int * counts_out, int * sites_out)
+{
+    return ((SpatsEngine *)engine)->spats.counters()->drain(counts_out, sites_out);
+}
+
+
+void *
+spats_lookup_engine_new(int pair_len, const char * adapter_b, const char * adapter_t, int count_mutations,
+                        int allowed_target_errors, int allowed_adapter_errors, int allow_indeterminate,
+                        int ignore_stops_with_mismatched_overlap, int count_only_full_reads,
+                        int edge_mutations, int minimum_quality)
+{
+    ATS_RETVAL_IF(pair_len <= 4, NULL);
+    LookupOptions options;
+    options.adapter_b = adapter_b;
+    options.adapter_t_rc = reverse_complement(adapter_t);
+    options.count_mutations = (0 != count_mutations);
+    options.allowed_target_errors = allowed_target_errors;
+    options.allowed_adapter_errors = allowed_adapter_errors;
+    options.allow_indeterminate = (0 != allow_indeterminate);
+    options.ignore_stops_with_mismatched_overlap = (0 != ignore_stops_with_mismatched_overlap);
+    options.count_only_full_reads = (0 != count_only_full_reads);
+    options.edge_mutations = edge_mutations;
+    options.minimum_quality = minimum_quality;
+    return new LookupEngine(pair_len, options);
+}
+
+void
+spats_lookup_engine_free(void * engine)
+{
+    delete (LookupEngine *)engine;
+}
+
+int
+spats_lookup_engine_add_target(void * engine, const char * name, const char * seq, int r2_match_len)
+{
+    return ((LookupEngine *)engine)->add_target(name, seq, r2_match_len);
+}
+
+void
+spats_lookup_engine_add_r1_alias(void * engine, const char * alias, const char * key)
+{
+    ((LookupEngine *)engine)->add_r1_alias(alias, key);
+}
+
+// q1s/q2s may be NULL if quality isn't being checked. returns the number of pairs registered.
+int
+spats_lookup_engine_process(void * engine, int num_pairs, const char ** r1s, const char ** r2s,
+                            const char ** q1s, const char ** q2s, const int * multiplicities)
+{
+    LookupEngine * e = (LookupEngine *)engine;
+    int num_kept = 0;
+    for (int i = 0; i < num_pairs; ++i) {
+        if (e->process_pair(r1s[i], r2s[i], (q1s ? q1s[i] : NULL), (q2s ? q2s[i] : NULL), (multiplicities ? multiplicities[i] : 1)))
+            ++num_kept;
+    }
+    return num_kept;
+}
+
+void
+spats_lookup_engine_drain_counts(void * engine, int * counts_out)
+{
+    ((LookupEngine *)engine)->drain_counts(counts_out);
+}
+
+int
+spats_lookup_engine_drain_sites(void * engine, int target, int mask, int * stops, int * quality_stops,
+                                int * muts, int * removed_muts)
+{
+    return ((LookupEngine *)engine)->drain_sites(target, mask, stops, quality_stops, muts, removed_muts);
+}
@@ -0,0 +1,36 @@
+#ifndef __SPATS_ENGINE_HPP_INCLUDED__
+#define __SPATS_ENGINE_HPP_INCLUDED__
+
+/* C interface to the cotrans and lookup engines, for loading in-process (e.g.,
+ * from python via ctypes; see spats_shape_seq/native.py). built as
+ * lib/libspats.so.
+ */
+
+extern "C" {
+
+void * spats_engine_new(int cotrans_minimum_length, const char * linker, const char * adapter_b, const char * adapter_t);
+void spats_engine_free(void * engine);
+int spats_engine_add_target(void * engine, const char * name, const char * seq);
+int spats_engine_setup(void * engine, int pair_len);
+int spats_engine_max_sites(void * engine);
+int spats_engine_process(void * engine, int num_pairs, const char ** r1s, const char ** r2s,
+                         const int * multiplicities, int * results, int accumulate);
+int spats_engine_drain(void * engine, int * counts_out, int * sites_out);
+
+/* the (non-cotrans) lookup engine; see lookup_engine.hpp */
+void * spats_lookup_engine_new(int pair_len, const char * adapter_b, const char * adapter_t, int count_mutations,
+                               int allowed_target_errors, int allowed_adapter_errors, int allow_indeterminate,
+                               int ignore_stops_with_mismatched_overlap, int count_only_full_reads,
+                               int edge_mutations, int minimum_quality);
+void spats_lookup_engine_free(void * engine);
+int spats_lookup_engine_add_target(void * engine, const char * name, const char * seq, int r2_match_len);
+void spats_lookup_engine_add_r1_alias(void * engine, const char * alias, const char * key);
+int spats_lookup_engine_process(void * engine, int num_pairs, const char ** r1s, const char ** r2s,
+                                const char ** q1s, const char ** q2s, const int * multiplicities);
+void spats_lookup_engine_drain_counts(void * engine, int * counts_out);
+int spats_lookup_engine_drain_sites(void * engine, int target, int mask, int * stops, int * quality_stops,
+                                    int * muts, int * removed_muts);
+
+}
+
+#endif // __SPATS_ENGINE_HPP_INCLUDED__
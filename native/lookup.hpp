@@ -26,7 +26,7 @@ public:
 
     virtual ~Lookup()
     {
-        delete [] m_table;
+        free(m_table);
     }
 
     int count() const { return m_count; }
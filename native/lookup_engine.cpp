@@ -0,0 +1,453 @@
+
+#include "lookup_engine.hpp"
+#include "mask.hpp"
+
+#include <algorithm>
+#include <ctype.h>
+#include <string.h>
+
+
+static const char * NUCLEOTIDES = "ACGT";
+
+static std::string
+rc(const std::string & seq)
+{
+    // same as util.reverse_complement in python: anything other than ACGT is passed through
+    std::string res(seq.rbegin(), seq.rend());
+    for (size_t i = 0; i < res.size(); ++i) {
+        switch (res[i]) {
+        case 'A': res[i] = 'T'; break;
+        case 'C': res[i] = 'G'; break;
+        case 'G': res[i] = 'C'; break;
+        case 'T': res[i] = 'A'; break;
+        case 'a': res[i] = 't'; break;
+        case 'c': res[i] = 'g'; break;
+        case 'g': res[i] = 'c'; break;
+        case 't': res[i] = 'a'; break;
+        default: break;
+        }
+    }
+    return res;
+}
+
+// s[start:end], for nonnegative start/end
+static std::string
+slice(const std::string & s, int start, int end)
+{
+    end = std::min(end, (int)s.size());
+    return (start >= end ? std::string() : s.substr(start, end - start));
+}
+
+static int
+match_errors(const char * s1, const char * s2, int len, std::vector<int> * errors = NULL, int offset = 0)
+{
+    int count = 0;
+    for (int i = 0; i < len; ++i) {
+        if (s1[i] != s2[i]) {
+            ++count;
+            if (errors)
+                errors->push_back(i + offset);
+        }
+    }
+    return count;
+}
+
+static bool
+is_determinate(const std::string & s)
+{
+    for (size_t i = 0; i < s.size(); ++i) {
+        char ch = s[i];
+        if (ch != 'A'  &&  ch != 'C'  &&  ch != 'G'  &&  ch != 'T')
+            return false;
+    }
+    return true;
+}
+
+// replaces v with the ordering that list(set(v)) has in python 2, so
+// that mutations are registered in the same order. with small ints
+// hashing to themselves, this only depends on the probe sequence in
+// the initial 8-entry table (good for up to 5 entries, after which
+// python would resize).
+static void
+python_set_order(std::vector<int> & v)
+{
+    int table[8];
+    bool used[8] = { false };
+    ATS_ASSERT(v.size() <= 5);
+    for (size_t k = 0; k < v.size(); ++k) {
+        int x = v[k];
+        size_t i = (size_t)x & 7;
+        size_t perturb = (size_t)x;
+        while (used[i & 7]  &&  table[i & 7] != x) {
+            i = (i << 2) + i + perturb + 1;
+            perturb >>= 5;
+        }
+        used[i & 7] = true;
+        table[i & 7] = x;
+    }
+    v.clear();
+    for (int i = 0; i < 8; ++i) {
+        if (used[i])
+            v.push_back(table[i]);
+    }
+}
+
+
+LookupEngine::LookupEngine(int pair_len, const LookupOptions & options) :
+    m_options(options), m_pair_len(pair_len), m_r1_length(pair_len - 4), m_r1_alias_length(0)
+{
+    for (int i = 0; i < NUM_LOOKUP_COUNTS; ++i)
+        m_counts[i] = 0;
+}
+
+LookupEngine::~LookupEngine()
+{
+    for (size_t i = 0; i < m_targets.size(); ++i)
+        delete m_targets[i];
+}
+
+void
+LookupEngine::add_r1_entry(const std::string & key, const LookupHit & hit)
+{
+    // hits for the same key are kept in insertion order, which determines the order they're tried in
+    m_r1_table[key].push_back(hit);
+}
+
+// same tables as Targets._build_R1_lookup / _build_R2_lookup in python
+int
+LookupEngine::add_target(const char * name, const char * seq, int r2_match_len)
+{
+    LookupTarget * target = new LookupTarget();
+    int t = (int)m_targets.size();
+    target->name = name;
+    target->seq = seq;
+    std::transform(target->seq.begin(), target->seq.end(), target->seq.begin(), ::toupper);
+    target->n = (int)target->seq.size();
+    target->r2_match_len = r2_match_len;
+    for (int mask = 0; mask < 2; ++mask) {
+        LookupSites & sites = target->sites[mask];
+        sites.stops.assign(target->n + 2, 0);
+        sites.quality_stops.assign(target->n + 2, 0);
+        sites.muts.assign(target->n + 2, 0);
+        sites.removed_muts.assign(target->n + 2, 0);
+        sites.touched = false;
+    }
+    m_targets.push_back(target);
+
+    int length = m_r1_length;
+    int tlen = target->n;
+    std::string rc_tgt = rc(target->seq);
+    for (int i = 1; i <= length; ++i) {
+        std::string candidate = rc_tgt.substr(0, i) + m_options.adapter_b.substr(0, length - i);
+        LookupHit hit = { t, (i == length ? -1 : tlen - i), length - i, 0 };
+        add_r1_entry(candidate, hit);
+        if (m_options.count_mutations) {
+            for (int toggle_idx = 0; toggle_idx < i  &&  toggle_idx < (int)candidate.size(); ++toggle_idx) {
+                std::string mutated = candidate;
+                for (const char * nt = NUCLEOTIDES; *nt; ++nt) {
+                    if (candidate[toggle_idx] == *nt)
+                        continue;
+                    mutated[toggle_idx] = *nt;
+                    LookupHit mhit = { t, hit.end, hit.trim, tlen - toggle_idx };
+                    add_r1_entry(mutated, mhit);
+                }
+            }
+        }
+    }
+
+    for (int i = 0; i < tlen - r2_match_len + 1; ++i) {
+        std::string candidate = target->seq.substr(i, r2_match_len);
+        target->r2_table[candidate] = i;
+        if (m_options.count_mutations) {
+            for (int toggle_idx = 0; toggle_idx < r2_match_len; ++toggle_idx) {
+                std::string mutated = candidate;
+                for (const char * nt = NUCLEOTIDES; *nt; ++nt) {
+                    if (candidate[toggle_idx] == *nt)
+                        continue;
+                    mutated[toggle_idx] = *nt;
+                    target->r2_table[mutated] = i;
+                }
+            }
+        }
+    }
+    return (int)m_targets.size();
+}
+
+// aliases must be added in the same order as they're listed in python,
+// since the first matching key for an alias is used
+void
+LookupEngine::add_r1_alias(const char * alias, const char * key)
+{
+    m_r1_alias_length = (int)strlen(alias);
+    m_r1_aliases[alias].push_back(key);
+}
+
+// same as Targets.lookup_r1 in python
+const std::vector<LookupHit> *
+LookupEngine::lookup_r1(const std::string & seq) const
+{
+    std::unordered_map<std::string, std::vector<LookupHit> >::const_iterator it = m_r1_table.find(seq);
+    if (it != m_r1_table.end())
+        return &it->second;
+    if (m_r1_aliases.empty())
+        return NULL;
+    std::unordered_map<std::string, std::vector<std::string> >::const_iterator alias = m_r1_aliases.find(seq.substr(0, m_r1_alias_length));
+    if (alias == m_r1_aliases.end())
+        return NULL;
+    const std::vector<std::string> & keys = alias->second;
+    for (size_t i = 0; i < keys.size(); ++i) {
+        if (!keys[i].empty()  &&  0 == seq.compare(0, keys[i].size(), keys[i])) {
+            it = m_r1_table.find(keys[i]);
+            return (it == m_r1_table.end() ? NULL : &it->second);
+        }
+    }
+    return NULL;
+}
+
+// returns true if the pair was registered, mirroring LookupProcessor.process_pair
+bool
+LookupEngine::process_pair(const char * r1_chars, const char * r2_chars, const char * q1, const char * q2, int m)
+{
+    std::string r1(r1_chars);
+    std::string r2(r2_chars);
+    if (r1.empty()  ||  r2.empty())
+        return false;
+    std::transform(r1.begin(), r1.end(), r1.begin(), ::toupper);
+    std::transform(r2.begin(), r2.end(), r2.begin(), ::toupper);
+
+    int mask = (r1.size() >= 4 ? match_mask(r1.c_str()) : MASK_NO_MATCH);
+    if (MASK_NO_MATCH == mask) {
+        m_counts[LOOKUP_COUNT_MASK_FAILURE] += m;
+        return false;
+    }
+    m_counts[MASK_TREATED == mask ? LOOKUP_COUNT_TREATED_TOTAL : LOOKUP_COUNT_UNTREATED_TOTAL] += m;
+
+    const std::vector<LookupHit> * r1_res = lookup_r1(r1.substr(4));
+    if (NULL == r1_res)
+        return false;
+    const std::vector<LookupHit> & hits = *r1_res;
+    for (size_t i = 0; i < hits.size(); ++i) {
+        for (size_t j = i + 1; j < hits.size(); ++j) {
+            if (hits[i].trim == hits[j].trim)
+                return false;   // multiple R1
+        }
+    }
+
+    m_mutations.clear();
+    m_removed.clear();
+    for (size_t i = 0; i < hits.size(); ++i) {
+        if (try_hit(hits[i], mask, r1, r2, q1, q2, m))
+            return true;
+    }
+    return false;
+}
+
+bool
+LookupEngine::try_hit(const LookupHit & hit, int mask, const std::string & r1, const std::string & r2,
+                      const char * q1, const char * q2, int m)
+{
+    const LookupOptions & opts = m_options;
+    LookupTarget * target = m_targets[hit.target];
+    const std::string & tseq = target->seq;
+    int tlen = target->n;
+    int r1len = (int)r1.size();
+    int r2len = (int)r2.size();
+    int match_site;
+
+    if (hit.end < 0) {
+        std::unordered_map<std::string, int>::const_iterator r2_res = target->r2_table.find(r2.substr(0, target->r2_match_len));
+        if (r2_res == target->r2_table.end())
+            return false;
+        match_site = r2_res->second;
+    }
+    else
+        match_site = hit.end;
+
+    // R2 against the target
+    int match_len = std::min(r2len, tlen - match_site);
+    std::vector<int> r2_mutations;
+    if (match_len <= 0)
+        return false;
+    //+1 for M_j indexing convention
+    if (match_errors(r2.c_str(), tseq.c_str() + match_site, match_len, &r2_mutations, match_site + 1) > opts.allowed_target_errors)
+        return false;
+
+    int adapter_len = r2len - match_len - 4;
+    if (adapter_len > 0) {
+        int len = std::min(adapter_len, (int)opts.adapter_t_rc.size());
+        if (match_errors(opts.adapter_t_rc.c_str(), r2.c_str() + r2len - adapter_len, len) > opts.allowed_adapter_errors)
+            return false;
+    }
+    int site = match_site;
+
+    // in rare cases, need to double-check what R1 should be based on R2
+    if (site != hit.end) {
+        int r1_match_len = std::min(r1len - 4, tlen - match_site);
+        int r1_adapter_len = r1len - r1_match_len - 4;
+        std::string expected = rc(tseq.substr(tlen - r1_match_len));
+        if (match_errors(expected.c_str(), r1.c_str() + 4, r1_match_len) > opts.allowed_target_errors)
+            return false;
+        if (r1_adapter_len > 0) {
+            int len = std::min(r1_adapter_len, (int)opts.adapter_b.size());
+            if (match_errors(r1.c_str() + r1len - r1_adapter_len, opts.adapter_b.c_str(), len) > opts.allowed_adapter_errors)
+                return false;
+        }
+        // python reuses match_len here, so this is also what R2's match_len becomes
+        match_len = r1_match_len;
+    }
+
+    if (!opts.allow_indeterminate  &&  !(is_determinate(r1)  &&  is_determinate(r2))) {
+        m_counts[LOOKUP_COUNT_INDETERMINATE] += m;
+        return false;
+    }
+
+    int r1_match_len = std::min(r1len - 4, tlen - match_site);
+    int r1_match_index = (hit.end > 0 ? hit.end : tlen - r1_match_len);
+    int r1_rtrim = hit.trim;
+
+    if (opts.ignore_stops_with_mismatched_overlap) {
+        int overlap_index = std::max(r1_match_index, site);
+        int overlap_len = site + match_len - overlap_index;
+        if (overlap_len > 0) {
+            int r1start = std::max(site - r1_match_index, 0);
+            std::string r1_part = slice(rc(slice(r1, 4, r1len - r1_rtrim)), r1start, r1start + overlap_len);
+            if (r1_part != r2.substr(match_len - overlap_len, overlap_len))
+                return false;
+        }
+    }
+
+    if (!r2_mutations.empty()  ||  hit.mut) {
+        m_mutations = r2_mutations;
+        if (hit.mut)
+            m_mutations.push_back(hit.mut);
+        python_set_order(m_mutations);
+        if ((int)m_mutations.size() > opts.allowed_target_errors)
+            return false;
+        m_counts[LOOKUP_COUNT_LOW_QUALITY_MUTS] += check_mutation_quality(target, r1_match_index, r1_rtrim, site, r1, r2, q1, q2);
+        m_counts[LOOKUP_COUNT_QUALITY_CHECKED] = 1;
+    }
+
+    if (opts.count_only_full_reads  &&  site != 0)
+        return false;
+
+    register_pair(target, mask, site, m);
+    return true;
+}
+
+// same as Pair.check_mutation_quality in python (without indels)
+int
+LookupEngine::check_mutation_quality(LookupTarget * target, int r1_match_index, int r1_rtrim, int r2_match_index,
+                                     const std::string & r1, const std::string & r2, const char * q1, const char * q2)
+{
+    int min_quality = m_options.minimum_quality;
+    if (min_quality < 0  ||  m_mutations.empty()  ||  NULL == q1  ||  NULL == q2  ||  !*q1  ||  !*q2)
+        return 0;
+    std::string r1_quality(q1);
+    std::string r2_quality(q2);
+    int r1_start = r1_match_index;
+    std::string r1_rc = rc(slice(r1, 4, (int)r1.size() - r1_rtrim));
+    std::string r1_rq = slice(r1_quality, 4, (int)r1_quality.size() - r1_rtrim);
+    std::reverse(r1_rq.begin(), r1_rq.end());
+    int r2_start = r2_match_index + 1;
+    int r2_end = r2_start + (int)r2.size();
+    std::vector<int> removed;
+
+    for (size_t i = 0; i < m_mutations.size(); ++i) {
+        int mut = m_mutations[i];
+        int q = 0, qual1 = 0, qual2 = 0;
+        char nt1 = 0, nt2 = 0;
+        if (mut < r2_end  &&  mut >= r2_start  &&  mut - r2_start < (int)r2_quality.size()) {
+            int idx = mut - r2_start;
+            qual2 = (unsigned char)r2_quality[idx];
+            nt2 = r2[idx];
+        }
+        if (mut > r1_start) {
+            int idx = mut - r1_start - 1;
+            if (idx < (int)r1_rq.size()) {
+                qual1 = (unsigned char)r1_rq[idx];
+                nt1 = r1_rc[idx];
+            }
+        }
+        if (qual1  &&  qual2) {
+            if (nt1 == nt2)
+                q = std::max(qual1, qual2);
+            else {
+                char ref = target->seq[mut - 1];
+                if (qual1 < min_quality  &&  qual2 >= min_quality)
+                    q = (nt2 == ref ? qual1 : qual2);
+                else if (qual2 < min_quality  &&  qual1 >= min_quality)
+                    q = (nt1 == ref ? qual2 : qual1);
+                else if (qual1 < min_quality  &&  qual2 < min_quality)
+                    q = std::max(qual1, qual2);
+                else
+                    q = 0;  // both high quality and disagree: ignore the mut
+            }
+        }
+        else if (qual1)
+            q = qual1;
+        else if (qual2)
+            q = qual2;
+        if (!q  ||  q < min_quality)
+            removed.push_back(mut);
+    }
+    for (size_t i = 0; i < removed.size(); ++i)
+        m_mutations.erase(std::find(m_mutations.begin(), m_mutations.end(), removed[i]));
+    if (!removed.empty())
+        m_removed = removed;
+    return (int)removed.size();
+}
+
+// same as Counters.register_count in python (without indels)
+void
+LookupEngine::register_pair(LookupTarget * target, int mask, int site, int m)
+{
+    LookupSites & sites = target->sites[mask - 1];
+    sites.touched = true;
+    for (size_t i = 0; i < m_mutations.size(); ++i) {
+        int mut = m_mutations[i];
+        if (site == mut - 1) {
+            // mutation on the edge
+            ++m_counts[LOOKUP_COUNT_EDGE_MUTS];
+            if (EDGE_MUTS_STOP_AND_MUT == m_options.edge_mutations)
+                sites.muts[mut] += m;
+            else if (EDGE_MUTS_IGNORE == m_options.edge_mutations)
+                return;     // don't count this as a stop at all
+        }
+        else
+            sites.muts[mut] += m;
+    }
+    for (size_t i = 0; i < m_removed.size(); ++i)
+        sites.removed_muts[site] += m;
+    sites.stops[site] += m;
+    if (m_removed.empty())
+        sites.quality_stops[site] += m;
+}
+
+void
+LookupEngine::drain_counts(int * counts_out)
+{
+    for (int i = 0; i < NUM_LOOKUP_COUNTS; ++i) {
+        counts_out[i] = m_counts[i];
+        m_counts[i] = 0;
+    }
+}
+
+// copies out (and resets) the site vectors for the target/mask, each
+// of which must have room for target_length() + 2 entries. returns
+// zero if there was nothing to copy.
+int
+LookupEngine::drain_sites(int target, int mask, int * stops, int * quality_stops, int * muts, int * removed_muts)
+{
+    LookupSites & sites = m_targets[target]->sites[mask - 1];
+    if (!sites.touched)
+        return 0;
+    std::vector<int> * vects[] = { &sites.stops, &sites.quality_stops, &sites.muts, &sites.removed_muts };
+    int * outs[] = { stops, quality_stops, muts, removed_muts };
+    for (int i = 0; i < 4; ++i) {
+        std::vector<int> & v = *vects[i];
+        std::copy(v.begin(), v.end(), outs[i]);
+        std::fill(v.begin(), v.end(), 0);
+    }
+    sites.touched = false;
+    return 1;
+}
@@ -0,0 +1,119 @@
+
+#ifndef __SPATS_LOOKUP_ENGINE_HPP_INCLUDED__
+#define __SPATS_LOOKUP_ENGINE_HPP_INCLUDED__
+
+#include <string>
+#include <unordered_map>
+#include <vector>
+
+
+/* single-length (non-cotrans) lookup processing, with the same
+ * feature coverage and results as the python LookupProcessor:
+ * multiple targets, single-error mutation counting, the edge
+ * mutation policy, and quality score thresholds.
+ *
+ * unlike R1Lookup/R2Lookup, the tables are keyed by the full
+ * sequence strings (not 2-bit words), so that they can carry the
+ * mutation for each entry, and so that reads with indeterminate
+ * nucleotides are handled the same as in python.
+ */
+
+#define LOOKUP_COUNT_MASK_FAILURE      0
+#define LOOKUP_COUNT_INDETERMINATE     1
+#define LOOKUP_COUNT_EDGE_MUTS         2
+#define LOOKUP_COUNT_LOW_QUALITY_MUTS  3
+#define LOOKUP_COUNT_QUALITY_CHECKED   4   // nonzero if check_mutation_quality() would have run
+#define LOOKUP_COUNT_TREATED_TOTAL     5
+#define LOOKUP_COUNT_UNTREATED_TOTAL   6
+#define NUM_LOOKUP_COUNTS              7
+
+#define EDGE_MUTS_IGNORE        0
+#define EDGE_MUTS_STOP_ONLY     1
+#define EDGE_MUTS_STOP_AND_MUT  2
+
+
+struct LookupHit
+{
+    int target;
+    int end;    // -1 if R2 must be looked up to determine the site
+    int trim;   // amount of adapter on R1
+    int mut;    // 0 if none
+};
+
+// per-site vectors for the pairs registered to a (target, mask)
+struct LookupSites
+{
+    std::vector<int> stops;
+    std::vector<int> quality_stops;     // stops for pairs with no removed (low quality) mutations
+    std::vector<int> muts;
+    std::vector<int> removed_muts;
+    bool touched;
+};
+
+struct LookupTarget
+{
+    std::string name;
+    std::string seq;
+    int n;
+    int r2_match_len;
+    std::unordered_map<std::string, int> r2_table;
+    LookupSites sites[2];    // indexed by mask - 1
+};
+
+struct LookupOptions
+{
+    std::string adapter_b;
+    std::string adapter_t_rc;
+    bool count_mutations;
+    int allowed_target_errors;
+    int allowed_adapter_errors;
+    bool allow_indeterminate;
+    bool ignore_stops_with_mismatched_overlap;
+    bool count_only_full_reads;
+    int edge_mutations;
+    int minimum_quality;    // already offset by '!', or -1 if not checking quality
+};
+
+
+class LookupEngine
+{
+private:
+    LookupOptions m_options;
+    int m_pair_len;
+    int m_r1_length;
+    std::vector<LookupTarget *> m_targets;
+    std::unordered_map<std::string, std::vector<LookupHit> > m_r1_table;
+    // for short R1 keys (when there isn't enough adapter_b); see Targets._build_R1_aliases in python
+    std::unordered_map<std::string, std::vector<std::string> > m_r1_aliases;
+    int m_r1_alias_length;
+    int m_counts[NUM_LOOKUP_COUNTS];
+
+    // per-pair state that (as in python) carries across hits for the same pair
+    std::vector<int> m_mutations;
+    std::vector<int> m_removed;
+
+    void add_r1_entry(const std::string & key, const LookupHit & hit);
+    const std::vector<LookupHit> * lookup_r1(const std::string & seq) const;
+    bool try_hit(const LookupHit & hit, int mask, const std::string & r1, const std::string & r2,
+                 const char * q1, const char * q2, int m);
+    int check_mutation_quality(LookupTarget * target, int r1_match_index, int r1_rtrim, int r2_match_index,
+                               const std::string & r1, const std::string & r2, const char * q1, const char * q2);
+    void register_pair(LookupTarget * target, int mask, int site, int m);
+
+public:
+    LookupEngine(int pair_len, const LookupOptions & options);
+    ~LookupEngine();
+
+    int pair_len() const { return m_pair_len; }
+    int num_targets() const { return (int)m_targets.size(); }
+    int target_length(int target) const { return m_targets[target]->n; }
+
+    int add_target(const char * name, const char * seq, int r2_match_len);
+    void add_r1_alias(const char * alias, const char * key);
+    bool process_pair(const char * r1, const char * r2, const char * q1, const char * q2, int m);
+    void drain_counts(int * counts_out);
+    int drain_sites(int target, int mask, int * stops, int * quality_stops, int * muts, int * removed_muts);
+};
+
+
+#endif // __SPATS_LOOKUP_ENGINE_HPP_INCLUDED__
@@ -1,6 +1,5 @@
 
 #include <fstream>
-#include <unistd.h>
 #include <algorithm>
 
 #include "ats.hpp"
@@ -46,10 +45,12 @@ fastq_parse_driver(const char * r1_path, const char * r2_path, pair_handler hand
     size_t skip = 0;
     size_t full_skip = 0;
     size_t skip_padding = 0;
+    WorkQueue * queue = new WorkQueue();
     WorkContext context;
     context.handler = handler;
     context.spats = spats;
     context.fragment_len = 0;
+    context.queue = queue;
 
     Worker workers[NUM_WORKERS];
     int num_workers = (spats ? NUM_WORKERS : 1);
@@ -57,22 +58,18 @@ fastq_parse_driver(const char * r1_path, const char * r2_path, pair_handler hand
         Worker * w = &workers[i];
         w->id = i;
         w->context = &context;
-        w->start = w->end = 0;
-        w->items[0].ready = false;
+        w->count = w->batches = w->waits = 0;
+        w->busy_seconds = w->idle_seconds = 0.0;
         if (spats)
             w->counters = new Counters(spats->counters()->n - 1);
         else
             w->counters = NULL;
 #if !(BENCHMARK_PARSING_ONLY)
-        pthread_mutex_init(&(w->mutex), NULL);
-        pthread_cond_init(&(w->cond), NULL);
         pthread_create(&(w->thread), NULL, &worker_fn, (void *)w);
 #endif
     }
-    Worker * cur_worker = NULL;
-    int cur_worker_idx = 0;
+    WorkBatch * cur_batch = NULL;
     WorkItem * cur_work_item = NULL;
-    int worker_full = 0;
     int fragment_len = 0;
     int pair_idx = 0;
     int wrap_len = 0;
@@ -110,33 +107,22 @@ fastq_parse_driver(const char * r1_path, const char * r2_path, pair_handler hand
         ATS_ASSERT((int)buf_idx < (int)r1r2read);
 
 #if !(BENCHMARK_PARSING_ONLY)
-        /* r1start, r2start now have null-terminated strings; process the line */
-        while (true) {
-            cur_worker = &workers[cur_worker_idx];
-            if (++cur_worker_idx >= num_workers)
-                cur_worker_idx = 0;
-            if (cur_worker->done)
+        /* r1start, r2start now have null-terminated strings; add the pair to the current batch */
+        if (NULL == cur_batch) {
+            cur_batch = queue->reserve();
+            if (NULL == cur_batch)
                 goto fastq_parse_done;
-            cur_work_item = &cur_worker->items[cur_worker->end];
-            if (cur_work_item->ready) {
-                ++worker_full;
-                WORKER_TRACE("!");
-                if (1 == num_workers)
-                    usleep(50);
-            }
-            else {
-                break;
-            }
         }
 
-        cur_worker->end = (cur_worker->end + 1) % CQ_SIZE;
-
+        cur_work_item = &cur_batch->items[cur_batch->count];
         memcpy(cur_work_item->r1chars, r1start, fragment_len);
         memcpy(cur_work_item->r2chars, r2start, fragment_len);
         cur_work_item->pair_id = ++pair_idx;
         ATS_VERBOSE("P: %d (%p) %20s / %20s\n", cur_work_item->pair_id, cur_work_item, cur_work_item->r1chars, cur_work_item->r2chars);
-        cur_work_item->ready = true;
-        WORKER_TRACE("v");
+        if (++cur_batch->count == WORK_BATCH_SIZE) {
+            queue->submit(cur_batch);
+            cur_batch = NULL;
+        }
 #endif
 
         /* now try to skip to the beginning of the next fragment, 4 lines down */
@@ -185,18 +171,30 @@ fastq_parse_done:
     fclose(r1);
     fclose(r2);
 
-    int wempty = 0;
 #if !(BENCHMARK_PARSING_ONLY)
+    if (NULL != cur_batch)
+        queue->submit(cur_batch);
+    queue->finish();
+    if (spats)
+        spats->m_worker_stats.clear();
     for (int i = 0; i < num_workers; ++i) {
         Worker * w = &workers[i];
-        w->done = true;
         pthread_join(w->thread, NULL);
-        wempty += w->empty_worker;
-        if (spats)
+        if (spats) {
             spats->counters()->aggregate(w->counters);
+            delete w->counters;
+            WorkerStats stats = { w->count, w->batches, w->waits, w->busy_seconds, w->idle_seconds };
+            spats->m_worker_stats.push_back(stats);
+        }
+        ATS_DEBUG("worker %d: %d pairs, %d waits", i, w->count, w->waits);
+    }
+    if (spats) {
+        spats->m_parser_waits = queue->producer_waits;
+        spats->m_parser_wait_seconds = queue->producer_wait_seconds;
     }
+    ATS_DEBUG("\n%d wfull", queue->producer_waits);
 #endif
-    ATS_DEBUG("\n%d wfull, %d empty\n", worker_full, wempty);
+    delete queue;
 }
 
 void
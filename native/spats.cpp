@@ -13,7 +13,8 @@ Spats::spats_handler(Fragment * r1, Fragment * r2, const char * handle, Counters
 {
     //printf("R1: %s\nR2: %s\nH: %s\n", r1->string().c_str(), r2->string().c_str(), handle);
 
-    INCR_COUNTER(counters,TOTAL);
+    int multiplicity = (NULL != caseinfo ? caseinfo->multiplicity : 1);
+    ADD_COUNTER(counters,TOTAL,multiplicity);
     ATS_VERBOSE("INCR: %d\n", caseinfo->pair_id);
 
     //if (0 == COUNTER(TOTAL) % 1000000) {
@@ -52,7 +53,7 @@ Spats::spats_handler(Fragment * r1, Fragment * r2, const char * handle, Counters
 
     while (NULL != res) {
         if (try_lookup_hit(res, r1, r2, handle, counters, caseinfo)) {
-            INCR_COUNTER(counters,MATCHED);
+            ADD_COUNTER(counters,MATCHED,multiplicity);
             return true;
         }
         res = res->m_next;
@@ -114,18 +115,20 @@ Spats::try_lookup_hit(FragmentResult * res, Fragment * r1, Fragment * r2, const
         }
     }
 
+    int multiplicity = (NULL != caseinfo ? caseinfo->multiplicity : 1);
+
     if (r1->has_errors() || r2->has_errors()) {
-        INCR_COUNTER(counters,INDETERMINATE);
+        ADD_COUNTER(counters,INDETERMINATE,multiplicity);
         return false;
     }
 
     int mask = match_mask(handle);
     if (MASK_NO_MATCH == mask) {
-        INCR_COUNTER(counters,MASK_FAILURE);
+        ADD_COUNTER(counters,MASK_FAILURE,multiplicity);
         return false;
     }
 
-    counters->register_site(mask, L, site);
+    counters->register_site(mask, L, site, multiplicity);
     if (NULL != caseinfo) {
         caseinfo->mask = mask;
         caseinfo->L = L;
@@ -191,3 +194,16 @@ Spats::store(const char * path)
     pdb->store_run();
     pdb->store_targets(&m_targets);
 }
+
+void
+Spats::report_workers(FILE * out) const
+{
+    for (size_t i = 0; i < m_worker_stats.size(); ++i) {
+        const WorkerStats & ws = m_worker_stats[i];
+        double total = ws.busy_seconds + ws.idle_seconds;
+        fprintf(out, "worker %d: %d pairs in %d batches, busy %.2fs, idle %.2fs (%.1f%% busy, %d waits)\n",
+                (int)i, ws.pairs, ws.batches, ws.busy_seconds, ws.idle_seconds,
+                (total > 0.0 ? 100.0 * ws.busy_seconds / total : 0.0), ws.waits);
+    }
+    fprintf(out, "parser: waited %.2fs for free batches (%d waits)\n", m_parser_wait_seconds, m_parser_waits);
+}
@@ -9,6 +9,9 @@
 #include "counters.hpp"
 #include "mask.hpp"
 
+#include <stdio.h>
+#include <vector>
+
 
 class PairDB;
 
@@ -30,13 +33,25 @@ public:
     int mask;
     int L;
     int site;
-    Case() : pair_id(0), mask(MASK_NO_MATCH), L(-1), site(-1) {}
-    Case(const char * _id, const char * _r1, const char * _r2) : id(_id), pair_id(0), r1(&_r1[4]), r2(_r2), handle(_r1, 4), L(-1), site(-1), mask(MASK_NO_MATCH)  { }
-    Case(int _id, const char * _r1, const char * _r2) : pair_id(_id), r1(&_r1[4]), r2(_r2), handle(_r1, 4), L(-1), site(-1), mask(MASK_NO_MATCH)  { }
+    int multiplicity;
+    Case() : pair_id(0), mask(MASK_NO_MATCH), L(-1), site(-1), multiplicity(1) {}
+    Case(const char * _id, const char * _r1, const char * _r2) : id(_id), pair_id(0), r1(&_r1[4]), r2(_r2), handle(_r1, 4), L(-1), site(-1), mask(MASK_NO_MATCH), multiplicity(1)  { }
+    Case(int _id, const char * _r1, const char * _r2) : pair_id(_id), r1(&_r1[4]), r2(_r2), handle(_r1, 4), L(-1), site(-1), mask(MASK_NO_MATCH), multiplicity(1)  { }
     bool valid() const { return (L > 0) && (site >= 0) && (mask != MASK_NO_MATCH); }
 };
 
 
+// how a native worker thread spent its time (see worker.cpp)
+struct WorkerStats
+{
+    int pairs;
+    int batches;
+    int waits;              // number of times the worker found the queue empty
+    double busy_seconds;
+    double idle_seconds;
+};
+
+
 class Spats
 {
 public:
@@ -58,6 +73,10 @@ public:
     bool m_writeback;
     PairDB * m_writeback_db;
 
+    std::vector<WorkerStats> m_worker_stats;
+    int m_parser_waits;     // number of times the parser found the work queue full
+    double m_parser_wait_seconds;
+
     void setup();
     bool try_lookup_hit(FragmentResult * res, Fragment * r1, Fragment * r2, const char * handle, Counters * counters, Case * caseinfo);
 
@@ -67,14 +86,21 @@ public: // internal use only
 public:
 
     Spats(bool cotrans = false) : m_cotrans(cotrans),  m_r1l(NULL), m_r2l(NULL), m_cotrans_target(NULL),
-          m_pair_len(36), m_cotrans_minimum_length(20), m_counters(NULL), m_writeback(false), m_writeback_db(NULL)
+          m_pair_len(36), m_cotrans_minimum_length(20), m_counters(NULL), m_writeback(false), m_writeback_db(NULL),
+          m_parser_waits(0), m_parser_wait_seconds(0.0)
     {
         m_adapter_b = "AGATCGGAAGAGCACACGTCTGAACTCCAGTCAC";
         m_adapter_t_rc = reverse_complement("AATGATACGGCGACCACCGAGATCTACACTCTTTCCCTACACGACGCTCTTCCGATCT");
         m_linker = new Fragment("CTGACTCGGGCACCAAGGAC", 20);
     }
 
-    ~Spats() { }
+    ~Spats()
+    {
+        delete m_r1l;
+        delete m_r2l;
+        delete m_linker;
+        delete m_counters;
+    }
 
     inline void process_pair_data(const char * r1_path, const char * r2_path) { this->run_fastq(r1_path, r2_path); }
     void store(const char * path);
@@ -89,6 +115,7 @@ public:
     PairDB * writeback_db() const { return (m_writeback ? m_writeback_db : NULL); }
 
     int cotrans_minimum_length() const { return m_cotrans_minimum_length; }
+    void report_workers(FILE * out) const;
 
 };
 
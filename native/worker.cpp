@@ -1,51 +1,156 @@
 
-#include <unistd.h>
-#include <sys/time.h>
+#include <time.h>
 
 #include "worker.hpp"
 #include "db.hpp"
 
 
+static double
+seconds_now()
+{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (double)ts.tv_sec + (1e-9 * (double)ts.tv_nsec);
+}
+
+
+WorkQueue::WorkQueue() :
+    full_start(0), full_count(0), free_count(CQ_SIZE), finished(false), stopped(false),
+    producer_waits(0), producer_wait_seconds(0.0)
+{
+    pthread_mutex_init(&mutex, NULL);
+    pthread_cond_init(&not_empty, NULL);
+    pthread_cond_init(&not_full, NULL);
+    for (int i = 0; i < CQ_SIZE; ++i)
+        free[i] = i;
+}
+
+WorkQueue::~WorkQueue()
+{
+    pthread_cond_destroy(&not_full);
+    pthread_cond_destroy(&not_empty);
+    pthread_mutex_destroy(&mutex);
+}
+
+// returns an empty batch for the parser to fill, blocking until one
+// is available. returns NULL if parsing should stop.
+WorkBatch *
+WorkQueue::reserve()
+{
+    WorkBatch * batch = NULL;
+    pthread_mutex_lock(&mutex);
+    if (0 == free_count  &&  !stopped) {
+        ++producer_waits;
+        WORKER_TRACE("!");
+        double start = seconds_now();
+        while (0 == free_count  &&  !stopped)
+            pthread_cond_wait(&not_full, &mutex);
+        producer_wait_seconds += seconds_now() - start;
+    }
+    if (!stopped) {
+        batch = &batches[free[--free_count]];
+        batch->count = 0;
+    }
+    pthread_mutex_unlock(&mutex);
+    return batch;
+}
+
+void
+WorkQueue::submit(WorkBatch * batch)
+{
+    pthread_mutex_lock(&mutex);
+    full[(full_start + full_count) % CQ_SIZE] = (int)(batch - batches);
+    ++full_count;
+    pthread_cond_signal(&not_empty);
+    pthread_mutex_unlock(&mutex);
+    WORKER_TRACE("v");
+}
+
+void
+WorkQueue::finish()
+{
+    pthread_mutex_lock(&mutex);
+    finished = true;
+    pthread_cond_broadcast(&not_empty);
+    pthread_mutex_unlock(&mutex);
+}
+
+void
+WorkQueue::stop()
+{
+    pthread_mutex_lock(&mutex);
+    stopped = true;
+    pthread_cond_broadcast(&not_full);
+    pthread_mutex_unlock(&mutex);
+}
+
+// returns the next batch to process, blocking until one is available.
+// returns NULL once the queue is finished and drained.
+WorkBatch *
+Worker::take()
+{
+    WorkQueue * q = context->queue;
+    WorkBatch * batch = NULL;
+    pthread_mutex_lock(&q->mutex);
+    if (0 == q->full_count  &&  !q->finished) {
+        ++waits;
+        WORKER_TRACE("z");
+        double start = seconds_now();
+        while (0 == q->full_count  &&  !q->finished)
+            pthread_cond_wait(&q->not_empty, &q->mutex);
+        idle_seconds += seconds_now() - start;
+    }
+    if (q->full_count > 0) {
+        batch = &q->batches[q->full[q->full_start]];
+        q->full_start = (q->full_start + 1) % CQ_SIZE;
+        --q->full_count;
+    }
+    pthread_mutex_unlock(&q->mutex);
+    return batch;
+}
+
+void
+Worker::release(WorkBatch * batch)
+{
+    WorkQueue * q = context->queue;
+    pthread_mutex_lock(&q->mutex);
+    q->free[q->free_count++] = (int)(batch - q->batches);
+    pthread_cond_signal(&q->not_full);
+    pthread_mutex_unlock(&q->mutex);
+}
+
+
 void *
 worker_fn(void * arg)
 {
     Worker * w = (Worker *)arg;
     Fragment r1_frag;
     Fragment r2_frag;
-    size_t fragment_len = 0;
     Spats * spats = w->context->spats;
     PairDB * writeback = spats ? spats->writeback_db() : NULL;
     pair_handler handler = w->context->handler;
     Case c;
 
-    for (int i = 0; i < CQ_SIZE; ++i) {
-        w->items[i].r1chars[fragment_len] = 0;
-        w->items[i].r2chars[fragment_len] = 0;
-    }
-
-    while (0 == fragment_len) {
-        fragment_len = w->context->fragment_len;
-        usleep(10);
-    }
-
     WORKER_TRACE("WIN");
 
     while (true) {
-        while (true) {
-            WorkItem * wi = &w->items[w->start];
-            if (!wi->ready)
-                break;
+        WorkBatch * batch = w->take();
+        if (NULL == batch)
+            break;
+        double start = seconds_now();
+        // set before the first batch was submitted
+        size_t fragment_len = w->context->fragment_len;
+        bool res = true;
+        for (int i = 0; i < batch->count  &&  res; ++i) {
+            WorkItem * wi = &batch->items[i];
             ++w->count;
             /* handle it */
-            //printf("%s  --  %s\n", wi->r1chars, wi->r2chars);
             r1_frag.parse(&wi->r1chars[4], fragment_len - 4);
             r2_frag.parse(wi->r2chars, fragment_len);
-            //printf("%s  --  %s\n", r1_frag.string().c_str(), r2_frag.string().c_str());
             wi->r1chars[4] = 0;
             c.pair_id = wi->pair_id;
             c.L = c.site = -1;
             c.mask = MASK_NO_MATCH;
-            bool res = false;
             if (spats)
                 res = spats->spats_handler(&r1_frag, &r2_frag, wi->r1chars, w->counters, &c);
             else
@@ -54,21 +159,15 @@ worker_fn(void * arg)
                 ATS_VERBOSE("W: %d (%p)\n", c.pair_id, wi);
                 writeback->submit_result(&c);
             }
-            if (!res) {
-                w->done = true;
-                break;
-            }
             WORKER_TRACE("^");
-            wi->ready = false;
-            w->start = (w->start + 1) % CQ_SIZE;
         }
-        if (w->done)
+        w->busy_seconds += seconds_now() - start;
+        ++w->batches;
+        w->release(batch);
+        if (!res) {
+            w->context->queue->stop();
             break;
-        //sleep(1);
-        WORKER_TRACE("z");
-        ++w->empty_worker;
-
-        usleep(50); // this is highly tune-able based on the work done in handler...
+        }
     }
     return w;
 }
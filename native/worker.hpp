@@ -6,8 +6,9 @@
 #include "parse.hpp"
 
 #define FRAG_BUFFER_SIZE 40
-#define CQ_SIZE 512
+#define WORK_BATCH_SIZE 256
 #define NUM_WORKERS 6
+#define CQ_SIZE (4 * NUM_WORKERS)
 
 #if 0
 # define WORKER_TRACE(theStr) printf(theStr);
@@ -18,34 +19,72 @@
 
 struct WorkItem
 {
-    bool ready;
     char r1chars[FRAG_BUFFER_SIZE];
     char r2chars[FRAG_BUFFER_SIZE];
     int pair_id;
 };
 
+struct WorkBatch
+{
+    int count;
+    WorkItem items[WORK_BATCH_SIZE];
+};
+
+
+/* blocking producer/consumer queue of batches: the parser fills free
+ * batches and hands them off, and whichever worker is waiting takes
+ * the next one. nobody polls; both sides sleep on a condition
+ * variable when there's nothing for them to do.
+ */
+struct WorkQueue
+{
+    pthread_mutex_t mutex;
+    pthread_cond_t not_empty;
+    pthread_cond_t not_full;
+    WorkBatch batches[CQ_SIZE];
+    int full[CQ_SIZE];      // ring of indices of batches ready for the workers
+    int full_start;
+    int full_count;
+    int free[CQ_SIZE];      // stack of indices of batches available to the parser
+    int free_count;
+    bool finished;          // no more batches coming
+    bool stopped;           // a handler asked to stop parsing
+    int producer_waits;     // number of times the parser had to wait for a free batch
+    double producer_wait_seconds;
+
+    WorkQueue();
+    ~WorkQueue();
+
+    WorkBatch * reserve();
+    void submit(WorkBatch * batch);
+    void finish();
+    void stop();
+};
+
 
 struct WorkContext
 {
     pair_handler handler;
     Spats * spats;
     size_t fragment_len;
+    WorkQueue * queue;
 };
 
 struct Worker
 {
     WorkContext * context;
     int id;
-    bool done;
     pthread_t thread;
-    pthread_mutex_t mutex;
-    pthread_cond_t cond;
-    WorkItem items[CQ_SIZE];
-    int start;
-    int end;
-    int empty_worker;
-    int count;
     Counters * counters;
+    // idle/busy accounting, see WorkerStats
+    int count;
+    int batches;
+    int waits;
+    double busy_seconds;
+    double idle_seconds;
+
+    WorkBatch * take();
+    void release(WorkBatch * batch);
 };
 
 void *
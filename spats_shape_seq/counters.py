@@ -1,18 +1,131 @@
+from timing import time_stages
+
+# kinds of per-site vectors kept for each (target, mask, end)
+_STOPS = 0
+_MUTS = 1
+_REMOVED_MUTS = 2
+_EDGE_MUTS = 3
+_INSERTS = 4
+_DELETES = 5
+_NUM_KINDS = 6
 
 def _dict_incr(d, key, m = 1):
     d[key] = d.get(key, 0) + m
 
+def _site_label(kind, index):
+    # the site portion of the registered_dict() keys
+    if _STOPS == kind:
+        return str(index)
+    elif _MUTS == kind:
+        return "M{}".format(index)
+    elif _REMOVED_MUTS == kind:
+        return "Mq{}".format(index)
+    elif _EDGE_MUTS == kind:
+        return "S{}M{}".format(index, index + 1)
+    elif _INSERTS == kind:
+        return "I{}".format(index)
+    return "D{}".format(index)
+
+def _parse_site_label(label):
+    if label.isdigit():
+        return _STOPS, int(label)
+    for kind, prefix in ( (_REMOVED_MUTS, "Mq"), (_MUTS, "M"), (_INSERTS, "I"), (_DELETES, "D") ):
+        if label.startswith(prefix) and label[len(prefix):].isdigit():
+            return kind, int(label[len(prefix):])
+    if label.startswith("S"):
+        site, _, mut = label[1:].partition("M")
+        if site.isdigit() and mut.isdigit() and int(mut) == int(site) + 1:
+            return _EDGE_MUTS, int(site)
+    return None
+
+# counters that are incremented once per processed pair, regardless of multiplicity
+_PER_PAIR_COUNTS = frozenset([ 'edge_muts', 'dna_residual_pairs', 'low_quality_muts' ])
+_PER_PAIR_PREFIXES = ( 'rt_primer_', )
+
+def _is_per_pair_count(key):
+    return key in _PER_PAIR_COUNTS or key.startswith(_PER_PAIR_PREFIXES)
+
+# stage timing keys (see timing.py): total ns, and number of calls
+_STAGE_PREFIX = '_stage_'
+_STAGE_NS_PREFIX = '_stage_ns_'
+_STAGE_CALLS_PREFIX = '_stage_calls_'
+
+def _parse_rowid(rowid):
+    return None if rowid == "None" else int(rowid)
+
+
+class _DepthVector(object):
+    # depths kept as a difference array: counting a pair that covers
+    # [start, end) is O(1), and the cumulative sums are only computed
+    # (and cached) when the values are needed
+
+    def __init__(self, n):
+        self._diffs = [0] * (n + 1)
+        self._values = None
+
+    def __len__(self):
+        return len(self._diffs) - 1
+
+    def grow(self, n):
+        if n > len(self):
+            self._diffs.extend([0] * (n - len(self)))
+
+    def add_range(self, start, end, m):
+        if start < 0:
+            # same as indexing a list from the back
+            self.add_range(len(self) + start, len(self), m)
+            start = 0
+        self._diffs[start] += m
+        self._diffs[end] -= m
+        self._values = None
+
+    def add(self, their_values):
+        self.grow(len(their_values))
+        diffs = self._diffs
+        prev = 0
+        for i, their_value in enumerate(their_values):
+            diffs[i] += their_value - prev
+            prev = their_value
+        diffs[len(their_values)] -= prev
+        self._values = None
+
+    def values(self):
+        if self._values is None:
+            values = []
+            cur = 0
+            for diff in self._diffs[:-1]:
+                cur += diff
+                values.append(cur)
+            self._values = values
+        return self._values
+
+
+class _EndCounts(object):
+    # dense vectors for a single (target, mask, end), indexed by site;
+    # each is only allocated once something is counted in it
+
+    def __init__(self):
+        self.sites = [ None ] * _NUM_KINDS
+        self.depths = None
+        self.quality_depths = None
+
+
 class Counters(object):
 
     def __init__(self, run = None):
         self._run = run
         self.reset()
+        if run and run.stage_timing:
+            time_stages(self, [ ('register_count', 'register') ], self.add_stage_time)
 
     def reset(self):
         self._counts = {}
-        self._registered = {}
-        self._depths = {}
-        self._quality_depths = {}
+        # (target rowid, mask index, end) -> _EndCounts
+        self._ends = {}
+        self._mask_indices = {}
+        self._mask_labels = []
+        # registered counts that don't fit in the vectors (e.g., negative sites), by string key
+        self._other_registered = {}
 
     def __getattr__(self, key):
         if key.startswith('_'):
@@ -30,32 +143,53 @@ class Counters(object):
         return { key : value for key, value in self._counts.iteritems() if not key.startswith('_') }
 
     def registered_dict(self):
-        return self._registered
-
-    def _count_key(self, pair):
-        return "{}:{}:{}:{}".format(pair.target.rowid, pair.mask_label, pair.site, pair.end)
-
-    def _depth_key(self, pair):
-        return "{}:{}:{}".format(pair.target.rowid, pair.mask_label, pair.end)
-
-    def _mut_key(self, pair, mut):
-        return "{}:{}:M{}:{}".format(pair.target.rowid, pair.mask_label, mut, pair.end)
-
-    def _low_quality_mut_key(self, pair):
-        return "{}:{}:Mq{}:{}".format(pair.target.rowid, pair.mask_label, pair.site, pair.end)
-
-    def _mut_edge_key(self, pair, mut):
-        return "{}:{}:S{}M{}:{}".format(pair.target.rowid, pair.mask_label, pair.site, mut, pair.end)
-
-    def _indel_key(self, pair, spot, indel):
-        # treat indels as 1-based (like mutations) for reactivity computations
-        if indel.insert_type:
-            # use same convention as ShapeMapper2 for inserts: count prior to the insert
-            return "{}:{}:I{}:{}".format(pair.target.rowid, pair.mask_label, spot, pair.end)
-        else:
-            return "{}:{}:D{}:{}".format(pair.target.rowid, pair.mask_label, spot + 1, pair.end)
+        registered = dict(self._other_registered)
+        labels = self._mask_labels
+        for (rowid, mask_index, end), ec in self._ends.iteritems():
+            prefix = "{}:{}:".format(rowid, labels[mask_index])
+            suffix = ":{}".format(end)
+            for kind, vect in enumerate(ec.sites):
+                if vect:
+                    for index, value in enumerate(vect):
+                        if value:
+                            registered[prefix + _site_label(kind, index) + suffix] = value
+        return registered
+
+    def _mask_index(self, mask_label):
+        mask_index = self._mask_indices.get(mask_label)
+        if mask_index is None:
+            mask_index = len(self._mask_labels)
+            self._mask_indices[mask_label] = mask_index
+            self._mask_labels.append(mask_label)
+        return mask_index
+
+    def _end_counts(self, rowid, mask_label, end):
+        key = (rowid, self._mask_index(mask_label), end)
+        ec = self._ends.get(key)
+        if ec is None:
+            ec = _EndCounts()
+            self._ends[key] = ec
+        return ec
+
+    def _find_end_counts(self, rowid, mask_label, end):
+        mask_index = self._mask_indices.get(mask_label)
+        return None if mask_index is None else self._ends.get((rowid, mask_index, end))
+
+    def _register(self, ec, kind, index, m, rowid, mask_label, end):
+        if index < 0:
+            _dict_incr(self._other_registered, "{}:{}:{}:{}".format(rowid, mask_label, _site_label(kind, index), end), m)
+            return
+        vect = ec.sites[kind]
+        if vect is None:
+            vect = [ 0 ] * (max(index, end) + 1)
+            ec.sites[kind] = vect
+        elif index >= len(vect):
+            vect.extend([ 0 ] * (index + 1 - len(vect)))
+        vect[index] += m
 
     def register_count(self, pair):
+        rowid, mask_label, end = pair.target.rowid, pair.mask_label, pair.end
+        ec = self._end_counts(rowid, mask_label, end)
         if pair.mutations:
             for mut in pair.mutations:
                 # TODO:  count mutations and indels at end as well as start
@@ -67,7 +201,7 @@ class Counters(object):
                     self.edge_muts += 1
                     if count_muts == 'stop_and_mut':
                         pair.edge_mut = 'stop_and_mut'
-                        _dict_incr(self._registered, self._mut_key(pair, mut), pair.multiplicity)
+                        self._register(ec, _MUTS, mut, pair.multiplicity, rowid, mask_label, end)
                         self.mutations += pair.multiplicity
                         _dict_incr(self._counts, pair.mask_label + "_mut", pair.multiplicity)
                     elif count_muts == 'stop_only':
@@ -78,17 +212,22 @@ class Counters(object):
                         pair.edge_mut = 'ignore'
                         return
                 else:
-                    _dict_incr(self._registered, self._mut_key(pair, mut), pair.multiplicity)
+                    self._register(ec, _MUTS, mut, pair.multiplicity, rowid, mask_label, end)
                     self.mutations += pair.multiplicity
                     _dict_incr(self._counts, pair.mask_label + "_mut", pair.multiplicity)
         if pair.removed_mutations:
             for mut in pair.removed_mutations:
-                _dict_incr(self._registered, self._low_quality_mut_key(pair), pair.multiplicity)
+                self._register(ec, _REMOVED_MUTS, pair.site, pair.multiplicity, rowid, mask_label, end)
         if pair.r1.indels or pair.r2.indels:
-            # only count one indel at a spot per pair 
+            # only count one indel at a spot per pair
             for spot in set(pair.r1.indels.keys() + pair.r2.indels.keys()):
                 indel = pair.r1.indels.get(spot, pair.r2.indels.get(spot))   # assumes types and length match at spot
-                _dict_incr(self._registered, self._indel_key(pair, spot, indel), pair.multiplicity)
+                # treat indels as 1-based (like mutations) for reactivity computations
+                if indel.insert_type:
+                    # use same convention as ShapeMapper2 for inserts: count prior to the insert
+                    self._register(ec, _INSERTS, spot, pair.multiplicity, rowid, mask_label, end)
+                else:
+                    self._register(ec, _DELETES, spot + 1, pair.multiplicity, rowid, mask_label, end)
                 _dict_incr(self._counts, pair.mask_label + "_indels", pair.multiplicity)
                 _dict_incr(self._counts, 'mapped_indel_len_{}'.format(len(indel.seq)), pair.multiplicity)
                 self.indels += pair.multiplicity
@@ -104,8 +243,8 @@ class Counters(object):
                 self.ambiguous_indels_pair += pair.multiplicity
             self.r1_indels += (pair.multiplicity * len(pair.r1.indels))
             self.r2_indels += (pair.multiplicity * len(pair.r2.indels))
-        _dict_incr(self._registered, self._count_key(pair), pair.multiplicity)
-        self._add_to_depth(pair)
+        self._register(ec, _STOPS, pair.site, pair.multiplicity, rowid, mask_label, end)
+        self._add_to_depth(pair, ec)
         self.registered_pairs += pair.multiplicity
         _dict_incr(self._counts, pair.mask_label + "_kept", pair.multiplicity)
         # TODO: find and count complex indel where subst and repl lens may not match (will always be ambiguous?)
@@ -118,13 +257,108 @@ class Counters(object):
     def increment_key(self, counter_key, multiplicity = 1):
         _dict_incr(self._counts, counter_key, multiplicity)
 
-    def _add_to_depth(self, pair):
-        dk = self._depth_key(pair)
-        n = min(pair.target.n, pair.end) + 1
-        for spot in xrange(pair.site, n):
-            self._depths.setdefault(dk, [0] * n)[spot] += pair.multiplicity
-            if not pair.removed_mutations:
-                self._quality_depths.setdefault(dk, [0] * n)[spot] += pair.multiplicity
+    def register_stops(self, target, mask_label, end, site, multiplicity):
+        """Same as register_count() for multiplicity pairs at site/end
+        without any mutations or indels.
+        """
+        ec = self._end_counts(target.rowid, mask_label, end)
+        self._register(ec, _STOPS, site, multiplicity, target.rowid, mask_label, end)
+        self._add_depth_range(ec, target.n, end, site, multiplicity, True)
+        self.registered_pairs += multiplicity
+        _dict_incr(self._counts, mask_label + "_kept", multiplicity)
+
+    def register_site_vectors(self, target, mask_label, end, stops, quality_stops, muts, removed_muts):
+        """Same as register_count() for all of the pairs at end without
+        indels, given as per-site vectors: the stops, the stops of pairs
+        without removed mutations, the mutations, and the removed mutations.
+        """
+        rowid = target.rowid
+        ec = self._end_counts(rowid, mask_label, end)
+        registered = 0
+        for site, count in enumerate(stops):
+            if count:
+                self._register(ec, _STOPS, site, count, rowid, mask_label, end)
+                quality = quality_stops[site]
+                if count > quality:
+                    self._add_depth_range(ec, target.n, end, site, count - quality, False)
+                if quality:
+                    self._add_depth_range(ec, target.n, end, site, quality, True)
+                registered += count
+        mutations = 0
+        for mut, count in enumerate(muts):
+            if count:
+                self._register(ec, _MUTS, mut, count, rowid, mask_label, end)
+                mutations += count
+        for site, count in enumerate(removed_muts):
+            if count:
+                self._register(ec, _REMOVED_MUTS, site, count, rowid, mask_label, end)
+        if mutations:
+            self.mutations += mutations
+            _dict_incr(self._counts, mask_label + "_mut", mutations)
+        if registered:
+            self.registered_pairs += registered
+            _dict_incr(self._counts, mask_label + "_kept", registered)
+
+    def replay(self, recording, multiplicity):
+        """Adds the counts from a :meth:`CountsRecorder.recording`, as if
+        the pair had been processed with the given multiplicity.
+        """
+        counts, ops = recording
+        my_counts = self._counts
+        for key, value, scaled in counts:
+            my_counts[key] = my_counts.get(key, 0) + (value * multiplicity if scaled else value)
+        for op in ops:
+            rowid, mask_label, end = op[1]
+            ec = self._end_counts(rowid, mask_label, end)
+            if op[0]:
+                self._add_depth_range(ec, op[2], end, op[3], op[4] * multiplicity, op[5])
+            else:
+                self._register(ec, op[2], op[3], op[4] * multiplicity, rowid, mask_label, end)
+
+    def add_stage_time(self, stage, seconds):
+        counts = self._counts
+        key = _STAGE_NS_PREFIX + stage
+        counts[key] = counts.get(key, 0) + int(seconds * 1e9)
+        key = _STAGE_CALLS_PREFIX + stage
+        counts[key] = counts.get(key, 0) + 1
+
+    def add_stage_times(self, other):
+        """Adds the stage times from other (e.g., a
+        :class:`CountsRecorder`, whose recording leaves them out).
+        """
+        for key, value in other._counts.iteritems():
+            if key.startswith(_STAGE_PREFIX):
+                _dict_incr(self._counts, key, value)
+
+    def stage_times(self):
+        """Returns ``{ stage : (seconds, calls) }`` for the stages timed
+        with :attr:`.run.Run.stage_timing`, summed over all workers.
+        """
+        res = {}
+        for key, value in self._counts.iteritems():
+            if key.startswith(_STAGE_NS_PREFIX):
+                stage = key[len(_STAGE_NS_PREFIX):]
+                res[stage] = (float(value) / 1e9, self._counts.get(_STAGE_CALLS_PREFIX + stage, 0))
+        return res
+
+    def _add_to_depth(self, pair, ec):
+        self._add_depth_range(ec, pair.target.n, pair.end, pair.site, pair.multiplicity, not pair.removed_mutations)
+
+    def _add_depth_range(self, ec, target_n, end, site, m, quality):
+        n = min(target_n, end) + 1
+        if site >= n:
+            return
+        if ec.depths is None:
+            ec.depths = _DepthVector(n)
+        else:
+            ec.depths.grow(n)
+        ec.depths.add_range(site, n, m)
+        if quality:
+            if ec.quality_depths is None:
+                ec.quality_depths = _DepthVector(n)
+            else:
+                ec.quality_depths.grow(n)
+            ec.quality_depths.add_range(site, n, m)
 
     def register_prefix(self, prefix, pair):
         self.increment_key('prefix_{}_{}'.format(pair.mask_label, prefix), pair.multiplicity)
@@ -138,22 +372,51 @@ class Counters(object):
     def register_mapped_mut_count(self, pair):
         self.increment_key('mapped_mut_count_{}'.format(len(pair.mutations) if pair.mutations else 0), pair.multiplicity)
 
+    def _depth_dicts(self):
+        depths = {}
+        quality_depths = {}
+        labels = self._mask_labels
+        for (rowid, mask_index, end), ec in self._ends.iteritems():
+            dk = "{}:{}:{}".format(rowid, labels[mask_index], end)
+            if ec.depths is not None:
+                depths[dk] = ec.depths.values()
+            if ec.quality_depths is not None:
+                quality_depths[dk] = ec.quality_depths.values()
+        return depths, quality_depths
+
     def count_data(self):
-        return (self._counts, self._registered), (self._depths, self._quality_depths)
+        return (self._counts, self.registered_dict()), self._depth_dicts()
 
     def update_with_count_data(self, count_data, vect_data):
         their_counts, their_registered = count_data
         for key, their_value in their_counts.iteritems():
             _dict_incr(self._counts, key, their_value)
         for key, their_value in their_registered.iteritems():
-            _dict_incr(self._registered, key, their_value)
+            bits = key.split(':')
+            parsed = _parse_site_label(bits[2]) if 4 == len(bits) else None
+            if parsed:
+                rowid, end = _parse_rowid(bits[0]), int(bits[3])
+                ec = self._end_counts(rowid, bits[1], end)
+                self._register(ec, parsed[0], parsed[1], their_value, rowid, bits[1], end)
+            else:
+                _dict_incr(self._other_registered, key, their_value)
         their_depths, their_quality_depths = vect_data
         for key, their_values in their_depths.iteritems():
-            for i, their_value in enumerate(their_values):
-                self._depths.setdefault(key, [0] * len(their_values))[i] += their_value
+            ec = self._end_counts_for_depth_key(key)
+            if ec.depths is None:
+                ec.depths = _DepthVector(len(their_values))
+            ec.depths.add(their_values)
         for key, their_values in their_quality_depths.iteritems():
-            for i, their_value in enumerate(their_values):
-                self._quality_depths.setdefault(key, [0] * len(their_values))[i] += their_value
+            ec = self._end_counts_for_depth_key(key)
+            if ec.quality_depths is None:
+                ec.quality_depths = _DepthVector(len(their_values))
+            ec.quality_depths.add(their_values)
+
+    def _end_counts_for_depth_key(self, key):
+        bits = key.split(':')
+        if 3 != len(bits):
+            raise Exception("Invalid depth key: {}".format(key))
+        return self._end_counts(_parse_rowid(bits[0]), bits[1], int(bits[2]))
 
     def mask_total(self, mask):
         if mask.empty_place_holder:
@@ -169,67 +432,109 @@ class Counters(object):
 
     def target_total(self, target):
         total = 0
-        for key, value in self._registered.items():
+        for (rowid, mask_index, end), ec in self._ends.iteritems():
+            if rowid == target.rowid:
+                total += sum(sum(vect) for vect in ec.sites if vect)
+        for key, value in self._other_registered.items():
             if key.startswith("{}:".format(target.rowid)):
                 total += value
         return total
 
+    def _site_vector(self, target, mask, end, kind):
+        ec = self._find_end_counts(target.rowid, mask, end)
+        vect = ec.sites[kind] if ec else None
+        if not vect:
+            return [0] * (end + 1)
+        res = vect[:end + 1]
+        if len(res) < end + 1:
+            res.extend([0] * (end + 1 - len(res)))
+        return res
+
     def mask_counts(self, target, mask, end):
-        c = self._registered
-        return [ c.get("{}:{}:{}:{}".format(target.rowid, mask, site, end), 0) for site in xrange(end + 1) ]
+        return self._site_vector(target, mask, end, _STOPS)
 
     def mask_depths(self, target, mask, end):
-        return self._depths.get("{}:{}:{}".format(target.rowid, mask, end), [0] * (end + 1))
+        ec = self._find_end_counts(target.rowid, mask, end)
+        return list(ec.depths.values()) if ec and ec.depths is not None else [0] * (end + 1)
 
     def mask_quality_depths(self, target, mask, end):
-        return self._quality_depths.get("{}:{}:{}".format(target.rowid, mask, end), [0] * (end + 1))
+        ec = self._find_end_counts(target.rowid, mask, end)
+        return list(ec.quality_depths.values()) if ec and ec.quality_depths is not None else [0] * (end + 1)
 
     def mask_muts(self, target, mask, end):
-        c = self._registered
-        return [ c.get("{}:{}:M{}:{}".format(target.rowid, mask, site, end), 0) for site in xrange(end + 1) ]
+        return self._site_vector(target, mask, end, _MUTS)
 
     def mask_edge_muts(self, target, mask, end):
-        c = self._registered
-        return [ c.get("{}:{}:S{}M{}:{}".format(target.rowid, mask, site, site + 1, end), 0) for site in xrange(end + 1) ]
+        return self._site_vector(target, mask, end, _EDGE_MUTS)
 
     def mask_removed_muts(self, target, mask, end):
-        c = self._registered
-        return [ c.get("{}:{}:Mq{}:{}".format(target.rowid, mask, site, end), 0) for site in xrange(end + 1) ]
+        return self._site_vector(target, mask, end, _REMOVED_MUTS)
 
     def mask_inserts(self, target, mask, end):
-        c = self._registered
-        return [ c.get("{}:{}:I{}:{}".format(target.rowid, mask, site, end), 0) for site in xrange(end + 1) ]
+        return self._site_vector(target, mask, end, _INSERTS)
 
     def mask_deletes(self, target, mask, end):
-        c = self._registered
-        return [ c.get("{}:{}:D{}:{}".format(target.rowid, mask, site, end), 0) for site in xrange(end + 1) ]
+        return self._site_vector(target, mask, end, _DELETES)
+
+    def _site_value(self, target_id, mask, end, site, kind):
+        ec = self._find_end_counts(target_id, mask, end)
+        vect = ec.sites[kind] if ec else None
+        return vect[site] if vect and 0 <= site < len(vect) else 0
 
     def site_count(self, target_id, mask, end, site):
-        return self._registered.get("{}:{}:{}:{}".format(target_id, mask, site, end), 0)
+        return self._site_value(target_id, mask, end, site, _STOPS)
 
     def site_mut_count(self, target_id, mask, end, site):
-        return self._registered.get("{}:{}:M{}:{}".format(target_id, mask, site, end), 0)
+        return self._site_value(target_id, mask, end, site, _MUTS)
 
     def load_from_db_data(self, data):
-        c = self._registered
+        loaded = set()
         for r in data:
-            c["{}:{}:{}:{}".format(r[0], r[1], r[2], r[3])] = r[4]
-            if r[2].isdigit():    # only add to depth if it's the count_key
-                n = r[3]
-                dk = "{}:{}:{}".format(r[0], r[1], r[3])
-                for spot in xrange(r[2], r[3] + 1):
-                    curdepths = self._depths.setdefault(dk, [0] * n)
-                    if n > len(curdepths):
-                        curdepths += [0] * (n - len(curdepths))
-                    curdepths[spot] += r[4]
-                # WARNING: The quality depths here are potentially
-                # wrong, since we don't track low quality muts/pairs
-                # in the Results or Pairs db tables.
-                # Rather than leave uninitialized we consider all
-                # pairs to have been of high enough quality (or that
-                # the run was done with the run options of
-                # `mutations_require_quality_score` set to None).
-                # TAI:  If the viz tool ever gets more play, we should
-                # probably track low_quality_muts in the Pairs db table.
-                self._quality_depths[dk] = list(self._depths[dk])
+            rowid, mask_label, site, end, count = r
+            ec = self._end_counts(rowid, mask_label, end)
+            loaded.add(ec)
+            self._register(ec, _STOPS, site, count, rowid, mask_label, end)
+            if ec.depths is None:
+                ec.depths = _DepthVector(end + 1)
+            else:
+                ec.depths.grow(end + 1)
+            ec.depths.add_range(max(site, 0), end + 1, count)
+            # WARNING: The quality depths here are potentially
+            # wrong, since we don't track low quality muts/pairs
+            # in the Results or Pairs db tables.
+            # Rather than leave uninitialized we consider all
+            # pairs to have been of high enough quality (or that
+            # the run was done with the run options of
+            # `mutations_require_quality_score` set to None).
+            # TAI:  If the viz tool ever gets more play, we should
+            # probably track low_quality_muts in the Pairs db table.
+        for ec in loaded:
+            if ec.depths is not None:
+                ec.quality_depths = _DepthVector(len(ec.depths))
+                ec.quality_depths.add(ec.depths.values())
+
+
+class CountsRecorder(Counters):
+    """Stands in for :class:`Counters` while processing a single pair
+    (with multiplicity ``1``), recording what gets counted so that it
+    can be replayed for other occurrences of the pair via
+    :meth:`Counters.replay`.
+    """
+
+    def reset(self):
+        Counters.reset(self)
+        self._ops = []
+
+    def _end_counts(self, rowid, mask_label, end):
+        return (rowid, mask_label, end)
+
+    def _register(self, ec, kind, index, m, rowid, mask_label, end):
+        self._ops.append((False, ec, kind, index, m))
+
+    def _add_depth_range(self, ec, target_n, end, site, m, quality):
+        self._ops.append((True, ec, target_n, site, m, quality))
 
+    def recording(self):
+        # stage times are only for when the pair was actually
+        # processed, so they're left out; see add_stage_times()
+        return ([ (key, value, not _is_per_pair_count(key)) for key, value in self._counts.iteritems() if not key.startswith(_STAGE_PREFIX) ], self._ops)
@@ -0,0 +1,147 @@
+
+#
+# hybrid (tiered) algorithm implementation
+#
+# general idea: the lookup algorithm is much faster than find_partial,
+# but can't handle everything (variable-length reads, indels, more
+# than a couple of errors, ...). and in real data, most pairs are
+# exact matches, which lookup handles just fine. so: try an exact-match
+# lookup first, and only send the pairs that miss on to find_partial.
+#
+# the catch is that the registered counts should be the same as with
+# find_partial alone, and the two algorithms don't always agree on
+# pairs that both of them handle. so a lookup hit is only taken when
+# find_partial is sure to come to the same answer:
+#
+# - the pair is an exact match, including any adapter, so there's
+#   nothing for find_partial to align or trim differently.
+#
+# - both the R1 and R2 target parts are at least
+#   minimum_target_match_length long (find_partial won't match
+#   anything shorter).
+#
+# - no other spot in any target could match as well. find_partial
+#   takes the longest exact match of the read, which may run into the
+#   adapter (or handle) part of it, so this requires that what's left
+#   of the target part, after taking off as much as the longest
+#   stretch of adapter that occurs in any target, still only occurs
+#   once in all of the targets. (for R2, only once in the R1 target,
+#   since that's the only one find_partial searches.) see
+#   Targets.unique_lengths().
+#
+# everything else (lookup misses, multiple hits, mutations, short
+# matches, pairs whose R1 and R2 lengths differ) is reset and goes
+# through find_partial as usual. the lookup_tier_pairs and
+# find_partial_tier_pairs counters keep track of how many went which
+# way.
+#
+
+from lookup import LookupProcessor
+from partial import PartialFindProcessor
+from util import _warn, reverse_complement
+
+
+def _longest_common_length(seq, targets):
+    # length of the longest substring of seq that occurs in any of the targets
+    longest = 0
+    for start in xrange(len(seq)):
+        while start + longest < len(seq) and any(seq[start:start + longest + 1] in target.seq for target in targets):
+            longest += 1
+    return longest
+
+
+class HybridProcessor(PartialFindProcessor, LookupProcessor):
+
+    # the lookup tier only takes exact matches
+    _lookup_mutations = False
+
+    _timed_stages = PartialFindProcessor._timed_stages + ( ('_match_lookup_hit', 'lookup'), )
+
+    def prepare(self):
+        PartialFindProcessor.prepare(self)
+        run = self._run
+        targets = self._targets
+        self._unique_lengths = targets.unique_lengths()
+        self._r2_unique_lengths = targets.unique_lengths(per_target = True)
+        if not self._unique_lengths:
+            _warn("Targets are not all ACGT, so all pairs will be processed with find_partial.")
+            return
+        self._r1_adapter_match = _longest_common_length(reverse_complement(run.adapter_b), targets.targets)
+        self._r1_adapter_start = reverse_complement(run.adapter_b[:1])
+        self._r2_adapter_match = _longest_common_length(self._adapter_t_rc, targets.targets)
+        self._prepare_lookups()
+
+    def _pair_steps(self, pair):
+        if not self._check_indeterminate(pair) or not self._match_mask(pair):
+            return None
+        if self._lookup_pair(pair):
+            self.counters.lookup_tier_pairs += pair.multiplicity
+            return None
+        self.counters.find_partial_tier_pairs += pair.multiplicity
+        self._reset_pair(pair)
+        return self._masked_pair_steps(pair)
+
+    def _reset_pair(self, pair):
+        # back to how it was after the mask match
+        mask, r1_quality, r2_quality = pair.mask, pair.r1.quality, pair.r2.quality
+        pair.set_from_data(pair.identifier, pair.r1.original_seq, pair.r2.original_seq, pair.multiplicity)
+        pair.r1.quality = r1_quality
+        pair.r2.quality = r2_quality
+        pair.set_mask(mask)
+
+    def _lookup_pair(self, pair):
+        # returns True if the pair was taken care of by the lookup tier
+        run = self._run
+        length = pair.r1.original_len
+        if not self._unique_lengths  or  pair.r2.original_len != length:
+            return False
+        if length != self._lookup_length  and  not self._use_lookups(length):
+            return False
+        r1_res = self._targets.lookup_r1(pair.r1.original_seq[pair.mask.length():])
+        if not r1_res  or  len(r1_res) > 1:
+            return False
+        if not self._match_lookup_hit(pair, r1_res[0])  or  not self._matches_find_partial(pair):
+            return False
+
+        # the counts find_partial would have made along the way
+        masklen = pair.mask.length()
+        if run.adapter_b  and  -1 != pair.r1.original_seq.rfind(run.adapter_b, masklen + run.minimum_target_match_length):
+            self.counters.adapter_trimmed += pair.multiplicity
+        if pair.r2.original_len - pair.r2.match_len > masklen:
+            self.counters.adapter_trimmed += pair.multiplicity
+        if run.count_mutations:
+            self.counters.register_mut_count(pair)
+
+        self._register_lookup_hit(pair)
+        if pair.has_site and run.count_mutations:
+            self.counters.register_mapped_mut_count(pair)
+        return True
+
+    def _matches_find_partial(self, pair):
+        # see the notes at the top
+        if pair.mutations or pair.r1.match_errors or pair.r2.match_errors or pair.r1.adapter_errors or pair.r2.adapter_errors:
+            return False
+        target = pair.target
+        min_len = self._run.minimum_target_match_length
+        masklen = pair.mask.length()
+
+        r1_len = pair.r1.match_len
+        r1_start = target.n - r1_len
+        if pair.r1.original_len - masklen > r1_len:
+            # adapter on R1; also, if the target could be extended into
+            # it, find_partial would have a longer match
+            adapter_match = self._r1_adapter_match
+            if r1_start > 0  and  target.seq[r1_start - 1] == self._r1_adapter_start:
+                return False
+        else:
+            adapter_match = 0
+        if r1_len < min_len  or  self._unique_lengths[target.name][r1_start] > r1_len - adapter_match:
+            return False
+
+        r2_len = pair.r2.match_len
+        site = pair.r2.match_index
+        # the handle and then the adapter follow the target on R2
+        tail_match = (masklen + self._r2_adapter_match) if pair.r2.original_len > r2_len else 0
+        if r2_len < min_len  or  r2_len <= tail_match  or  self._r2_unique_lengths[target.name][site + tail_match] > r2_len - tail_match:
+            return False
+        return True
@@ -43,21 +43,66 @@
 #   dictionary lookups and a few string compares, so it's very
 #   fast. see _try_lookup_hit() below for details.
 #
+# variable-length reads:
+#
+# - the R1 keys are the whole of R1[4:], so the tables only work for
+#   one read length. for pre-trimmed (variable-length) data, there's
+#   a set of tables for each R1 length, built the first time that
+#   length comes up, and kept around for when it comes up again (see
+#   _use_lookups()). R2 only needs to be long enough for its lookup.
+#   with count_mutations and many targets, that's a lot of tables, so
+#   compact_lookup_tables (or mmap_lookup_tables) is a good idea there.
+#
+# - reads too short to build tables for (see
+#   Targets.minimum_lookup_length) are failed as nomatch.
+#
 
 from processor import PairProcessor, Failures
 from util import _warn, _debug, reverse_complement, string_match_errors
 
 class LookupProcessor(PairProcessor):
 
+    _timed_stages = PairProcessor._timed_stages + ( ('_match_lookup_hit', 'lookup'), )
+
+    # passed on to Targets.build_lookups (None for the run's count_mutations)
+    _lookup_mutations = None
+
     def prepare(self):
         targets = self._targets
-        targets.index()
-        targets.build_lookups(self._run, length = self._run.pair_length)
-        if not self._run.quiet:
+        targets.index(packed = self._run.packed_target_index)
+        self._prepare_lookups()
+
+    def _prepare_lookups(self):
+        run = self._run
+        targets = self._targets
+        self._lookup_tables = {}
+        self._lookup_length = None
+        self._minimum_lookup_length = targets.minimum_lookup_length(run, self._lookup_mutations)
+        # a negative pair_length means variable-length reads; the tables are then built as needed
+        if run.pair_length > 0  and  self._use_lookups(run.pair_length)  and  not run.quiet:
             print("Lookup table: {} R1 entries, {} R2 entries for {} targets.".format(len(targets.r1_lookup),
                                                                                       sum(map(len, targets.r2_lookup.values())),
                                                                                       len(targets.r2_lookup)))
 
+    def _use_lookups(self, length):
+        # sets up the tables for reads of the given length, building them
+        # if they haven't been yet; returns False if it's too short. (the
+        # minimum is on the safe side, so the run's own pair_length is
+        # always tried, as it was before variable lengths.)
+        if length == self._lookup_length:
+            return True
+        targets = self._targets
+        tables = self._lookup_tables.get(length)
+        if tables is None:
+            if length < self._minimum_lookup_length  and  length != self._run.pair_length:
+                return False
+            targets.build_lookups(self._run, length = length, mutations = self._lookup_mutations)
+            self._lookup_tables[length] = targets.lookup_tables()
+        else:
+            targets.set_lookup_tables(tables)
+        self._lookup_length = length
+        return True
+
 
     #@profile
     def process_pair(self, pair):
@@ -65,6 +110,10 @@ class LookupProcessor(PairProcessor):
         if not self._match_mask(pair):
             return
 
+        if pair.r1.original_len != self._lookup_length  and  not self._use_lookups(pair.r1.original_len):
+            pair.failure = Failures.nomatch
+            return
+
         r1_res = self._targets.lookup_r1(pair.r1.original_seq[pair.mask.length():])
         if not r1_res:
             pair.failure = Failures.nomatch
@@ -81,8 +130,15 @@ class LookupProcessor(PairProcessor):
             if pair.has_site:
                 return
 
-    #@profile
     def _try_lookup_hit(self, pair, r1_res):
+        if self._match_lookup_hit(pair, r1_res):
+            self._register_lookup_hit(pair)
+
+    #@profile
+    def _match_lookup_hit(self, pair, r1_res):
+        # fills in the match for the hit, leaving the registration to
+        # _register_lookup_hit; returns False (with pair.failure set) if
+        # the hit doesn't work out
 
         targets = self._targets
         run = self._run
@@ -98,7 +154,7 @@ class LookupProcessor(PairProcessor):
                 match_site = r2_res[0]
             else:
                 pair.failure = Failures.nomatch
-                return
+                return False
         else:
             match_site = r1_res[1]
 
@@ -109,7 +165,7 @@ class LookupProcessor(PairProcessor):
             # TODO: dumbbell errors
             if pair.r2.original_seq[:r2_match_start] != run.dumbbell:
                 pair.failure = Failures.dumbbell
-                return
+                return False
             pair.dumbbell = match_site - r2_match_start
             match_len = min(r2len - r2_match_start, target.n - match_site)
             pair.r2.ltrim = r2_match_start
@@ -121,14 +177,14 @@ class LookupProcessor(PairProcessor):
             r2_mutations = map(lambda x : x + match_site + 1, pair.r2.match_errors)
         if match_len <= 0  or  len(pair.r2.match_errors) > run.allowed_target_errors:
             pair.failure = Failures.match_errors
-            return
+            return False
 
         adapter_len = r2len - match_len - r2_match_start - masklen
         if adapter_len > 0:
             pair.r2.adapter_errors = string_match_errors(self._adapter_t_rc[:adapter_len], pair.r2.original_seq[-adapter_len:])
             if len(pair.r2.adapter_errors) > run.allowed_adapter_errors:
                 pair.failure = Failures.adapter_trim
-                return
+                return False
         site = match_site
 
         # in rare cases, need to double-check what R1 should be based on R2
@@ -138,7 +194,7 @@ class LookupProcessor(PairProcessor):
             pair.r1.match_errors = string_match_errors(reverse_complement(target.seq[-match_len:]), pair.r1.original_seq[masklen:masklen+match_len])
             if len(pair.r1.match_errors) > run.allowed_target_errors:
                 pair.failure = Failures.match_errors
-                return
+                return False
             if adapter_len > 0 and pair.dumbbell:
                 if adapter_len > r2_match_start:
                     dumbbell_len = len(run.dumbbell)
@@ -149,15 +205,15 @@ class LookupProcessor(PairProcessor):
                 # TODO: dumbbell errors
                 if pair.r1.reverse_complement[adapter_len:dumbbell_len] != run.dumbbell[-dumbbell_len:]:
                     pair.failure = Failures.dumbbell
-                    return
+                    return False
             if adapter_len > 0:
                 pair.r1.adapter_errors = string_match_errors(pair.r1.original_seq[-adapter_len:], self._run.adapter_b[:adapter_len])
                 if len(pair.r1.adapter_errors) > run.allowed_adapter_errors:
                     pair.failure = Failures.adapter_trim
-                    return
+                    return False
 
         if not self._check_indeterminate(pair):
-            return
+            return False
 
         pair.r1.match_len = min(pair.r1.original_len - masklen, target.n - match_site)
         pair.r1.match_index = r1_res[1] or (target.n - pair.r1.match_len)
@@ -167,22 +223,28 @@ class LookupProcessor(PairProcessor):
 
         if run.ignore_stops_with_mismatched_overlap and not pair.check_overlap():
             pair.failure = Failures.r1_r2_overlap
-            return
+            return False
 
         pair.target = target
         if r2_mutations or r1_res[3]:
             pair.mutations = list(set(r2_mutations + r1_res[3]))
-            if pair.mutations and len(pair.mutations) > run.allowed_target_errors:
+        return True
+
+    def _register_lookup_hit(self, pair):
+        run = self._run
+        if pair.mutations:
+            if len(pair.mutations) > run.allowed_target_errors:
                 pair.failure = Failures.match_errors
                 return
-            self.counters.low_quality_muts += pair.check_mutation_quality(run.mutations_require_quality_score)
+            self.counters.low_quality_muts += self._check_mutation_quality(pair)
 
+        site = pair.r2.match_index
         if run.count_only_full_reads and site != 0:
             pair.failure = Failures.not_full_read
             return
 
         pair.site = site
-        pair.end = target.n
+        pair.end = pair.target.n
         pair.failure = None
         self.counters.register_count(pair)
 
@@ -191,7 +253,7 @@ class CotransLookupProcessor(PairProcessor):
 
     def prepare(self):
         targets = self._targets
-        targets.index()
+        targets.index(packed = self._run.packed_target_index)
         targets.build_cotrans_lookups(self._run)
         target = targets.targets[0]
         self.r2_lookup = targets.r2_lookup[target.name]
@@ -295,7 +357,7 @@ class CotransLookupProcessor(PairProcessor):
             if pair.mutations and len(pair.mutations) > run.allowed_target_errors:
                 pair.failure = Failures.match_errors
                 return
-            self.counters.low_quality_muts += pair.check_mutation_quality(run.mutations_require_quality_score)
+            self.counters.low_quality_muts += self._check_mutation_quality(pair)
 
         if run.count_only_full_reads and site != 0:
             pair.failure = Failures.not_full_read
@@ -1,3 +1,10 @@
+from operator import itemgetter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 nuc_A = (1)
 nuc_C = (1<<1)
 nuc_G = (1<<2)
@@ -65,6 +72,66 @@ def match_mask_optimized(s, masks = [ 'RRRY', 'YYYR' ]):
     return None
 
 
+class MaskClassifier(object):
+    '''Matches the R1s of a whole batch of pairs against the masks at
+       once: the first bytes of all of the sequences go into a numpy
+       byte matrix, and each position of each mask is a lookup in a
+       table (by byte) of whether the mask matches there. Without numpy,
+       matches one sequence at a time.
+
+       :param masks: the list of :class:`Mask` to match, in order.
+       :param optimized: if True, matches like :func:`match_mask_optimized`
+          (only A, C, G or T in the handle); otherwise like :meth:`Mask.matches`.
+    '''
+
+    def __init__(self, masks, optimized = False):
+        self.masks = masks
+        self._length = max([ mask.length() for mask in masks ] + [ 0 ])
+        known = 'ACGT' if optimized else ''.join(char_to_mask.keys())
+        self._known = [ chr(b) in known for b in xrange(256) ]
+        self._tables = [ [ [ chr(b) in known  and  0 != (char_to_mask[chr(b)] & value) for b in xrange(256) ] for value in mask.values ] for mask in masks ]
+        if numpy:
+            self._known = numpy.array(self._known, dtype = bool)
+            self._tables = [ numpy.array(table, dtype = bool).reshape(len(table), 256) for table in self._tables ]
+
+    def classify(self, seqs):
+        '''Returns, for each of seqs, the index of the first mask that it
+           matches, or -1 if there isn't one -- or if the sequence has
+           something else (it's too short, or has other characters in the
+           handle), so that the caller can check it for itself.
+        '''
+        if not self.masks:
+            return [ -1 ] * len(seqs)
+        if numpy is None:
+            return [ self._classify_one(seq) for seq in seqs ]
+        k = self._length
+        try:
+            handles = ''.join(map(itemgetter(slice(0, k)), seqs))
+        except TypeError:
+            handles = ''
+        if len(handles) != k * len(seqs):
+            # some are too short (or aren't strs)
+            handles = ''.join(str(seq[:k]).ljust(k, '\0') for seq in seqs)
+        data = numpy.frombuffer(handles, dtype = numpy.uint8).reshape(len(seqs), k)
+        known = self._known[data].all(axis = 1)
+        res = numpy.empty(len(seqs), dtype = int)
+        res.fill(-1)
+        for idx in xrange(len(self.masks) - 1, -1, -1):
+            matched = known.copy()
+            for pos, table in enumerate(self._tables[idx]):
+                matched &= table[data[:, pos]]
+            res[matched] = idx
+        return res.tolist()
+
+    def _classify_one(self, seq):
+        if len(seq) < self._length  or  not all(self._known[ord(c)] for c in seq[:self._length]):
+            return -1
+        for idx, table in enumerate(self._tables):
+            if all(table[pos][ord(seq[pos])] for pos in xrange(len(table))):
+                return idx
+        return -1
+
+
 # returns (left, right), where 'left' is the max number of chars extending to the left,
 # and 'right' is the max number of chars extending to the right, s.t. s1 matches s2
 # when the passed-in ranges (pos, len) are extended to the left and right the
@@ -1,32 +1,173 @@
 import ast
+import ctypes
 import os
 import subprocess
+from lookup import LookupProcessor
 from processor import PairProcessor, Failures
 
-# wrapper for unit-testing the native code. extremely slow for anything but the smallest datasets.
+
+def _native_path(*parts):
+    import spats_shape_seq
+    return os.path.normpath(os.path.join(os.path.dirname(spats_shape_seq.__file__), "..", "native", *parts))
+
+_lib = None
+
+def _load_library():
+    global _lib
+    if _lib is None:
+        lib_path = _native_path("lib", "libspats.so")
+        if not os.path.exists(lib_path):
+            return None
+        lib = ctypes.CDLL(lib_path)
+        handle, c_int, c_char_p = ctypes.c_void_p, ctypes.c_int, ctypes.c_char_p
+        int_p, str_p = ctypes.POINTER(c_int), ctypes.POINTER(c_char_p)
+        for name, restype, argtypes in ( ("spats_engine_new", handle, [ c_int, c_char_p, c_char_p, c_char_p ]),
+                                         ("spats_engine_free", None, [ handle ]),
+                                         ("spats_engine_add_target", c_int, [ handle, c_char_p, c_char_p ]),
+                                         ("spats_engine_setup", c_int, [ handle, c_int ]),
+                                         ("spats_engine_max_sites", c_int, [ handle ]),
+                                         ("spats_engine_process", c_int, [ handle, c_int, str_p, str_p, int_p, int_p, c_int ]),
+                                         ("spats_engine_drain", c_int, [ handle, int_p, int_p ]),
+                                         ("spats_lookup_engine_new", handle, [ c_int, c_char_p, c_char_p ] + [ c_int ] * 8),
+                                         ("spats_lookup_engine_free", None, [ handle ]),
+                                         ("spats_lookup_engine_add_target", c_int, [ handle, c_char_p, c_char_p, c_int ]),
+                                         ("spats_lookup_engine_add_r1_alias", None, [ handle, c_char_p, c_char_p ]),
+                                         ("spats_lookup_engine_process", c_int, [ handle, c_int, str_p, str_p, str_p, str_p, int_p ]),
+                                         ("spats_lookup_engine_drain_counts", None, [ handle, int_p ]),
+                                         ("spats_lookup_engine_drain_sites", c_int, [ handle, c_int, c_int, int_p, int_p, int_p, int_p ]) ):
+            fn = getattr(lib, name)
+            fn.restype = restype
+            fn.argtypes = argtypes
+        _lib = lib
+    return _lib
+
+
+# bits in the word used by the native engine for R1 lookups (WORD_BITS in native/seq.hpp)
+ENGINE_WORD_BITS = 64
+
+# mask codes used by the native engine
+MASK_NO_MATCH = 0
+MASK_TREATED = 1
+MASK_UNTREATED = 2
+
+# indices of the counts from NativeLookupEngine.drain()
+LOOKUP_COUNT_MASK_FAILURE = 0
+LOOKUP_COUNT_INDETERMINATE = 1
+LOOKUP_COUNT_EDGE_MUTS = 2
+LOOKUP_COUNT_LOW_QUALITY_MUTS = 3
+LOOKUP_COUNT_QUALITY_CHECKED = 4
+LOOKUP_COUNT_TREATED_TOTAL = 5
+LOOKUP_COUNT_UNTREATED_TOTAL = 6
+NUM_LOOKUP_COUNTS = 7
+
+_EDGE_MUTATION_POLICIES = { None : 0, 'stop_only' : 1, 'stop_and_mut' : 2 }
+
+
+class NativeEngine(object):
+    '''In-process binding for the native cotrans engine, which must be
+    built first via ``make -C native lib``.
+
+    Pairs are processed a batch at a time without leaving the process;
+    counts accumulate natively until collected via :meth:`drain`.
+    '''
+
+    @staticmethod
+    def available():
+        return _load_library() is not None
+
+    @staticmethod
+    def supports(pair_length):
+        '''Whether the engine can process pairs of the given length: R1,
+           less the handle, must fit in a single word, 2 bits per base
+           (so at most 36nt). Pairs of any other length in a batch are
+           counted in the total but not processed.
+        '''
+        return (pair_length or 0) > 4  and  ((pair_length - 4) << 1) <= ENGINE_WORD_BITS
+
+    def __init__(self, run, target):
+        lib = _load_library()
+        if not lib:
+            raise Exception("native engine not available, build it via `make -C native lib`")
+        self._lib = lib
+        self._handle = lib.spats_engine_new(run.cotrans_minimum_length, run.cotrans_linker, run.adapter_b, run.adapter_t)
+        lib.spats_engine_add_target(self._handle, target.name, target.seq)
+        self.pair_length = None
+
+    def __del__(self):
+        if getattr(self, '_handle', None):
+            self._lib.spats_engine_free(self._handle)
+            self._handle = None
+
+    def _setup(self, pair_length):
+        if self.pair_length is None:
+            if 0 != self._lib.spats_engine_setup(self._handle, pair_length):
+                raise Exception("Unsupported pair length for native engine: {}".format(pair_length))
+            self.pair_length = pair_length
+            self._max_sites = self._lib.spats_engine_max_sites(self._handle)
+
+    def process(self, r1s, r2s, multiplicities = None, accumulate = True):
+        '''Processes the pairs given by the lists of R1/R2 sequences.
+
+           :return: a list of ``(mask, end, site)`` for each pair, where
+              ``mask`` is one of the ``MASK_*`` codes.
+        '''
+        n = len(r1s)
+        if 0 == n:
+            return []
+        self._setup(len(r1s[0]))
+        results = (ctypes.c_int * (3 * n))()
+        self._lib.spats_engine_process(self._handle, n,
+                                       (ctypes.c_char_p * n)(*r1s),
+                                       (ctypes.c_char_p * n)(*r2s),
+                                       (ctypes.c_int * n)(*multiplicities) if multiplicities else None,
+                                       results,
+                                       1 if accumulate else 0)
+        results = results[:]
+        return [ tuple(results[i:i + 3]) for i in xrange(0, 3 * n, 3) ]
+
+    def drain(self):
+        '''Collects the counts accumulated since the last call, and resets them.
+
+           :return: ``(counts, sites)``, where ``counts`` is the list of
+              ``[ total, matched, mask_failure, indeterminate ]`` pair
+              counts, and ``sites`` a list of ``(mask, end, site, count)``.
+        '''
+        counts = (ctypes.c_int * 4)()
+        if self.pair_length is None:
+            return counts[:], []
+        sites = (ctypes.c_int * (4 * self._max_sites))()
+        num_sites = self._lib.spats_engine_drain(self._handle, counts, sites)
+        sites = sites[:4 * num_sites]
+        return counts[:], [ tuple(sites[i:i + 4]) for i in xrange(0, 4 * num_sites, 4) ]
+
+
 class CotransNativeProcessor(PairProcessor):
 
     def prepare(self):
-        pass
+        # the engine only knows about RRRY/YYYR masks. without it, falls back to running
+        # native/bin/unittest per pair (extremely slow; only useful for unit tests)
+        use_engine = NativeEngine.available() and self._match_mask == self._match_mask_optimized
+        self._engine = NativeEngine(self._run, self._targets.targets[0]) if use_engine else None
 
     def exists(self):
-        import spats_shape_seq
-        bin_path = os.path.join(os.path.dirname(spats_shape_seq.__file__), "../native/bin/unittest")
-        return os.path.exists(bin_path)
+        return bool(self._engine) or os.path.exists(_native_path("bin", "unittest"))
 
     def process_pair(self, pair):
-        try:
-            import spats_shape_seq
-            basepath = os.path.dirname(spats_shape_seq.__file__)
-            bin_path = os.path.join(basepath, "../native/bin/unittest")
-            tgt_path = os.path.join(basepath, "../test/cotrans/cotrans_single.fa")
-            res = subprocess.check_output([bin_path, tgt_path, pair.r1.original_seq, pair.r2.original_seq])
-            val = ast.literal_eval(res)
-        except:
-            import traceback
-            print(traceback.format_exc())
-            pair.failure = Failures.nomatch
-            return
+        if self._engine:
+            mask, end, site = self._engine.process([ pair.r1.original_seq ], [ pair.r2.original_seq ], accumulate = False)[0]
+            if MASK_NO_MATCH == mask:
+                pair.failure = Failures.nomatch
+                return
+            val = [ mask, end, site ]
+        else:
+            try:
+                res = subprocess.check_output([_native_path("bin", "unittest"), _native_path("..", "test", "cotrans", "cotrans_single.fa"), pair.r1.original_seq, pair.r2.original_seq])
+                val = ast.literal_eval(res)
+            except:
+                import traceback
+                print(traceback.format_exc())
+                pair.failure = Failures.nomatch
+                return
 
         if not self._match_mask(pair):
             return
@@ -36,3 +177,147 @@ class CotransNativeProcessor(PairProcessor):
         pair.site = val[2]
         self.counters.register_count(pair)
 
+    def process_pair_batch(self, pairs):
+        if not self._engine:
+            return False
+        self._engine.process([ str(p[1]) for p in pairs ], [ str(p[2]) for p in pairs ], [ p[0] for p in pairs ])
+        counts, sites = self._engine.drain()
+        counters = self.counters
+        counters.mask_failure += counts[2]
+        counters.indeterminate += counts[3]
+        target = self._targets.targets[0]
+        labels = { MASK_TREATED : self._masks[0].chars, MASK_UNTREATED : self._masks[1].chars }
+        for mask, end, site, count in sites:
+            counters.increment_mask(labels[mask], count)
+            counters.register_stops(target, labels[mask], end, site, count)
+        return True
+
+
+class NativeLookupEngine(object):
+    '''In-process binding for the native (non-cotrans) lookup engine,
+    which gives the same results as :class:`.LookupProcessor` for
+    multiple targets, mutations, the edge mutation policy, and quality
+    score thresholds.
+    '''
+
+    @staticmethod
+    def available():
+        return _load_library() is not None
+
+    @staticmethod
+    def supports(run, targets):
+        '''Whether the engine can process pairs for the run config and
+           targets (otherwise, use :class:`.LookupProcessor`).
+        '''
+        length = (run.pair_length or 0) - 4
+        return (length > 0  and  not run.dumbbell  and  not run.handle_indels  and
+                run.allowed_target_errors <= 4  and
+                run.count_edge_mutations in _EDGE_MUTATION_POLICIES  and
+                all(target.n >= length for target in targets.targets))
+
+    def __init__(self, run, targets):
+        lib = _load_library()
+        if not lib:
+            raise Exception("native engine not available, build it via `make -C native lib`")
+        self._lib = lib
+        quality = run.mutations_require_quality_score
+        self._handle = lib.spats_lookup_engine_new(run.pair_length, run.adapter_b, run.adapter_t,
+                                                   int(bool(run.count_mutations)),
+                                                   run.allowed_target_errors,
+                                                   run.allowed_adapter_errors,
+                                                   int(bool(run.allow_indeterminate)),
+                                                   int(bool(run.ignore_stops_with_mismatched_overlap)),
+                                                   int(bool(run.count_only_full_reads)),
+                                                   _EDGE_MUTATION_POLICIES[run.count_edge_mutations],
+                                                   -1 if quality is None else quality + ord('!'))
+        self.targets = targets.targets
+        for target in self.targets:
+            lib.spats_lookup_engine_add_target(self._handle, target.name, target.seq, targets.r2_match_lengths[target.name])
+        # the order of the keys for each alias matters, so these come from python's tables
+        for alias, keys in (targets.r1_aliases or {}).iteritems():
+            for key in keys:
+                lib.spats_lookup_engine_add_r1_alias(self._handle, alias, key)
+
+    def __del__(self):
+        if getattr(self, '_handle', None):
+            self._lib.spats_lookup_engine_free(self._handle)
+            self._handle = None
+
+    def process(self, r1s, r2s, multiplicities = None, q1s = None, q2s = None):
+        '''Processes the pairs given by the lists of R1/R2 sequences (and
+           optionally, qualities), accumulating counts until collected
+           via :meth:`drain`.
+
+           :return: the number of pairs registered.
+        '''
+        n = len(r1s)
+        if 0 == n:
+            return 0
+        strs = ctypes.c_char_p * n
+        return self._lib.spats_lookup_engine_process(self._handle, n, strs(*r1s), strs(*r2s),
+                                                     strs(*q1s) if q1s else None,
+                                                     strs(*q2s) if q2s else None,
+                                                     (ctypes.c_int * n)(*multiplicities) if multiplicities else None)
+
+    def drain(self):
+        '''Collects the counts accumulated since the last call, and resets them.
+
+           :return: ``(counts, sites)``, where ``counts`` is indexed by
+              the ``LOOKUP_COUNT_*`` values, and ``sites`` is a list of
+              ``(target, mask, stops, quality_stops, muts, removed_muts)``
+              per-site vectors.
+        '''
+        lib = self._lib
+        counts = (ctypes.c_int * NUM_LOOKUP_COUNTS)()
+        lib.spats_lookup_engine_drain_counts(self._handle, counts)
+        sites = []
+        for index, target in enumerate(self.targets):
+            for mask in (MASK_TREATED, MASK_UNTREATED):
+                vects = [ (ctypes.c_int * (target.n + 2))() for i in xrange(4) ]
+                if lib.spats_lookup_engine_drain_sites(self._handle, index, mask, *vects):
+                    sites.append((target, mask) + tuple(v[:] for v in vects))
+        return counts[:], sites
+
+
+class NativeLookupProcessor(LookupProcessor):
+    '''Same as :class:`.LookupProcessor`, but processes whole batches of
+    pairs with the native lookup engine when it's available and
+    supports the run config.
+    '''
+
+    def prepare(self):
+        LookupProcessor.prepare(self)
+        use_engine = (NativeLookupEngine.available()  and  self._match_mask == self._match_mask_optimized  and
+                      self._lookup_length == self._run.pair_length  and
+                      NativeLookupEngine.supports(self._run, self._targets))
+        self._engine = NativeLookupEngine(self._run, self._targets) if use_engine else None
+
+    def process_pair_batch(self, pairs):
+        if not self._engine:
+            return False
+        # the engine is built for the one pair_length; batches with
+        # (pre-trimmed) reads of other lengths go through process_pair
+        length = self._run.pair_length
+        if any(len(p[1]) != length  or  len(p[2]) != length for p in pairs):
+            return False
+        use_quality = self._run._parse_quality
+        self._engine.process([ str(p[1]) for p in pairs ], [ str(p[2]) for p in pairs ], [ p[0] for p in pairs ],
+                             [ str(p[4]) for p in pairs ] if use_quality else None,
+                             [ str(p[5]) for p in pairs ] if use_quality else None)
+        counts, sites = self._engine.drain()
+        counters = self.counters
+        labels = { MASK_TREATED : self._masks[0].chars, MASK_UNTREATED : self._masks[1].chars }
+        for label, index in ( (labels[MASK_TREATED], LOOKUP_COUNT_TREATED_TOTAL), (labels[MASK_UNTREATED], LOOKUP_COUNT_UNTREATED_TOTAL) ):
+            if counts[index]:
+                counters.increment_mask(label, counts[index])
+        if counts[LOOKUP_COUNT_MASK_FAILURE]:
+            counters.mask_failure += counts[LOOKUP_COUNT_MASK_FAILURE]
+        if counts[LOOKUP_COUNT_INDETERMINATE]:
+            counters.indeterminate += counts[LOOKUP_COUNT_INDETERMINATE]
+        if counts[LOOKUP_COUNT_EDGE_MUTS]:
+            counters.edge_muts += counts[LOOKUP_COUNT_EDGE_MUTS]
+        if counts[LOOKUP_COUNT_QUALITY_CHECKED]:
+            counters.low_quality_muts += counts[LOOKUP_COUNT_LOW_QUALITY_MUTS]
+        for target, mask, stops, quality_stops, muts, removed_muts in sites:
+            counters.register_site_vectors(target, labels[mask], target.n, stops, quality_stops, muts, removed_muts)
+        return True
@@ -6,23 +6,34 @@ from mask import PLUS_PLACEHOLDER, MINUS_PLACEHOLDER
 
 class Pair(object):
 
+    # a worker reuses one Pair (and its two Sequences) for all of its
+    # pairs, so everything is reset in place rather than reallocated
+    __slots__ = ( 'identifier', 'r1', 'r2', 'mask', 'mask_label', '_target', 'site', 'interesting',
+                  'failure', 'multiplicity', 'tags', '_end', 'mutations', 'removed_mutations', 'linker',
+                  'edge_mut', 'edge_indel', 'ambig_indel', 'dumbbell', '_fully_matched', '_indels_match' )
+
     def __init__(self):
+        self.r1 = Sequence()
+        self.r2 = Sequence()
         self.reset()
 
     def __repr__(self):
         return 'T={}/E={}/S={}/m={}'.format(self.target.name if self.target else None, self.end, self.site, self.mutations)
 
     def reset(self):
-        self.identifier = None
-        self.r1 = Sequence()
-        self.r2 = Sequence()
+        self._reset(None, None, None, 1)
+
+    def _reset(self, identifier, r1_seq, r2_seq, multiplicity):
+        self.identifier = identifier
+        self.r1._reset(r1_seq, bool(r1_seq))
+        self.r2._reset(r2_seq, False)
         self.mask = None
         self.mask_label = ""
         self._target = None
         self.site = None
         self.interesting = False
         self.failure = None
-        self.multiplicity = 1
+        self.multiplicity = multiplicity
         self.tags = None
         self._end = -1
         self.mutations = None
@@ -35,23 +46,25 @@ class Pair(object):
         self._fully_matched = False
         self._indels_match = None
 
+    def copy_from(self, other, skip = ()):
+        # r1 and r2 are copied into this pair's own Sequences, so that
+        # resetting this pair later doesn't touch other's
+        for attr in Pair.__slots__:
+            if attr in skip:
+                continue
+            if attr == 'r1' or attr == 'r2':
+                getattr(self, attr).copy_from(getattr(other, attr))
+            else:
+                setattr(self, attr, getattr(other, attr))
+
     def set_from_data(self, identifier, r1_seq, r2_seq, multiplicity = 1):
-        self.reset()
-        self.identifier = identifier
-        self.multiplicity = multiplicity
-        if r1_seq:
-            self.r1.set_seq(r1_seq, True)
-        if r2_seq:
-            self.r2.set_seq(r2_seq)
+        self._reset(identifier, r1_seq, r2_seq, multiplicity)
         return (r1_seq and r2_seq)
 
     def set_from_records(self, r1_record, r2_record):
         if not r1_record.identifier or r1_record.identifier != r2_record.identifier:
             raise Exception("Invalid record IDs for pair: {}, {}".format(r1_record.identifier, r2_record.identifier))
-        self.reset()
-        self.identifier = r1_record.identifier
-        self.r1.set_seq(r1_record.sequence, True)
-        self.r2.set_seq(r2_record.sequence)
+        self._reset(r1_record.identifier, r1_record.sequence, r2_record.sequence, 1)
 
     def is_determinate(self):
         return set(self.r1.original_seq + self.r2.original_seq) <= set('ACGT')
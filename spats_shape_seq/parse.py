@@ -1,11 +1,151 @@
 
 import datetime
+import mmap
 import os
+import Queue
 import struct
+import threading
+import zlib
+from cStringIO import StringIO
 from sys import version_info
 
 import spats_shape_seq
-from mask import match_mask_optimized, Mask
+from mask import match_mask_optimized, Mask, MaskClassifier
+
+
+GZIP_MAGIC = '\x1f\x8b'
+
+def is_gzipped(path):
+    with open(path, 'rb') as infile:
+        return infile.read(2) == GZIP_MAGIC
+
+
+class GzipStreamReader(object):
+    """Line-oriented reader for gzip (including multi-member / bgzip) files.
+
+    Decompression happens on a background thread, which stays up to
+    ``queue_depth`` blocks ahead of the consumer; zlib releases the GIL
+    while inflating, so this overlaps with pair processing. Iterating
+    yields lines (with line endings) just like a regular file object.
+    """
+
+    def __init__(self, path, chunk_size = 1 << 20, queue_depth = 8):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._blocks = Queue.Queue(queue_depth)
+        self._stop = False
+        self._error = None
+        self._lines = iter([])
+        self._pending = ''
+        self._eof = False
+        self._infile = open(path, 'rb')
+        self._thread = threading.Thread(target = self._decompress)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, block):
+        while not self._stop:
+            try:
+                self._blocks.put(block, True, 0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _decompress(self):
+        try:
+            infile = self._infile
+            decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            while not self._stop:
+                data = infile.read(self.chunk_size)
+                if not data:
+                    break
+                while data:
+                    block = decomp.decompress(data)
+                    if block and not self._put(block):
+                        return
+                    data = decomp.unused_data
+                    if data:
+                        # start of the next gzip member (bgzip files are many concatenated members)
+                        decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            block = decomp.flush()
+            if block:
+                self._put(block)
+        except Exception, e:
+            self._error = e
+        finally:
+            self._put(None)
+
+    def _next_lines(self):
+        while True:
+            block = self._blocks.get()
+            if block is None:
+                self._eof = True
+                if self._error:
+                    raise Exception("Error decompressing {}: {}".format(self.path, self._error))
+                tail, self._pending = self._pending, ''
+                return iter([ tail ] if tail else [])
+            block = self._pending + block
+            cut = block.rfind('\n') + 1
+            if cut:
+                self._pending = block[cut:]
+                return iter(StringIO(block[:cut]))
+            self._pending = block
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        while True:
+            try:
+                return self._lines.next()
+            except StopIteration:
+                if self._eof:
+                    raise
+                self._lines = self._next_lines()
+
+    def readline(self):
+        try:
+            return self.next()
+        except StopIteration:
+            return ''
+
+    def close(self):
+        if self._infile:
+            self._stop = True
+            self._thread.join()
+            self._infile.close()
+            self._infile = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def open_input(path):
+    # transparently handles gzip/bgzip-compressed inputs, which are streamed rather than decompressed to disk
+    if is_gzipped(path):
+        return GzipStreamReader(path)
+    return open(path, 'rb')
+
+def uncompressed_size(path, sample_size = 1 << 20):
+    # for compressed inputs, an estimate based on the compression ratio of the start of the file
+    size = os.path.getsize(path)
+    if not is_gzipped(path):
+        return size
+    with open(path, 'rb') as infile:
+        data = infile.read(sample_size)
+    consumed = len(data)
+    out = 0
+    decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while data:
+        out += len(decomp.decompress(data))
+        data = decomp.unused_data
+        if data:
+            decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    return int(float(size) * float(out) / float(max(1, consumed)))
 
 
 # not currently used in spats, but potentially useful for tools
@@ -47,16 +187,139 @@ class FastqRecord(object):
         self.quality = self.quality[::-1]
 
 
+class FastqShard(object):
+    """A record-aligned byte range of a pair of R1/R2 fastq files, see :func:`fastq_shards`.
+    """
+
+    def __init__(self, r1_path, r2_path, r1_range, r2_range):
+        self.r1_path = r1_path
+        self.r2_path = r2_path
+        self.r1_range = r1_range
+        self.r2_range = r2_range
+
+
+def _record_start(infile, offset):
+    # first fastq record boundary at or after offset: a line starting with '@' whose
+    # third line starts with '+' (quality lines may also start with '@')
+    if 0 == offset:
+        return 0
+    infile.seek(offset - 1)
+    infile.readline()
+    while True:
+        pos = infile.tell()
+        header = infile.readline()
+        if not header:
+            return pos
+        infile.readline()
+        if header.startswith('@') and infile.readline().startswith('+'):
+            return pos
+        infile.seek(pos)
+        infile.readline()
+
+def _record_id(header):
+    return header.split(' ')[0].rstrip('\r\n')
+
+def _record_ids(infile, pos, num_records):
+    # ids of the (up to) num_records records starting at pos
+    infile.seek(pos)
+    ids = []
+    for i in xrange(num_records):
+        header = infile.readline()
+        if not header:
+            break
+        ids.append(_record_id(header))
+        infile.readline()
+        infile.readline()
+        infile.readline()
+    return ids
+
+def _find_records(infile, record_ids, near, lo, hi):
+    # offset in [lo, hi), closest to near, of the run of records with the given ids
+    # (more than one, in case ids are repeated). searches windows that grow outward
+    # from near, so only the area around it is read unless the files don't match up
+    window = 1 << 16
+    while True:
+        start = _record_start(infile, max(lo, near - window))
+        end = min(hi, near + window)
+        candidates = []
+        infile.seek(start)
+        pos = start
+        while pos < end:
+            header = infile.readline()
+            if not header:
+                break
+            if _record_id(header) == record_ids[0]:
+                candidates.append(pos)
+            infile.readline()
+            infile.readline()
+            infile.readline()
+            pos = infile.tell()
+        for pos in sorted(candidates, key = lambda c: abs(c - near)):
+            if record_ids == _record_ids(infile, pos, len(record_ids)):
+                return pos
+        if start <= lo  and  end >= hi:
+            return None
+        window <<= 4
+
+def fastq_shards(r1_path, r2_path, num_shards):
+    """Splits a pair of (uncompressed) fastq files into up to
+    ``num_shards`` record-aligned byte ranges, which can be parsed
+    independently via :class:`.FastFastqParser`.
+
+    R1 is split near even offsets (resynchronizing on record
+    boundaries). Each R2 boundary is then found near the proportional
+    offset in R2, as the record with the same id as the one at the R1
+    boundary (and the same ids for the records that follow, in case
+    ids repeat). So only the neighborhood of each boundary is read,
+    not the files themselves.
+
+    :return: a list of :class:`.FastqShard`
+    """
+    r1_size = os.path.getsize(r1_path)
+    r2_size = os.path.getsize(r2_path)
+    shards = []
+    with open(r1_path, 'rb') as r1_in, open(r2_path, 'rb') as r2_in:
+        r1_start = r2_start = 0
+        for i in xrange(1, num_shards + 1):
+            if i == num_shards:
+                r1_end, r2_end = r1_size, r2_size
+            else:
+                r1_end = _record_start(r1_in, max(r1_start, (r1_size * i) / num_shards))
+                if r1_end >= r1_size:
+                    r1_end, r2_end = r1_size, r2_size
+                else:
+                    R1_ids = _record_ids(r1_in, r1_end, 16)
+                    r2_end = _find_records(r2_in, R1_ids, (r2_size * r1_end) / r1_size, r2_start, r2_size)
+                    if r2_end is None:
+                        raise Exception("Malformed input files, no R2 records match R1 at id: {}".format(R1_ids[0]))
+            if r1_end > r1_start:
+                shards.append(FastqShard(r1_path, r2_path, (r1_start, r1_end), (r2_start, r2_end)))
+            r1_start, r2_start = r1_end, r2_end
+            if r1_start >= r1_size:
+                break
+    return shards
+
+def _mmap_range(infile, byte_range):
+    # maps just the given range (mmap offsets must be a multiple of the allocation granularity),
+    # positioned at the start of the range so that readline() stops at the end of it
+    start, end = byte_range
+    base = start - (start % mmap.ALLOCATIONGRANULARITY)
+    mapped = mmap.mmap(infile.fileno(), end - base, access = mmap.ACCESS_READ, offset = base)
+    mapped.seek(start - base)
+    return mapped
+
+
 class FastFastqParser(object):
 
-    def __init__(self, r1_path, r2_path, parse_quality = False):
+    def __init__(self, r1_path, r2_path, parse_quality = False, shard = None):
         self.r1_path = r1_path
         self.r2_path = r2_path
         self.parse_quality = parse_quality
+        self.shard = shard
 
     def pair_length(self):
-        with open(self.r1_path, 'rb') as r1_in:
-            with open(self.r2_path, 'rb') as r2_in:
+        with open_input(self.r1_path) as r1_in:
+            with open_input(self.r2_path) as r2_in:
                 r1_in.readline()
                 r1_first = r1_in.readline().strip('\r\n')
                 r2_in.readline()
@@ -68,14 +331,22 @@ class FastFastqParser(object):
                 return pair_length
 
     def appx_number_of_pairs(self):
-        with open(self.r1_path, 'rb') as r1_in:
+        with open_input(self.r1_path) as r1_in:
             # the +1 is since first records tend to be short, and we'd rather underestimate than overestimate
             frag_len = 1 + len(r1_in.readline()) + len(r1_in.readline()) + len(r1_in.readline()) + len(r1_in.readline())
-        return int(float(os.path.getsize(self.r1_path)) / float(frag_len))
+        return int(float(uncompressed_size(self.r1_path)) / float(frag_len))
 
     def __enter__(self):
-        self.r1_in = open(self.r1_path, 'rb')
-        self.r2_in = open(self.r2_path, 'rb')
+        if self.shard:
+            self.r1_file = open(self.r1_path, 'rb')
+            self.r2_file = open(self.r2_path, 'rb')
+            self.r1_in = _mmap_range(self.r1_file, self.shard.r1_range)
+            self.r2_in = _mmap_range(self.r2_file, self.shard.r2_range)
+            self.r1_iter = iter(self.r1_in.readline, '')
+            self.r2_iter = iter(self.r2_in.readline, '')
+            return self
+        self.r1_in = open_input(self.r1_path)
+        self.r2_in = open_input(self.r2_path)
         self.r1_iter = iter(self.r1_in)
         self.r2_iter = iter(self.r2_in)
         return self
@@ -83,6 +354,11 @@ class FastFastqParser(object):
     def __exit__(self, type, value, traceback):
         self.r1_in.close()
         self.r2_in.close()
+        if self.shard:
+            self.r1_file.close()
+            self.r2_file.close()
+            self.r1_file = None
+            self.r2_file = None
         self.r1_in = None
         self.r2_in = None
         self.r1_iter = None
@@ -177,6 +453,46 @@ class FastFastqParser(object):
             pass
         return pairs, count
 
+def dedup_pair_batches(batch_iter, max_unique, batch_size):
+    """Collapses duplicate pairs from an iterator of pair batches (as
+    from :meth:`FastFastqParser.iterator`) into batches of distinct
+    pairs, with the multiplicities summed.
+
+    At most ``max_unique`` distinct pairs are held at a time; once
+    the table fills, it is flushed (in batches of ``batch_size``) and
+    restarted. A pair may therefore appear in more than one flush, but
+    the total multiplicity is always preserved. Pair ids are
+    renumbered, and quality strings are not supported.
+    """
+    table = {}
+    next_id = 0
+    for batch in batch_iter:
+        get = table.get
+        for pair_info in batch:
+            key = (pair_info[1], pair_info[2])
+            table[key] = get(key, 0) + pair_info[0]
+        if len(table) >= max_unique:
+            for out in _flush_dedup_table(table, batch_size, next_id):
+                next_id += len(out)
+                yield out
+            table = {}
+    if table:
+        for out in _flush_dedup_table(table, batch_size, next_id):
+            yield out
+
+def _flush_dedup_table(table, batch_size, first_id):
+    batch = []
+    pair_id = first_id
+    for key, mult in table.iteritems():
+        batch.append((mult, key[0], key[1], str(pair_id)))
+        pair_id += 1
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 class FastqWriter(object):
 
     def __init__(self, r1_path, r2_path):
@@ -202,6 +518,8 @@ class FastqWriter(object):
             self.r2_out = None
 
 
+_HANDLE_FILTER_BATCH_SIZE = 16384
+
 class _MaskMatcher:
     def __init__(self, masks):
         if len(masks) == 2  and  'RRRY' in masks  and  'YYYR' in masks:
@@ -229,6 +547,9 @@ def fastq_handle_filter(r1_path, r2_path, masks = [ 'RRRY', 'YYYR' ], strip_mask
         comboname = os.path.basename(combined_path)
         if comboname.endswith(".tmp"):
             comboname = comboname[:-4]
+        elif comboname.lower().endswith(".gz"):
+            # outputs are written uncompressed
+            comboname = comboname[:-3]
         return os.path.abspath(os.path.join(outpath, handle + '-' + comboname))
     for mask in masks:
         if len(mask) == 0:
@@ -240,20 +561,31 @@ def fastq_handle_filter(r1_path, r2_path, masks = [ 'RRRY', 'YYYR' ], strip_mask
         r2of[mask] = open(r2fpath, 'w+')
         result.append(r2fpath)
     mm = _MaskMatcher(masks)
+    # the records are read a batch at a time, so that their handles can be classified all at once
+    classifier = MaskClassifier([ Mask(mask) for mask in masks ], optimized = (mm.match_mask == match_mask_optimized))
     try:
-        fqr1 = FastqRecord()
-        fqr2 = FastqRecord()
-        with open(r1_path, 'r') as r1if, open(r2_path, 'r') as r2if:
-            while fqr1.read(r1if) and fqr2.read(r2if):
-                mask = mm.match_mask(fqr1.sequence)
-                if mask:
-                    striplen = len(mask) if strip_mask else 0
-                    fqr1.write(r1of[mask], striplen)
-                    fqr2.write(r2of[mask])
-                    if counters:
-                        counters.increment_key(mask)
-                elif counters:
-                    counters.increment_key('no_mask')
+        with open_input(r1_path) as r1if, open_input(r2_path) as r2if:
+            more = True
+            while more:
+                records = []
+                while len(records) < _HANDLE_FILTER_BATCH_SIZE:
+                    fqr1 = FastqRecord()
+                    fqr2 = FastqRecord()
+                    if not (fqr1.read(r1if) and fqr2.read(r2if)):
+                        more = False
+                        break
+                    records.append((fqr1, fqr2))
+                classified = classifier.classify([ fqr1.sequence for fqr1, fqr2 in records ])
+                for (fqr1, fqr2), idx in zip(records, classified):
+                    mask = masks[idx] if idx >= 0 else mm.match_mask(fqr1.sequence)
+                    if mask:
+                        striplen = len(mask) if strip_mask else 0
+                        fqr1.write(r1of[mask], striplen)
+                        fqr2.write(r2of[mask])
+                        if counters:
+                            counters.increment_key(mask)
+                    elif counters:
+                        counters.increment_key('no_mask')
     finally:
         for mask in masks:
             r1of[mask].close()
@@ -376,7 +708,7 @@ class SamParser(object):
         self.target_map = target_map
 
     def __enter__(self):
-        self.sam_in = open(self.sam_path, 'rb')
+        self.sam_in = open_input(self.sam_path)
         self.sam_iter = iter(self.sam_in)
         return self
 
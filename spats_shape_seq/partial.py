@@ -2,13 +2,33 @@
 from processor import PairProcessor, Failures
 from mask import base_similarity_ind
 from pair import Pair
-from util import _warn, _debug, reverse_complement, string_match_errors, string_find_errors, string_find_with_overlap, AlignmentParams
+from util import _warn, _debug, reverse_complement, string_match_errors, string_find_errors, string_find_with_overlap, AlignmentParams, align_strings, align_strings_batch
+
+
+# number of pairs stepped through together by process_pair_batch()
+_ALIGNMENT_BATCH_SIZE = 1024
 
 
 class PartialFindProcessor(PairProcessor):
 
+    _timed_stages = PairProcessor._timed_stages + ( ('_find_matches', 'find_in_targets'),
+                                                    ('_cotrans_find_short_matches', 'find_in_targets'),
+                                                    ('_trim_adapters', 'adapter_trim'),
+                                                    ('_verify_full_match', 'adapter_trim'),
+                                                    ('_align', 'alignment'),
+                                                    ('_align_batch', 'alignment') )
+
     def prepare(self):
-        self._targets.index()
+        run = self._run
+        self._targets.index(packed = run.packed_target_index, suffix_array = run.suffix_array_search)
+        self._alignment_params = None
+        self._rc_pair = Pair()
+        if run.handle_indels:
+            if run.allow_indeterminate:
+                simfn = lambda nt1, nt2: base_similarity_ind(nt1, nt2, run.indel_match_value, run.indel_mismatch_cost, .5 * run.indel_match_value)
+            else:
+                simfn = lambda nt1, nt2: AlignmentParams.char_sim(nt1, nt2, run.indel_match_value, run.indel_mismatch_cost)
+            self._alignment_params = AlignmentParams(simfn, run.indel_gap_open_cost, run.indel_gap_extend_cost, band = run.indel_alignment_band)
 
 
     def _find_matches(self, pair):
@@ -125,36 +145,6 @@ class PartialFindProcessor(PairProcessor):
         return self._recheck_targets(pair)
 
 
-    def _extend_match(self, pair, ap):
-        run = self._run
-        masklen = pair.mask.length()
-        dumblen = len(run.dumbbell) if run.dumbbell else 0
-
-        ## Align remaining R2 first to find adapter overhang.
-        ## TAI: probably better way of doing adapter alignment  (see indels_7 testcase)
-        r2suffix = "" if run.cotrans else reverse_complement(pair.r1.original_seq[:masklen]) + reverse_complement(run.adapter_t)
-        pair.r2.extend_alignment(pair.target, ap, r2suffix)
-        if run.dumbbell:
-            pair.dumbbell = pair.r2.match_index - dumblen
-
-        ## Trim the adapters off both R1 and R2
-        if not self._trim_adapters(pair):
-            if not pair.failure:
-                pair.failure = Failures.adapter_trim
-                self.counters.adapter_trim_failure += pair.multiplicity
-            return False
-
-        ## Now align remaining R1 if necessary
-        if not pair.r1.fully_matched:
-            pair.r1.extend_alignment(pair.target, ap)
-            # we may have not trimmed enough
-            r1_overhang = pair.r1.right_est - pair.target.n
-            if r1_overhang > 0:
-                pair.r1.ltrim += r1_overhang    # also updates match_len
-
-        return True
-
-
     def _verify_full_match(self, pair):
         run = self._run
         if not run.cotrans:
@@ -189,7 +179,7 @@ class PartialFindProcessor(PairProcessor):
 
 
     def _check_targetrc(self, pair):
-        rcpair = Pair()
+        rcpair = self._rc_pair
         rcpair.set_from_data(pair.identifier,
                              reverse_complement(pair.r1.original_seq),
                              reverse_complement(pair.r2.original_seq))
@@ -213,10 +203,72 @@ class PartialFindProcessor(PairProcessor):
     ##         (R2 read may end before or during this)
     ##    M+ = mask/handle designating treatment (reverse/R1 reads will always start here)
 
+    ##
+    ## Processing a pair is done in steps, so that the string alignments
+    ## (which are most of the time spent with handle_indels) can be done
+    ## for many pairs at once: the steps are a generator, which yields a
+    ## list of alignment jobs (each a (source, target) tuple or None) and
+    ## is sent back the list of Alignments for them.
+
     def process_pair(self, pair):
-        if not self._check_indeterminate(pair) or not self._match_mask(pair):
+        steps = self._pair_steps(pair)
+        if not steps:
             return
+        jobs = _step(steps)
+        while jobs is not None:
+            jobs = _step(steps, self._align(jobs))
+
+    def _align(self, jobs):
+        ap = self._alignment_params
+        return [ align_strings(job[0], job[1], ap) if job else None for job in jobs ]
+
+    def _align_batch(self, jobs):
+        return align_strings_batch(jobs, self._alignment_params)
+
+    def process_pair_batch(self, pairs):
+        # steps through a sub-batch of pairs together, doing the
+        # alignments for all of them at each step with align_strings_batch()
+        if not self._run.handle_indels  or  self._pair_cache is not None:
+            return False
+        use_quality = self._run._parse_quality
+        masks = self.classify_masks([ lines[1] for lines in pairs ])
+        for start in xrange(0, len(pairs), _ALIGNMENT_BATCH_SIZE):
+            pending = []
+            for idx in xrange(start, min(start + _ALIGNMENT_BATCH_SIZE, len(pairs))):
+                lines = pairs[idx]
+                pair = Pair()
+                if not pair.set_from_data(lines[3], str(lines[1]), str(lines[2]), lines[0]):
+                    print('\nskipping empty pair:  {}'.format(lines[3]))
+                    continue
+                if use_quality:
+                    pair.r1.quality = str(lines[4])
+                    pair.r2.quality = str(lines[5])
+                if masks[idx]:
+                    pair.set_mask(masks[idx])
+                steps = self._pair_steps(pair)
+                jobs = _step(steps) if steps else None
+                if jobs is not None:
+                    pending.append((steps, jobs))
+            while pending:
+                alignments = self._align_batch([ job for steps, jobs in pending for job in jobs ])
+                still_pending = []
+                used = 0
+                for steps, jobs in pending:
+                    next_jobs = _step(steps, alignments[used:used + len(jobs)])
+                    used += len(jobs)
+                    if next_jobs is not None:
+                        still_pending.append((steps, next_jobs))
+                pending = still_pending
+        return True
+
+    def _pair_steps(self, pair):
+        # returns the steps for processing the pair, or None if there's
+        # nothing (more) to do
+        if not self._check_indeterminate(pair) or not self._match_mask(pair):
+            return None
+        return self._masked_pair_steps(pair)
 
+    def _masked_pair_steps(self, pair):
         run = self._run
         masklen = pair.mask.length()
         pair.r2.auto_adjust_match = True
@@ -287,14 +339,6 @@ class PartialFindProcessor(PairProcessor):
                 self._check_targetrc(pair)
                 return
 
-        ap = None
-        if run.handle_indels:
-            if run.allow_indeterminate:
-                simfn = lambda nt1, nt2: base_similarity_ind(nt1, nt2, run.indel_match_value, run.indel_mismatch_cost, .5 * run.indel_match_value)
-            else:
-                simfn = lambda nt1, nt2: AlignmentParams.char_sim(nt1, nt2, run.indel_match_value, run.indel_mismatch_cost)
-            ap = AlignmentParams(simfn, run.indel_gap_open_cost, run.indel_gap_extend_cost)
-
         ## And extend the match if necessary using string alignment on the rest
         aligned = False
         if pair.fully_matched:
@@ -302,8 +346,29 @@ class PartialFindProcessor(PairProcessor):
             if not self._verify_full_match(pair):
                 return
         elif run.handle_indels:
-            if not self._extend_match(pair, ap):
+            ## Align remaining R2 first to find adapter overhang.
+            ## TAI: probably better way of doing adapter alignment  (see indels_7 testcase)
+            r2suffix = "" if run.cotrans else reverse_complement(pair.r1.original_seq[:masklen]) + reverse_complement(run.adapter_t)
+            alignments = yield pair.r2.alignment_jobs(pair.target, r2suffix)
+            pair.r2.apply_alignments(pair.target, r2suffix, *alignments)
+            if run.dumbbell:
+                pair.dumbbell = pair.r2.match_index - dumblen
+
+            ## Trim the adapters off both R1 and R2
+            if not self._trim_adapters(pair):
+                if not pair.failure:
+                    pair.failure = Failures.adapter_trim
+                    self.counters.adapter_trim_failure += pair.multiplicity
                 return
+
+            ## Now align remaining R1 if necessary
+            if not pair.r1.fully_matched:
+                alignments = yield pair.r1.alignment_jobs(pair.target)
+                pair.r1.apply_alignments(pair.target, "", *alignments)
+                # we may have not trimmed enough
+                r1_overhang = pair.r1.right_est - pair.target.n
+                if r1_overhang > 0:
+                    pair.r1.ltrim += r1_overhang    # also updates match_len
             aligned = True
         elif not self._trim_adapters(pair):
             if not pair.failure:
@@ -323,7 +388,8 @@ class PartialFindProcessor(PairProcessor):
                 pair.r2.rtrim -= pair.r2.linker_trim_len
                 pair.r2.fully_rtrimmed = False
                 if run.handle_indels:
-                    pair.r2.extend_alignment(pair.target, ap)
+                    alignments = yield pair.r2.alignment_jobs(pair.target)
+                    pair.r2.apply_alignments(pair.target, "", *alignments)
                 else:
                     pair.r2.match_len += pair.r2.linker_trim_len
             if run.handle_indels and not pair.check_overlap(False):
@@ -404,7 +470,7 @@ class PartialFindProcessor(PairProcessor):
                 pair.failure = Failures.match_errors
                 self.counters.match_errors += pair.multiplicity
                 return
-            self.counters.low_quality_muts += pair.check_mutation_quality(run.mutations_require_quality_score)
+            self.counters.low_quality_muts += self._check_mutation_quality(pair)
 
         if run.count_only_full_reads and pair.left != 0:
             pair.failure = Failures.not_full_read
@@ -438,3 +504,11 @@ class PartialFindProcessor(PairProcessor):
         if run.count_mutations:
             self.counters.register_mapped_mut_count(pair)
 
+
+def _step(steps, alignments = None):
+    # advances the steps for a pair, returning the next alignment jobs,
+    # or None once it's done
+    try:
+        return steps.send(alignments)
+    except StopIteration:
+        return None
@@ -1,6 +1,10 @@
 
-from counters import Counters
-from mask import match_mask_optimized
+from collections import OrderedDict
+
+from counters import Counters, CountsRecorder
+from mask import match_mask_optimized, MaskClassifier
+from pair import Pair
+from timing import time_stages
 from util import _warn, _debug, reverse_complement, string_match_errors
 
 class Failures(object):
@@ -33,6 +37,12 @@ class Failures(object):
 
 class PairProcessor(object):
 
+    # (method, stage) for run.stage_timing; see timing.py
+    _timed_stages = ( ('process_pair', 'pair'),
+                      ('_match_mask', 'mask'),
+                      ('classify_masks', 'mask'),
+                      ('_check_mutation_quality', 'quality') )
+
     def __init__(self, run, targets, masks):
         self._run = run
         self._targets = targets
@@ -43,8 +53,16 @@ class PairProcessor(object):
         self._match_mask = self._match_mask_optimized if (run.masks[0] == 'RRRY' and run.masks[1] == 'YYYR') else self._match_mask_general
         if self._match_mask != self._match_mask_optimized:
             print("Warning: not using optimized mask match.")
+        self._mask_classifier = MaskClassifier(masks, optimized = (self._match_mask == self._match_mask_optimized))
         run.apply_config_restrictions()
         self.prepare()
+        self._pair_cache = None
+        if run.pair_cache_size > 0 and not (self.uses_tags or run.generate_sam or run.generate_channel_reads):
+            self._pair_cache = OrderedDict()
+            self._process_pair_uncached = self.process_pair
+            self.process_pair = self._process_pair_cached
+        if run.stage_timing:
+            time_stages(self, self._timed_stages, lambda stage, seconds: self.counters.add_stage_time(stage, seconds))
 
     def exists(self):
         return True
@@ -87,6 +105,18 @@ class PairProcessor(object):
             pair.failure = Failures.mask
             return False
 
+    def classify_masks(self, r1_seqs):
+        # the Mask that each of a batch of R1s matches, all at once (or
+        # None, in which case _match_mask() checks the pair as usual);
+        # see MaskClassifier. a pair can be set_mask() with it
+        # beforehand, as with a forced mask.
+        # (-1 picks the None at the end)
+        return map((self._masks + [ None ]).__getitem__, self._mask_classifier.classify(r1_seqs))
+
+    def _check_mutation_quality(self, pair):
+        # returns the number of mutations removed for low quality
+        return pair.check_mutation_quality(self._run.mutations_require_quality_score)
+
     def _check_indeterminate(self, pair):
         if not self._run.allow_indeterminate  and  not pair.is_determinate():
             pair.failure = Failures.indeterminate
@@ -99,3 +129,48 @@ class PairProcessor(object):
 
     def process_pair(self, pair):
         raise Exception("subclasses must override")
+
+    # the parts of the pair that processing fills in, which are
+    # restored on a cache hit (the rest is set by Pair.set_from_data)
+    _UNCACHED_PAIR_ATTRS = ( 'identifier', 'multiplicity' )
+
+    def _pair_cache_key(self, pair):
+        key = (pair.r1.original_seq, pair.r2.original_seq, pair.mask_label)
+        if self._run.mutations_require_quality_score is not None:
+            key += (pair.r1.quality, pair.r2.quality)
+        return key
+
+    def _process_pair_cached(self, pair):
+        key = self._pair_cache_key(pair)
+        cache = self._pair_cache
+        entry = cache.pop(key, None)
+        if entry is None:
+            self.counters.pair_cache_misses += 1
+            counters = self.counters
+            multiplicity = pair.multiplicity
+            recorder = self.counters = CountsRecorder(self._run)
+            pair.multiplicity = 1
+            try:
+                self._process_pair_uncached(pair)
+                recording = recorder.recording()
+            finally:
+                self.counters = counters
+                pair.multiplicity = multiplicity
+            if self._run.stage_timing:
+                counters.add_stage_times(recorder)
+            state = Pair()
+            state.copy_from(pair)
+            entry = (state, recording)
+            if len(cache) >= self._run.pair_cache_size:
+                cache.popitem(last = False)
+        else:
+            self.counters.pair_cache_hits += 1
+            pair.copy_from(entry[0], skip = self._UNCACHED_PAIR_ATTRS)
+        cache[key] = entry
+        self.counters.replay(entry[1], pair.multiplicity)
+
+    def process_pair_batch(self, pairs):
+        # processors that can handle a whole batch of pair data at
+        # once (registering directly in the counters) override this to
+        # return True
+        return False
@@ -2,6 +2,11 @@
 import math
 from mask import PLUS_PLACEHOLDER, MINUS_PLACEHOLDER
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class Profiles(object):
 
@@ -100,8 +105,11 @@ class Profiles(object):
             return self._profiles[target_name]
 
     def compute(self):
-        for profile in self._profiles.values():
-            profile.compute()
+        if numpy is not None:
+            _compute_vectorized(self._profiles.values(), self._run)
+        else:
+            for profile in self._profiles.values():
+                profile.compute()
 
     def write(self, target_path):
         with open(target_path, 'wb') as outfile:
@@ -409,3 +417,153 @@ class TargetProfiles(object):
     def data(self):
         return { "t" : self.treated_counts,
                  "u" : self.untreated_counts }
+
+
+# Vectorized equivalent of TargetProfiles.compute() (and
+# compute_mutated_profiles()), used when numpy is available. Profiles
+# are processed a block at a time as an (end x site) matrix, with
+# sites that would have hit an exception in the scalar code masked
+# out. Results are bit-identical to the scalar code: logs still use
+# math.log, running sums use a sequential cumsum, and the per-site
+# int/float types of the outputs are preserved.
+
+_VECTORIZED_BLOCK_SIZE = 256
+
+def _compute_vectorized(profiles, run):
+    profiles = sorted(profiles, key = lambda p : len(p.treated_counts))
+    for i in xrange(0, len(profiles), _VECTORIZED_BLOCK_SIZE):
+        block = profiles[i:i + _VECTORIZED_BLOCK_SIZE]
+        with numpy.errstate(all = 'ignore'):
+            _compute_block(block, run)
+            mutated = [ p for p in block if p.treated_muts or p.treated_inserts or p.treated_deletes ]
+            if mutated:
+                _compute_mutated_block(mutated, run)
+
+def _matrix(vects, ns, N):
+    # only the first n entries of each vect are used; missing entries are treated as 0
+    rows = []
+    for vect, n in zip(vects, ns):
+        row = list(vect[:n]) if vect else []
+        rows.append(row + [ 0 ] * (N - len(row)))
+    return numpy.array(rows, dtype = numpy.float64).reshape(len(vects), N)
+
+def _masked_log(vals, mask):
+    res = numpy.zeros(vals.shape)
+    res[mask] = map(math.log, vals[mask].tolist())
+    return res
+
+def _running_sums(vals):
+    # equivalent to `running -= val` for each val, starting from 0.0
+    if 0 == vals.shape[1]:
+        return [ 0.0 ] * vals.shape[0]
+    return (0.0 - numpy.cumsum(vals, axis = 1)[:, -1]).tolist()
+
+def _row_values(vals, mask, n, fail_val):
+    return [ v if m else fail_val for v, m in zip(vals[:n], mask[:n]) ]
+
+def _compute_block(block, run):
+    allow_negative_values = run.allow_negative_values
+    ns = [ len(p.treated_counts) - 1 for p in block ]
+    N = max(ns)
+    valid = numpy.arange(N)[None, :] < numpy.array(ns)[:, None]
+    tc = _matrix([ p.treated_counts for p in block ], ns, N)
+    uc = _matrix([ p.untreated_counts for p in block ], ns, N)
+    td = _matrix([ p.treated_depths for p in block ], ns, N)
+    ud = _matrix([ p.untreated_depths for p in block ], ns, N)
+
+    ok = valid & (td != 0) & (ud != 0)
+    Xbit = tc / td
+    Ybit = uc / ud
+    ok &= (1.0 - Ybit) != 0
+    betas = (Xbit - Ybit) / (1.0 - Ybit)
+    ok &= ((1.0 - Ybit) > 0) & ((1.0 - Xbit) > 0)
+    thetas = _masked_log(1.0 - Ybit, ok) - _masked_log(1.0 - Xbit, ok)
+    ok &= (1.0 - betas) > 0
+    c_sums = _running_sums(_masked_log(1.0 - betas, ok))
+    if not allow_negative_values:
+        betas = numpy.where(betas > 0.0, betas, 0.0)
+        thetas = numpy.where(thetas > 0.0, thetas, 0.0)
+    ok &= (1.0 - betas) > 0
+    c_thresh_sums = _running_sums(_masked_log(1.0 - betas, ok))
+    if run.compute_z_reactivity:
+        phat = (tc + uc) / (td + ud)
+        var = phat * (1.0 - phat) * ((1.0 / td) + (1.0 / ud))
+        ok &= var >= 0
+        se = numpy.sqrt(numpy.where(ok, var, 0.0))
+        z = numpy.where(se != 0, (Xbit - Ybit) / se, Xbit - Ybit)
+        if not allow_negative_values:
+            z = numpy.where(z > 0.0, z, 0.0)
+        z = z.tolist()
+
+    betas = betas.tolist()
+    thetas = thetas.tolist()
+    ok = ok.tolist()
+    for r, p in enumerate(block):
+        n = ns[r]
+        p.betas = _row_values(betas[r], ok[r], n, 0) + [ 0 ]
+        c_thresh = c_thresh_sums[r]
+        c_factor = 1.0 / c_thresh if c_thresh else 1.0
+        p.thetas = [ max(c_factor * th, 0) for th in _row_values(thetas[r], ok[r], n, 0) + [ 0 ] ]
+        p.rhos = [ n * th for th in p.thetas ]
+        p.z = (_row_values(z[r], ok[r], n, 0) if run.compute_z_reactivity else [ 0 ] * n) + [ 0 ]
+        p.c = c_sums[r]
+        p.c_thresh = c_thresh
+
+def _compute_mutated_block(block, run):
+    allow_negative_values = run.allow_negative_values
+    ns = [ len(p.treated_counts) - 1 for p in block ]
+    N = max(ns)
+    valid = numpy.arange(N)[None, :] < numpy.array(ns)[:, None]
+    mat = lambda attr : _matrix([ getattr(p, attr) for p in block ], ns, N)
+    tc, uc = mat('treated_counts'), mat('untreated_counts')
+    td, ud = mat('treated_depths'), mat('untreated_depths')
+    tqd, uqd = mat('treated_quality_depths'), mat('untreated_quality_depths')
+    # mut_j - Only one of { mut, insert, delete } is currently possible at a site per pair
+    mut_t = mat('treated_muts') + mat('treated_inserts') + mat('treated_deletes')
+    mut_u = mat('untreated_muts') + mat('untreated_inserts') + mat('untreated_deletes')
+
+    ok = valid & (tqd != 0) & (uqd != 0)
+    Tbit = mut_t / tqd
+    Ubit = mut_u / uqd
+    ok &= (1.0 - Ubit) != 0
+    mu = (Tbit - Ubit) / (1.0 - Ubit)
+    with_z = numpy.zeros(ok.shape, dtype = bool)
+    if run.compute_z_reactivity:
+        with_z = ok & (tqd + uqd > 0) & (td + ud > 0)
+        if not allow_negative_values:
+            # the scalar code fails on these sites (xref the z[k] NameError in compute_mutated_profiles)
+            ok &= ~with_z
+        else:
+            n1 = tqd + uqd
+            n2 = td + ud
+            phat = ((mut_t + mut_u) + (tc + uc)) / (n1 + n2)
+            var = phat * (1.0 - phat) * ((1.0 / n1) + (1.0 / n2))
+            ok &= ~with_z | (var >= 0)
+            se_z = numpy.sqrt(numpy.where(ok & with_z, var, 0.0))
+            Tboth = (mut_t + tc) / (0.5 * (tqd + td))
+            Uboth = (mut_u + uc) / (0.5 * (uqd + ud))
+            z = numpy.where(se_z > 0, (Tboth - Uboth) / se_z, Tboth - Uboth).tolist()
+    with_z = (with_z & ok).tolist()
+
+    c_inf = (ok & ~((1.0 - mu) > 0)).any(axis = 1).tolist()
+    c_sums = _running_sums(_masked_log(1.0 - mu, ok & ((1.0 - mu) > 0)))
+    if not allow_negative_values:
+        mu = numpy.where(mu > 0.0, mu, 0.0)
+    c_thresh_inf = (ok & ~((1.0 - mu) > 0)).any(axis = 1).tolist()
+    c_thresh_sums = _running_sums(_masked_log(1.0 - mu, ok & ((1.0 - mu) > 0)))
+
+    mu = mu.tolist()
+    ok = ok.tolist()
+    for r, p in enumerate(block):
+        n = ns[r]
+        p.mu = _row_values(mu[r], ok[r], n, 0.0) + [ 0 ]
+        p.r_mut = [ p.betas[j] + p.mu[j] for j in xrange(n) ] + [ 0 ]
+        p.z = [ (z[r][j] if with_z[r][j] else 0) if ok[r][j] else 0.0 for j in xrange(n) ] + [ 0 ]
+        if c_inf[r]:
+            p.c = float('inf')   # when c is infinite, pr of modification is 1
+        else:
+            p.c += c_sums[r]
+        if c_thresh_inf[r]:
+            p.c_thresh = float('inf')    # when c_thresh is infinite, pr of modification is 1
+        else:
+            p.c_thresh += c_thresh_sums[r]
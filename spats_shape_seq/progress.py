@@ -0,0 +1,148 @@
+
+#
+# live progress telemetry for SpatsWorker (run.progress_log and
+# Spats.progress_callback)
+#
+# general idea: on long runs, it's useful to see the throughput as it
+# goes, and whether the workers are kept busy or the input can't keep
+# up (or vice versa), in order to size num_workers and the batches.
+#
+# - each worker keeps a WorkerStats: pairs and batches processed, and
+#   the time spent processing batches (busy) vs. waiting for them
+#   (idle). it sends a snapshot of it to the parent now and then,
+#   and a final one along with its counts.
+#
+# - the parent combines the latest snapshots with what it sees itself:
+#   how full the batch queue is, how long it's been blocked on a full
+#   queue (backpressure: the workers can't keep up), and how long it's
+#   spent getting the next batch from the input (the input can't keep
+#   up). with the approximate number of pairs expected (e.g., from
+#   FastFastqParser.appx_number_of_pairs), that gives rates and an ETA.
+#
+# - every progress_interval seconds (and once at the end), a record
+#   (a dict, see ProgressMonitor._record) is appended as a JSON line to
+#   run.progress_log and/or passed to the callback.
+#
+
+import json
+import time
+
+
+class WorkerStats(object):
+
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.pairs = 0
+        self.batches = 0
+        self.busy = 0.0
+        self.idle = 0.0
+        self.max_latency = 0.0
+        self._last_sent = time.time()
+
+    def add_batch(self, pairs, seconds):
+        self.pairs += pairs
+        self.batches += 1
+        self.busy += seconds
+        if seconds > self.max_latency:
+            self.max_latency = seconds
+
+    def add_idle(self, seconds):
+        self.idle += seconds
+
+    def snapshot(self):
+        return (self.worker_id, self.pairs, self.batches, self.busy, self.idle, self.max_latency)
+
+    def due(self, interval):
+        # whether it's time to send a snapshot again
+        now = time.time()
+        if now - self._last_sent < interval:
+            return False
+        self._last_sent = now
+        return True
+
+
+class ProgressMonitor(object):
+    """Collects :class:`WorkerStats` snapshots and the parent's own
+    stats, and emits progress records every ``run.progress_interval``
+    seconds to ``run.progress_log`` and/or callback.
+    """
+
+    def __init__(self, run, num_workers, expected_pairs = None, queue_capacity = None, callback = None):
+        self._interval = run.progress_interval
+        self._callback = callback
+        self._log = open(run.progress_log, 'a') if run.progress_log else None
+        self._num_workers = num_workers
+        self._expected_pairs = expected_pairs
+        self._queue_capacity = queue_capacity
+        self._workers = {}
+        self._start = self._last = time.time()
+        self._last_pairs = 0
+        self.queue_wait = 0.0
+        self.input_wait = 0.0
+        self.batches_queued = 0
+
+    def update(self, snapshot):
+        # snapshots come over two queues, so may arrive out of order;
+        # busy + idle time only goes up, so keep the latest
+        last = self._workers.get(snapshot[0])
+        if not last  or  snapshot[3] + snapshot[4] >= last[3] + last[4]:
+            self._workers[snapshot[0]] = snapshot
+
+    def poll(self, queued = None):
+        """Emits a record if the interval has passed since the last one.
+        queued is the number of batches waiting for the workers, if known.
+        """
+        if time.time() - self._last >= self._interval:
+            self._emit(queued, False)
+
+    def finish(self):
+        self._emit(None, True)
+        if self._log:
+            self._log.close()
+            self._log = None
+
+    def _emit(self, queued, done):
+        record = self._record(queued, done)
+        if self._log:
+            self._log.write(json.dumps(record) + '\n')
+            self._log.flush()
+        if self._callback:
+            self._callback(record)
+
+    def _record(self, queued, done):
+        now = time.time()
+        elapsed = now - self._start
+        workers = [ self._workers[wid] for wid in sorted(self._workers.keys()) ]
+        pairs = sum(w[1] for w in workers)
+        recent_rate = float(pairs - self._last_pairs) / (now - self._last) if now > self._last else 0.0
+        rate = float(pairs) / elapsed if elapsed > 0 else 0.0
+        self._last = now
+        self._last_pairs = pairs
+        expected = self._expected_pairs
+        eta = None
+        if expected and not done:
+            eta_rate = recent_rate or rate
+            eta = float(max(0, expected - pairs)) / eta_rate if eta_rate else None
+        return { 'time' : now,
+                 'elapsed' : elapsed,
+                 'done' : done,
+                 'pairs' : pairs,
+                 'expected_pairs' : expected,
+                 'fraction_done' : (min(1.0, float(pairs) / expected) if expected else None),
+                 'pairs_per_sec' : rate,
+                 'recent_pairs_per_sec' : recent_rate,
+                 'eta' : eta,
+                 'batches_queued' : self.batches_queued,
+                 'queue_depth' : queued,
+                 'queue_capacity' : self._queue_capacity,
+                 'queue_wait' : self.queue_wait,
+                 'input_wait' : self.input_wait,
+                 'num_workers' : self._num_workers,
+                 'workers' : [ { 'id' : w[0],
+                                 'pairs' : w[1],
+                                 'batches' : w[2],
+                                 'busy' : w[3],
+                                 'idle' : w[4],
+                                 'utilization' : (w[3] / (w[3] + w[4]) if w[3] + w[4] > 0 else 0.0),
+                                 'mean_batch_latency' : (w[3] / w[2] if w[2] else 0.0),
+                                 'max_batch_latency' : w[5] } for w in workers ] }
@@ -3,8 +3,9 @@ import ast
 import sys
 
 from partial import PartialFindProcessor
+from hybrid import HybridProcessor
 from lookup import LookupProcessor, CotransLookupProcessor
-from native import CotransNativeProcessor
+from native import CotransNativeProcessor, NativeLookupProcessor
 from tag import TagProcessor
 from util import _warn
 
@@ -46,6 +47,46 @@ class Run(object):
         #: determine an appropriate value.
         self.minimum_target_match_length = 10
 
+        #: Defaults to ``False``. Set to ``True`` to index the targets
+        #: by 2-bit packed k-mer codes in sorted arrays, rather than a
+        #: dict of k-mer strings. Matching results are the same, and
+        #: so is the speed (to within ~10%); this uses several times
+        #: less memory for large target sets.
+        self.packed_target_index = False
+
+        #: Defaults to ``False``. Set to ``True`` to have the
+        #: ``find_partial`` algorithm find the longest target matches
+        #: via a suffix array over all of the targets, rather than by
+        #: extending every hit of the index words. Results are the
+        #: same, but the cost then scales with the read length rather
+        #: than the number of hits, which helps with large or
+        #: repetitive target sets.
+        self.suffix_array_search = False
+
+        #: Defaults to ``None``. Set to a directory path to cache data
+        #: computed from the targets (such as the target self-match
+        #: lengths used to build lookup tables), so that later runs
+        #: with the same targets can skip recomputing it.
+        self.cache_dir = None
+
+        #: Defaults to ``False``. If set to ``True`` (requires
+        #: ``cache_dir``), the lookup tables used by the ``lookup``
+        #: algorithm are written to a file in the ``cache_dir`` the
+        #: first time they're built for a set of targets and settings,
+        #: and memory-mapped read-only from there, so that later runs
+        #: start up quickly and worker processes share the tables
+        #: instead of each holding a copy.
+        self.mmap_lookup_tables = False
+
+        #: Defaults to ``False``. If set to ``True``, the ``lookup``
+        #: algorithm keys its tables by 2-bit packed sequences instead
+        #: of strings, which makes them small enough to hold every
+        #: variant within two substitutions of the target. With
+        #: ``count_mutations``, that allows ``allowed_target_errors``
+        #: of ``2`` with the ``lookup`` algorithm (for non-cotrans
+        #: runs), rather than forcing ``find_partial``.
+        self.compact_lookup_tables = False
+
 
         #: Defaults to ``False``. If set to ``True``, will count both
         #: stops and muations, and incorporate the mutation information
@@ -125,6 +166,66 @@ class Run(object):
         #: and only process unique counts.
         self.skip_database = True
 
+        #: Default ``False``, set to ``True`` to have each worker parse its
+        #: own record-aligned byte range of the (uncompressed) input
+        #: files, rather than having a single parser feed all workers.
+        #: Only used when processing data files with ``skip_database``
+        #: and more than one worker; the parsing throughput then
+        #: scales with :attr:`.num_workers`.
+        self.sharded_input = False
+
+        #: Default ``False``, set to ``True`` to collapse duplicate pairs
+        #: as they stream from the parser, so that each distinct
+        #: (R1, R2) is processed once per flush with its multiplicity,
+        #: without building a database. Only used when processing data
+        #: files with ``skip_database`` (and not with ``sharded_input``
+        #: or quality parsing). xref :attr:`.dedup_max_unique`.
+        self.dedup_pairs = False
+
+        #: Default ``262144``, the number of distinct pairs held by
+        #: :attr:`.dedup_pairs` before they are flushed on for
+        #: processing. Larger values collapse more duplicates at the
+        #: cost of memory.
+        self.dedup_max_unique = 262144
+
+        #: Default ``False``, set to ``True`` to pass batches of pairs
+        #: (and their results) between the main process and workers
+        #: via preallocated shared memory slots rather than pickling
+        #: them through queues. Uses roughly ``num_workers + 2`` batches'
+        #: worth of memory; batches which don't fit are sent as usual.
+        self.shared_memory_batches = False
+
+        #: Default ``0``, set to a number of pairs to keep a
+        #: least-recently-used cache of that many processing outcomes,
+        #: keyed by the pair sequences, so that repeats of the same
+        #: pair replay the cached counts rather than being processed
+        #: again. Hit rates are reported in the run summary. Not used
+        #: with :attr:`.generate_sam`, :attr:`.generate_channel_reads`
+        #: or tag processing.
+        self.pair_cache_size = 0
+
+        #: Default ``False``, set to ``True`` to time each stage of pair
+        #: processing (mask matching, target matching, adapter
+        #: trimming, alignment, quality checks and registering counts).
+        #: The times and call counts are summed over all workers and
+        #: printed in the run summary; they can also be written out
+        #: with ``spats_tool dump timing``. Adds a small overhead to
+        #: every pair.
+        self.stage_timing = False
+
+        #: Default ``None``, set to a file path to append a JSON record
+        #: of the progress of a run every :attr:`.progress_interval`
+        #: seconds, one per line: pairs processed, rates and ETA,
+        #: how full the worker queue is and how long the input and
+        #: the workers spend waiting on each other, and per-worker
+        #: utilization and batch latencies. xref
+        #: :attr:`.spats.Spats.progress_callback`.
+        self.progress_log = None
+
+        #: Default ``10``, the number of seconds between progress
+        #: records; see :attr:`.progress_log`.
+        self.progress_interval = 10
+
         #: Default ``None``, in which case the pair length is detected
         #: from input data. Otherwise, can be set explicitly.
         self.pair_length = None
@@ -171,7 +272,11 @@ class Run(object):
         #: `reads` tool and the ``find_partial`` algorithms.
         self.regions_of_interest = None
 
-        #: Default ``find_partial``, set to ``lookup`` to use the lookup optimization.
+        #: Default ``find_partial``, set to ``lookup`` to use the lookup optimization,
+        #: or to ``native`` to use the lookup optimization with batches of pairs
+        #: processed in the native engine (if built via ``make -C native lib``).
+        #: ``hybrid`` handles exact matches via lookup and everything else via
+        #: ``find_partial``, with the same results as ``find_partial`` alone.
         self.algorithm = "find_partial"
 
         #: Default ``False``, set to ``True`` to allow beta, theta,
@@ -272,6 +377,18 @@ class Run(object):
         #: Only applies when ``handle_indels`` is True.
         self.indel_gap_extend_cost = 1
 
+        #: Default ``None`` (align the full matrix), set to a number of
+        #: nucleotides to limit the Smith-Waterman alignment to that many
+        #: diagonals either side of the main one. Much faster, and uses
+        #: memory proportional to the read length rather than read
+        #: length times target length. Indels that add up to a larger
+        #: shift than the band won't be found. The band can also change
+        #: which alignment wins, so the results can differ from the full
+        #: alignment in either direction: a pair that fails to match
+        #: with the full alignment may match with a band, or vice versa.
+        #: Only applies when ``handle_indels`` is True.
+        self.indel_alignment_band = None
+
         # private config that should be persisted (use _p_ prefix)
         self._p_use_tag_processor = False
         self._p_processor_class = None
@@ -295,11 +412,15 @@ class Run(object):
         if self.count_mutations:
             self.allowed_target_errors = max(self.allowed_target_errors, 1)
         if self.handle_indels:
-            self.algorithm = 'find_partial'
+            if self.algorithm != 'hybrid':
+                self.algorithm = 'find_partial'
             if not self.count_mutations:
                 raise Exception("count_mutations should be True if using handle_indels.")
         if self.dumbbell and self.cotrans:
             self.algorithm = 'find_partial'
+        if self.algorithm == 'hybrid' and (self.cotrans or self.dumbbell):
+            # the lookup tier only knows the non-cotrans, no-dumbbell layout
+            self.algorithm = 'find_partial'
         if self.allowed_dumbbell_errors > 0:
             self.algorithm = 'find_partial'
         if self.collapse_left_prefixes:
@@ -317,8 +438,15 @@ class Run(object):
             for primer in self._p_rt_primers_list:
                 if len(primer) < self.minimum_target_match_length:
                     _warn("rt_primer `{}` shorter than minimum_target_match_length={}.".format(primer, self.minimum_target_match_length))
-        if self.count_left_prefixes or self.allow_multiple_rt_starts or self.allowed_target_errors > 1 or not self.ignore_stops_with_mismatched_overlap:
+        max_lookup_errors = 2 if (self.compact_lookup_tables and self.count_mutations and not self.cotrans) else 1
+        if self.algorithm == 'hybrid':
+            # the lookup tier only takes exact matches, so any errors are fine
+            max_lookup_errors = self.allowed_target_errors
+        if self.count_left_prefixes or self.allow_multiple_rt_starts or self.allowed_target_errors > max_lookup_errors or not self.ignore_stops_with_mismatched_overlap:
             self.algorithm = 'find_partial'
+        if self.compact_lookup_tables and self.algorithm == 'native' and not self.cotrans:
+            # the native engine builds its own (single-substitution) tables
+            self.algorithm = 'lookup'
         if self.regions_of_interest:
             self.algorithm = 'find_partial'
             try:
@@ -349,6 +477,8 @@ class Run(object):
             raise Exception('Invalid mutations_require_quality_score value: {}'.format(self.mutations_require_quality_score))
         if self.count_edge_mutations and (self.count_edge_mutations != 'stop_only' and self.count_edge_mutations != 'stop_and_mut'):
             raise Exception('Invalid count_edge_mutations value: {}'.format(self.count_edge_mutations))
+        if self.compact_lookup_tables and self.mmap_lookup_tables:
+            raise Exception('compact_lookup_tables and mmap_lookup_tables cannot be used together')
         if not self._unsafe_skip_error_restrictions:
             if self.handle_indels:
                 if self.allowed_target_errors > 2:
@@ -370,8 +500,9 @@ class Run(object):
         elif self.algorithm == 'lookup':
             return CotransLookupProcessor if self.cotrans else LookupProcessor
         elif self.algorithm == 'native':
-            assert(self.cotrans)
-            return CotransNativeProcessor
+            return CotransNativeProcessor if self.cotrans else NativeLookupProcessor
+        elif self.algorithm == 'hybrid':
+            return HybridProcessor
         assert(False)
         return PartialFindProcessor
 
@@ -3,17 +3,26 @@ from util import _debug, reverse_complement, align_strings, Indel, string_match_
 
 class Sequence(object):
 
+    # the trimmed strings (and their reverses) are asked for many times
+    # while processing a pair, so they're built once and kept until the
+    # trims (or the quality) change
+    __slots__ = ( '_seq', '_needs_rc', '_length', '_ltrim', '_rtrim', '_quality',
+                  '_subseq', '_seq_rc', '_subquality', '_reverse_quality',
+                  'match_start', 'match_len', 'match_index', 'target_len', 'adapter_errors', 'match_errors',
+                  'indels', 'indels_delta', '_seq_with_indels', '_quality_with_indels', 'auto_adjust_match',
+                  'adapter_trimmed', 'fully_rtrimmed', 'linker_start', 'linker_trim_len', 'tags' )
+
     def __init__(self):
         self._reset(None, False)
 
     def _reset(self, seq, needs_rc):
         self._seq = seq.upper() if seq else None
         self._needs_rc = needs_rc
-        self._seq_rc = None
         self._length = len(seq) if seq else None
         self._ltrim = 0
         self._rtrim = 0
-        self.quality = None
+        self._quality = None
+        self._clear_trimmed()
         self.match_start = None
         self.match_len = None
         self.match_index = None
@@ -27,6 +36,19 @@ class Sequence(object):
         self.auto_adjust_match = False
         self.adapter_trimmed = None
         self.fully_rtrimmed = False
+        self.linker_start = None
+        self.linker_trim_len = None
+        self.tags = None
+
+    def _clear_trimmed(self):
+        self._subseq = None
+        self._seq_rc = None
+        self._subquality = None
+        self._reverse_quality = None
+
+    def copy_from(self, other):
+        for attr in Sequence.__slots__:
+            setattr(self, attr, getattr(other, attr))
 
     def set_seq(self, seq, needs_reverse_complement = False):
         assert(seq)
@@ -57,17 +79,31 @@ class Sequence(object):
 
     @property
     def subsequence(self):
-        if self._rtrim:
-            return self._seq[self._ltrim:-self._rtrim]
-        else:
-            return self._seq[self._ltrim:]
+        if self._subseq is None:
+            if self._rtrim:
+                self._subseq = self._seq[self._ltrim:-self._rtrim]
+            else:
+                self._subseq = self._seq[self._ltrim:]
+        return self._subseq
+
+    @property
+    def quality(self):
+        return self._quality
+
+    @quality.setter
+    def quality(self, val):
+        self._quality = val
+        self._subquality = None
+        self._reverse_quality = None
 
     @property
     def subquality(self):
-        if self._rtrim:
-            return self.quality[self._ltrim:-self._rtrim]
-        else:
-            return self.quality[self._ltrim:]
+        if self._subquality is None:
+            if self._rtrim:
+                self._subquality = self._quality[self._ltrim:-self._rtrim]
+            else:
+                self._subquality = self._quality[self._ltrim:]
+        return self._subquality
 
     @property
     def seq_len(self):
@@ -81,7 +117,9 @@ class Sequence(object):
 
     @property
     def reverse_quality(self):
-        return self.subquality[::-1]
+        if self._reverse_quality is None:
+            self._reverse_quality = self.subquality[::-1]
+        return self._reverse_quality
 
     @property
     def matched(self):
@@ -111,7 +149,7 @@ class Sequence(object):
     @ltrim.setter
     def ltrim(self, val):
         self._ltrim = val
-        self._seq_rc = None
+        self._clear_trimmed()
 
     @property
     def rtrim(self):
@@ -122,7 +160,7 @@ class Sequence(object):
         changed = (val != self._rtrim)
         self._rtrim = val
         if changed:
-            self._seq_rc = None
+            self._clear_trimmed()
             if self.auto_adjust_match:
                 self.trim_indels()          # should only matter for R2 since R1 won't have indels when rtrimmed
                 self.match_errors = [ err for err in self.match_errors if err < self.seq_len - self.indels_delta ]
@@ -159,6 +197,7 @@ class Sequence(object):
                 self._rtrim -= self.match_index
             else:
                 self._ltrim -= self.match_index
+            self._clear_trimmed()
             self.match_index = 0
         self.match_len = self.seq_len
 
@@ -208,15 +247,41 @@ class Sequence(object):
         self.indels = newindels
 
     def extend_alignment(self, target, ap, suffix = ""):
+        front, back = self.alignment_jobs(target, suffix)
+        self.apply_alignments(target, suffix,
+                              align_strings(front[0], front[1], ap) if front else None,
+                              align_strings(back[0], back[1], ap) if back else None)
+
+    def alignment_jobs(self, target, suffix = ""):
+        """Returns the (source, target) string pairs that extend_alignment()
+        aligns towards the front and back of the match (each None if there's
+        nothing to align there), so that they can be aligned elsewhere (see
+        align_strings_batch) and handed to apply_alignments().
+        """
+        front = back = None
         read_end = self.match_start + self.match_len + self.indels_delta
         if self.match_start > 0  and  self.match_index > 0:
-            ## Extend towards left/front/5' end...
             front_read = self.reverse_complement[:self.match_start] if self._needs_rc else self.subsequence[:self.match_start]
             front_target = target.seq[:self.match_index]
             # Reverse strings for front-bias since their ends are more likely to align...
-            align_front = align_strings(front_read[::-1], front_target[::-1], ap)
-            align_front.flip()
+            front = (front_read[::-1], front_target[::-1])
+        target_end = self.match_index + self.match_len
+        if read_end < self.seq_len and (target_end < target.n  or  len(suffix) > 0):
+            back_read = self.reverse_complement[read_end:] if self._needs_rc else self.subsequence[read_end:]
+            back_target = target.seq[target_end:] + suffix
+            back = (back_read, back_target)
+        return front, back
 
+    def apply_alignments(self, target, suffix, align_front, align_back):
+        # align_front and align_back are the Alignments for the jobs from
+        # alignment_jobs(), or None where there wasn't one. note that
+        # target_end doesn't change when extending at the front.
+        read_end = self.match_start + self.match_len + self.indels_delta
+        if align_front:
+            ## Extend towards left/front/5' end...
+            front_read = self.reverse_complement[:self.match_start] if self._needs_rc else self.subsequence[:self.match_start]
+            front_target = target.seq[:self.match_index]
+            align_front.flip()
             if align_front.score > 0.0:
                 tlen = len(front_target)
                 if tlen - align_front.target_match_end - 1 > 0:
@@ -246,12 +311,10 @@ class Sequence(object):
                 self.match_errors += [ e for e in xrange(m) if front_read[e + self.match_start] != front_target[e + self.match_index] ]
 
         target_end = self.match_index + self.match_len
-        if read_end < self.seq_len and (target_end < target.n  or  len(suffix) > 0):
+        if align_back:
             ## Extend towards right/rear/3' end...
             back_read = self.reverse_complement[read_end:] if self._needs_rc else self.subsequence[read_end:]
             back_target = target.seq[target_end:] + suffix
-            align_back = align_strings(back_read, back_target, ap)
-
             if align_back.score > 0.0:
                 if align_back.target_match_start > 0:
                     delseq = back_target[:align_back.target_match_start]
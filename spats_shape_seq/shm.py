@@ -0,0 +1,162 @@
+
+import ctypes
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+from processor import Failures
+from mask import PLUS_PLACEHOLDER, MINUS_PLACEHOLDER
+
+
+# stands in for a target rowid of None
+_NO_TARGET = -(1 << 31)
+
+class _SharedResult(ctypes.Structure):
+    _fields_ = [ ("ident", ctypes.c_longlong),
+                 ("target", ctypes.c_int),
+                 ("mask", ctypes.c_int),
+                 ("site", ctypes.c_int),
+                 ("end", ctypes.c_int),
+                 ("muts", ctypes.c_int),
+                 ("multiplicity", ctypes.c_int),
+                 ("failure", ctypes.c_int) ]
+
+
+class _Slot(object):
+
+    def __init__(self, capacity, data_size, num_fields):
+        self.lengths = RawArray(ctypes.c_int, capacity * num_fields)
+        self.multiplicities = RawArray(ctypes.c_int, capacity)
+        self.idents = RawArray(ctypes.c_longlong, capacity)
+        self.data = RawArray(ctypes.c_char, data_size)
+        self.results = RawArray(_SharedResult, capacity)
+
+
+def num_slots_for(num_workers):
+    '''The number of slots for all of the batches that can be in flight:
+    a full queue (``2 * num_workers``), one per worker, and the one
+    being filled.
+    '''
+    return 3 * num_workers + 1
+
+
+class SharedBatches(object):
+    '''Fixed-size shared memory slots used to move batches of pairs to
+    the workers, and results back, without pickling each pair.
+
+    Only slot indices go through the queues. Each slot holds the
+    multiplicities, identifiers, and lengths of up to ``capacity``
+    pairs, plus their sequences (and qualities) packed end-to-end in a
+    preallocated byte buffer; results are written into a structured
+    array. A batch that doesn't fit (or whose identifiers aren't
+    integers) is left to be sent through the queue as usual.
+
+    The parent waits for a free slot, so there should be enough of them
+    for every batch in flight: see :func:`num_slots_for`.
+    '''
+
+    def __init__(self, first_batch, num_slots, use_quality, masks):
+        self.capacity = len(first_batch)
+        self.num_fields = 4 if use_quality else 2
+        per_pair = sum(max(len(p[i]) for p in first_batch) for i in self._field_indices())
+        self.data_size = self.capacity * per_pair
+        self.slots = [ _Slot(self.capacity, self.data_size, self.num_fields) for i in xrange(num_slots) ]
+        self.free_slots = multiprocessing.Queue()
+        for i in xrange(num_slots):
+            self.free_slots.put(i)
+        self.mask_labels = [ "" ] + list(masks) + [ PLUS_PLACEHOLDER, MINUS_PLACEHOLDER ]
+        self.mask_codes = { m : i for i, m in enumerate(self.mask_labels) }
+        self.failures = Failures.all_failures()
+        self.failure_codes = { f : i for i, f in enumerate(self.failures) }
+        # (parent side) batches sent through slots, and through the queue
+        self.num_slot_batches = 0
+        self.num_queue_batches = 0
+
+    def _field_indices(self):
+        return (1, 2, 4, 5) if 4 == self.num_fields else (1, 2)
+
+    # parent side
+
+    def put(self, batch, timeout = None):
+        '''Packs the batch into a free slot, waiting for one (up to
+        ``timeout`` seconds, if given) if need be. Returns the slot info
+        to pass to the worker, or ``None`` if the batch doesn't fit.
+        Raises ``Queue.Empty`` if no slot was freed in time.
+        '''
+        n = len(batch)
+        if n > self.capacity:
+            self.num_queue_batches += 1
+            return None
+        cols = zip(*batch)
+        idents = cols[3]
+        if not all(isinstance(i, (int, long)) for i in idents):
+            if idents != tuple(str(i) for i in xrange(n)):
+                self.num_queue_batches += 1
+                return None
+            idents = xrange(n)    # as from FastFastqParser.iterator_read, rebuilt in the worker
+            str_idents = True
+        else:
+            str_idents = False
+        fields = [ cols[i] for i in self._field_indices() ]
+        data = ''.join(''.join(map(str, f)) for f in fields)
+        if len(data) > self.data_size:
+            self.num_queue_batches += 1
+            return None
+        slot_index = self.free_slots.get(True, timeout)
+        self.num_slot_batches += 1
+        slot = self.slots[slot_index]
+        slot.multiplicities[:n] = list(cols[0])
+        slot.idents[:n] = list(idents)
+        for i, f in enumerate(fields):
+            slot.lengths[i * n:(i + 1) * n] = map(len, f)
+        ctypes.memmove(slot.data, data, len(data))
+        return (slot_index, n, str_idents)
+
+    def results(self, slot_index, n):
+        '''Unpacks results into the list format of ``SpatsWorker._make_result``, and frees the slot.
+        '''
+        masks = self.mask_labels
+        failures = self.failures
+        res = [ [ r.ident,
+                  r.target if r.target != _NO_TARGET else None,
+                  masks[r.mask],
+                  r.site,
+                  r.end,
+                  r.muts,
+                  r.multiplicity,
+                  failures[r.failure] if r.failure >= 0 else None ] for r in self.slots[slot_index].results[:n] ]
+        self.free_slots.put(slot_index)
+        return res
+
+    # worker side
+
+    def get(self, slot_info):
+        '''Returns the list of pair tuples stored in the slot.
+        '''
+        slot_index, n, str_idents = slot_info
+        slot = self.slots[slot_index]
+        lengths = slot.lengths[:n * self.num_fields]
+        data = ctypes.string_at(slot.data, sum(lengths))
+        fields = []
+        pos = 0
+        for i in xrange(self.num_fields):
+            strs = []
+            for l in lengths[i * n:(i + 1) * n]:
+                strs.append(data[pos:pos + l])
+                pos += l
+            fields.append(strs)
+        idents = map(str, xrange(n)) if str_idents else slot.idents[:n]
+        return zip(slot.multiplicities[:n], fields[0], fields[1], idents, *fields[2:])
+
+    def set_result(self, slot_info, i, ident, pair):
+        r = self.slots[slot_info[0]].results[i]
+        r.ident = ident
+        r.target = pair.target.rowid if pair.target and pair.target.rowid is not None else _NO_TARGET
+        r.mask = self.mask_codes[pair.mask_label]
+        r.site = pair.site if pair.has_site else -1
+        r.end = pair.end if pair.has_site else -1
+        r.muts = len(pair.mutations) if pair.mutations else -1
+        r.multiplicity = pair.multiplicity
+        r.failure = self.failure_codes[pair.failure] if pair.failure else -1
+
+    def release(self, slot_info):
+        self.free_slots.put(slot_info[0])
@@ -172,14 +172,16 @@
 #
 
 
+import multiprocessing
 import os
 import time
 import re
 
 from db import PairDB
 from mask import Mask, PLUS_PLACEHOLDER, MINUS_PLACEHOLDER
+from native import NativeEngine
 from pair import Pair
-from parse import fasta_parse, FastFastqParser
+from parse import dedup_pair_batches, fasta_parse, fastq_shards, is_gzipped, FastFastqParser
 from profiles import Profiles
 from run import Run
 from target import Targets
@@ -202,6 +204,10 @@ class Spats(object):
         self._masks = None
         self._profiles = None
         self.force_mask = None
+        #: Default ``None``, set to a function to have it called with
+        #: each progress record (a ``dict``) while processing pairs;
+        #: see :attr:`.run.Run.progress_log`.
+        self.progress_callback = None
 
 
     @property
@@ -321,13 +327,37 @@ class Spats(object):
         self.run.apply_config_restrictions()
         self.force_mask = Mask(force_mask) if force_mask else None
         use_quality = self.run._parse_quality
-        if not self.run.skip_database and not use_quality:
+        # the in-process native engine handles whole batches directly from the parser
+        native = ('native' == self.run.algorithm and NativeEngine.available())
+        if not self.run.skip_database and not use_quality and not native:
             self.process_pair_db(self._memory_db_from_pairs(data_r1_path, data_r2_path))
         else:
             with FastFastqParser(data_r1_path, data_r2_path, use_quality) as parser:
                 if not self.run.pair_length:
                     self.run.pair_length = parser.pair_length()
-                self._process_pair_iter(parser.iterator(batch_size = 131072))
+                expected_pairs = parser.appx_number_of_pairs() if self._tracks_progress() else None
+                if self._use_sharded_input(data_r1_path, data_r2_path):
+                    num_workers = self.run.num_workers or multiprocessing.cpu_count()
+                    # more shards than workers, so that the load balances out at the end
+                    shards = fastq_shards(data_r1_path, data_r2_path, 4 * num_workers)
+                    self._process_pair_iter(iter(shards), expected_pairs = expected_pairs)
+                elif self.run.dedup_pairs and not use_quality:
+                    self._process_pair_iter(dedup_pair_batches(parser.iterator(batch_size = 131072), self.run.dedup_max_unique, 16384), expected_pairs = expected_pairs)
+                else:
+                    self._process_pair_iter(parser.iterator(batch_size = 131072), expected_pairs = expected_pairs)
+
+    def _tracks_progress(self):
+        return bool(self.run.progress_log or self.progress_callback)
+
+    def _use_sharded_input(self, data_r1_path, data_r2_path):
+        run = self.run
+        if not run.sharded_input  or  run._run_limit  or  1 == max(1, run.num_workers or multiprocessing.cpu_count()):
+            return False
+        if is_gzipped(data_r1_path) or is_gzipped(data_r2_path):
+            if not run.quiet:
+                print("Note: sharded_input is not supported for compressed inputs.")
+            return False
+        return True
 
     def process_pair_db(self, pair_db, batch_size = 65536):
         """Processes pair data provided by a :class:`.db.PairDB`.
@@ -360,10 +390,13 @@ class Spats(object):
         else:
             db_iter = pair_db.unique_pairs_with_counts(batch_size = batch_size)
 
-        self._process_pair_iter(db_iter, pair_db, result_set_id)
+        # (only known up front when all of the pairs are processed)
+        resuming = self.run.resume_processing or self.run._redo_tag
+        expected_pairs = pair_db.count() if self._tracks_progress() and not resuming else None
+        self._process_pair_iter(db_iter, pair_db, result_set_id, expected_pairs)
 
     #@profile
-    def _process_pair_iter(self, pair_iter, pair_db = None, result_set_id = None):
+    def _process_pair_iter(self, pair_iter, pair_db = None, result_set_id = None, expected_pairs = None):
 
         _set_debug(self.run)
 
@@ -372,12 +405,12 @@ class Spats(object):
         # force the processor to load and do whatever indexing/etc is required
         self._processor
 
-        worker = SpatsWorker(self.run, self._processor, pair_db, result_set_id, self.force_mask)
+        worker = SpatsWorker(self.run, self._processor, pair_db, result_set_id, self.force_mask, self.progress_callback)
 
         if not self.run.quiet:
             print("Processing pairs{}...".format(" with mask='{}'".format(self.force_mask.chars) if self.force_mask else ""))
 
-        worker.run(pair_iter)
+        worker.run(pair_iter, expected_pairs)
 
         if not self.run.quiet:
             self._report_counts(time.time() - start)
@@ -391,6 +424,10 @@ class Spats(object):
         skip_keypat = re.compile("(prefix_)|(mut_count_)|(indel_len)")
         skipped_some = False
         countinfo = counters.counts_dict()
+        cache_hits = countinfo.pop("pair_cache_hits", 0)
+        cache_misses = countinfo.pop("pair_cache_misses", 0)
+        lookup_tier = countinfo.pop("lookup_tier_pairs", 0)
+        find_partial_tier = countinfo.pop("find_partial_tier_pairs", 0)
         for key in sorted(countinfo.keys(), key = lambda k : countinfo[k], reverse = True):
             if skip_keypat.search(key):
                 skipped_some = True
@@ -407,6 +444,21 @@ class Spats(object):
             for tgt in sorted(self._targets.targets, key = lambda t : tmap[t.name], reverse = True):
                 if tmap[tgt.name] > 0:
                     print("  {}: {} ({:.1f}%)".format(tgt.name, tmap[tgt.name], (100.0 * float(tmap[tgt.name])) / float(total) if total else 0))
+        if cache_hits or cache_misses:
+            lookups = cache_hits + cache_misses
+            print("Pair cache: {} hits / {} lookups ({:.1f}%)".format(cache_hits, lookups, (100.0 * float(cache_hits)) / float(lookups)))
+        if lookup_tier or find_partial_tier:
+            tiered = lookup_tier + find_partial_tier
+            print("Hybrid: {} lookup / {} find_partial ({:.1f}% via lookup)".format(lookup_tier, find_partial_tier, (100.0 * float(lookup_tier)) / float(tiered)))
+        stage_times = counters.stage_times()
+        if stage_times:
+            # 'pair' is the whole of process_pair(); see timing.py
+            pair_time = stage_times.get('pair', (0, 0))[0]
+            print("Stage timing (summed over workers):")
+            for stage in sorted(stage_times.keys(), key = lambda s : stage_times[s][0], reverse = True):
+                seconds, calls = stage_times[stage]
+                share = " ({:.1f}% of pair)".format(100.0 * seconds / pair_time) if pair_time and stage != 'pair' else ""
+                print("  {} : {:.2f}s, {} calls, {:.2f}us/call{}".format(stage, seconds, calls, 1e6 * seconds / calls if calls else 0, share))
         if skipped_some:
             print("Some counters not printed above; use 'spats_tool dump ...' commands to obtain.")
         if delta:
@@ -0,0 +1,329 @@
+
+#
+# suffix array search for Targets.find_partial
+#
+# general idea: find_partial seeds on index words at regularly-spaced
+# sites in the query, extends every hit to a maximal match, and keeps
+# the longest. so, with many (or repetitive) targets, the cost grows
+# with the number of hits for each seed. but the answer only depends
+# on the longest exact matches between the query and the targets,
+# which can be found directly from a suffix array over all of the
+# targets -- a couple of binary searches per query position.
+#
+# - the targets are concatenated, each followed by a '\0' separator,
+#   so that no match can span two targets.
+#
+# - for each query position p, the longest match starting there is
+#   found from the neighbors of where query[p:] would be inserted in
+#   the suffix array. only positions starting with a full index word
+#   matter (shorter matches are never found by the seeds), so the
+#   search for p is limited to the bucket of suffixes starting with
+#   that word.
+#
+# - the longest matches are then ordered the same way as the seed
+#   search would have discovered them (by the first check site they
+#   cover, then target, then position), so that the chosen match and
+#   the multiple-target ties come out identical.
+#
+# - longest_match() treats IUPAC codes as matching their
+#   nucleotides, which exact matching can't do; so this only handles
+#   ACGT-only queries and targets, and find_partial falls back to the
+#   seeds otherwise.
+#
+
+from array import array
+from bisect import bisect_right
+
+from util import _KMER_DIGITS
+
+
+_SEPARATOR = '\0'
+_INITIAL_SORT_LENGTH = 16
+_MAX_BUCKET_WORD_LENGTH = 10
+
+
+class TargetSuffixArray(object):
+
+    def __init__(self, targets, word_len):
+        self._targets = targets
+        self._word_len = word_len
+        self.usable = all(is_acgt(target.seq) for target in targets)
+        if not self.usable:
+            return
+        self._text = _SEPARATOR.join(target.seq for target in targets) + _SEPARATOR
+        self._starts = array('L')
+        start = 0
+        for target in targets:
+            self._starts.append(start)
+            start += target.n + 1
+        self._sa = self._build()
+        self._buckets = self._build_buckets() if word_len <= _MAX_BUCKET_WORD_LENGTH else None
+
+    def _build(self):
+        # prefix doubling (a la Larsson-Sadakane), where the rank of a
+        # suffix is the start of its group in the sorted order. only the
+        # order up to (and including) a suffix's separator matters, since
+        # a query never matches across one: so groups whose shared prefix
+        # reaches a separator don't need to be sorted any further.
+        text = self._text
+        n = len(text)
+        k = _INITIAL_SORT_LENGTH
+        sa = array('L', sorted(xrange(n), key = lambda i: text[i:i + k]))
+        rank = array('L', [ 0 ]) * n
+        groups = []
+        start = 0
+        for idx in xrange(1, n + 1):
+            if idx == n or text[sa[idx]:sa[idx] + k] != text[sa[start]:sa[start] + k]:
+                for j in xrange(start, idx):
+                    rank[sa[j]] = start
+                if idx - start > 1 and _SEPARATOR not in text[sa[start]:sa[start] + k]:
+                    groups.append((start, idx))
+                start = idx
+        while groups:
+            updates = []
+            next_groups = []
+            for start, end in groups:
+                members = sorted(sa[start:end], key = lambda i: rank[i + k])
+                sa[start:end] = array('L', members)
+                sub_start = start
+                for idx in xrange(start + 1, end + 1):
+                    if idx == end or rank[sa[idx] + k] != rank[sa[sub_start] + k]:
+                        for j in xrange(sub_start, idx):
+                            updates.append((sa[j], sub_start))
+                        if idx - sub_start > 1 and _SEPARATOR not in text[sa[sub_start]:sa[sub_start] + 2 * k]:
+                            next_groups.append((sub_start, idx))
+                        sub_start = idx
+            for i, r in updates:
+                rank[i] = r
+            groups = next_groups
+            k *= 2
+        return sa
+
+    def _build_buckets(self):
+        # the range of the suffix array starting with each index word
+        text = self._text
+        sa = self._sa
+        word_len = self._word_len
+        lo = array('L', [ 0 ]) * (1 << (2 * word_len))
+        hi = array('L', [ 0 ]) * (1 << (2 * word_len))
+        for idx in xrange(len(sa)):
+            word = text[sa[idx]:sa[idx] + word_len]
+            if _SEPARATOR in word or len(word) < word_len:
+                continue
+            code = int(word.translate(_KMER_DIGITS), 4)
+            if hi[code] == 0:
+                lo[code] = idx
+            hi[code] = idx + 1
+        return lo, hi
+
+    def _bucket(self, query, p):
+        word = query[p:p + self._word_len]
+        if self._buckets:
+            code = int(word.translate(_KMER_DIGITS), 4)
+            return self._buckets[0][code], self._buckets[1][code]
+        lo = self._lower_bound(word, 0, len(self._sa))
+        return lo, self._upper_bound(word, lo, len(self._sa))
+
+    def _lower_bound(self, q, lo, hi):
+        text = self._text
+        sa = self._sa
+        m = len(q)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i = sa[mid]
+            if text[i:i + m] < q:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _upper_bound(self, q, lo, hi):
+        text = self._text
+        sa = self._sa
+        m = len(q)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i = sa[mid]
+            if text[i:i + m] <= q:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _common_length(self, q, i, known):
+        text = self._text
+        m = len(q)
+        l = known
+        while l < m and text[i + l] == q[l]:
+            l += 1
+        return l
+
+    def longest_matches(self, query):
+        """Returns (length, [ (query_index, text_index), ... ]) for all of
+        the longest exact matches of at least the index word length, or
+        (0, []) if there aren't any.
+        """
+        word_len = self._word_len
+        sa = self._sa
+        best = word_len
+        at_best = []
+        for p in xrange(len(query) - word_len + 1):
+            if len(query) - p < best:
+                break
+            lo, hi = self._bucket(query, p)
+            if lo == hi:
+                continue
+            q = query[p:]
+            ins = self._lower_bound(q, lo, hi)
+            length = word_len
+            if ins > lo:
+                length = self._common_length(q, sa[ins - 1], word_len)
+            if ins < hi:
+                length = max(length, self._common_length(q, sa[ins], word_len))
+            if length > best:
+                best = length
+                at_best = [ (p, lo, hi) ]
+            elif length == best:
+                at_best.append((p, lo, hi))
+        matches = []
+        for p, lo, hi in at_best:
+            q = query[p:p + best]
+            start = self._lower_bound(q, lo, hi)
+            for idx in xrange(start, self._upper_bound(q, start, hi)):
+                matches.append((p, sa[idx]))
+        return (best, matches) if matches else (0, [])
+
+    def unique_lengths(self):
+        """Returns, for each target, an array giving for each position i
+        the shortest length l such that seq[i:i+l] occurs nowhere else
+        in any of the targets (or n - i + 1 if there isn't one).
+        """
+        # the longest prefix a suffix shares with any other suffix is the
+        # longest it shares with either of its neighbors in the suffix
+        # array; comparisons stop at the separators, so a suffix that is
+        # all shared with another is never unique.
+        text = self._text
+        sa = self._sa
+        shared = array('L', [ 0 ]) * len(text)
+        for idx in xrange(1, len(sa)):
+            i, j = sa[idx - 1], sa[idx]
+            common = 0
+            while text[i + common] == text[j + common] and text[i + common] != _SEPARATOR:
+                common += 1
+            shared[j] = common
+            if common > shared[i]:
+                shared[i] = common
+        res = []
+        for t, target in enumerate(self._targets):
+            start = self._starts[t]
+            res.append(array('L', [ shared[start + i] + 1 for i in xrange(target.n) ]))
+        return res
+
+    def find_partial(self, query, min_lengths):
+        """Same as :meth:`.target.Targets.find_partial`, trying each of
+        the minimum lengths in turn. Returns ``None`` if the query can't
+        be handled here.
+        """
+        word_len = self._word_len
+        query_len = len(query)
+        if not is_acgt(query):
+            return None
+        for min_len in min_lengths:
+            if query_len - max(min_len - word_len, 1, word_len) < 0:
+                return None
+        length, matches = self.longest_matches(query)
+        for min_len in min_lengths:
+            if length and length >= min_len:
+                candidate = self._choose(query_len, min_len, length, matches)
+                if candidate[0]:
+                    return candidate
+        return [None, None, None, None]
+
+    def _choose(self, query_len, min_len, length, matches):
+        # order the matches by how find_partial would have first come
+        # across them: the first check site they cover, then the
+        # target, then the seed position in it
+        word_len = self._word_len
+        check_every = max(min_len - word_len, 1)
+        last = query_len - max(check_every, word_len)
+        starts = self._starts
+        targets = self._targets
+        found = []
+        for p, text_index in matches:
+            site = ((p + check_every - 1) // check_every) * check_every
+            if site >= last:
+                site = last
+            if site < p or site > p + length - word_len:
+                continue
+            t = bisect_right(starts, text_index) - 1
+            index = text_index - starts[t]
+            found.append((site, t, index + site - p, p, index))
+        found.sort()
+        candidate = [None, None, None, None]
+        for site, t, seed_index, p, index in found:
+            target = targets[t]
+            if not candidate[2]:
+                candidate = [target, p, length, index]
+            elif target != candidate[0]:
+                if isinstance(candidate[0], list):
+                    candidate[0] = candidate[0] if target in candidate[0] else [ target ] + candidate[0]
+                else:
+                    candidate[0] = [ target, candidate[0] ]
+        return candidate
+
+
+def longest_repeat(seq):
+    """Returns the length of the longest substring that occurs (at
+    least) twice in seq, where the occurrences may overlap. Uses a
+    suffix automaton, so is linear in the length of seq.
+    """
+    # each state is a set of substrings with the same end positions;
+    # length is the longest of them, and count (once propagated up the
+    # suffix links) is the number of end positions
+    link = [ -1 ]
+    length = [ 0 ]
+    trans = [ {} ]
+    count = [ 0 ]
+    last = 0
+    for ch in seq:
+        cur = len(length)
+        link.append(-1)
+        length.append(length[last] + 1)
+        trans.append({})
+        count.append(1)
+        p = last
+        while p != -1 and ch not in trans[p]:
+            trans[p][ch] = cur
+            p = link[p]
+        if p == -1:
+            link[cur] = 0
+        else:
+            q = trans[p][ch]
+            if length[p] + 1 == length[q]:
+                link[cur] = q
+            else:
+                clone = len(length)
+                link.append(link[q])
+                length.append(length[p] + 1)
+                trans.append(dict(trans[q]))
+                count.append(0)
+                while p != -1 and trans[p].get(ch) == q:
+                    trans[p][ch] = clone
+                    p = link[p]
+                link[q] = link[cur] = clone
+        last = cur
+    # states by decreasing length, so that counts are complete before being propagated
+    by_length = [ [] for i in xrange(len(seq) + 1) ]
+    for state in xrange(1, len(length)):
+        by_length[length[state]].append(state)
+    longest = 0
+    for states in reversed(by_length):
+        for state in states:
+            if count[state] > 1 and length[state] > longest:
+                longest = length[state]
+            count[link[state]] += count[state]
+    return longest
+
+
+def is_acgt(seq):
+    return not seq.translate(None, 'ACGT')
@@ -0,0 +1,200 @@
+
+#
+# on-disk cache of the lookup tables built by Targets.build_lookups
+# and build_cotrans_lookups
+#
+# general idea: the R1/R2 tables only depend on the targets and a few
+# run settings, but building them (especially with count_mutations,
+# which adds every single-nucleotide variant of every entry) can take
+# a long time and a lot of memory. so they're written once to a file
+# in the cache_dir, and later runs just mmap it read-only: startup is
+# near-instant, and since the pages come from the file, they're shared
+# by all of the worker processes instead of being copied into each.
+#
+# - each table is an open-addressing hash table (crc32 of the key,
+#   linear probing, at most half full): an array of 64-bit record
+#   offsets (0 for an empty slot), followed by the records. so a
+#   lookup is typically one slot read and one key compare.
+#
+# - a record is the key length and the number of values, the key, and
+#   then the values as 32-bit ints: (target index, end, trim,
+#   mutation) for R1, and (site, mutation) for R2. a None end or no
+#   mutation is stored as _NONE.
+#
+# - the small bits (R1 aliases, R2 match lengths, where each table
+#   is) go in a JSON header.
+#
+# - the file is written to a temporary name and renamed, so a reader
+#   never sees a partial file.
+#
+
+import json
+import mmap
+import os
+import struct
+import zlib
+
+
+_MAGIC = 'SPATSLUT'
+_VERSION = 1
+_NONE = -0x80000000
+_RECORD_HEADER = struct.Struct('<II')
+_OFFSET = struct.Struct('<Q')
+_R1_VALUE = struct.Struct('<iiii')
+_R2_VALUE = struct.Struct('<ii')
+_PACK_CHUNK = 65536
+
+
+def _encode(val):
+    return _NONE if val is None else val
+
+def _decode(val):
+    return None if val == _NONE else val
+
+
+class _MappedTable(object):
+    # read-only, dict-like view of one table in the mapped file
+
+    def __init__(self, mm, offset, slots, count, make_value):
+        self._mm = mm
+        self._offset = offset
+        self._mask = slots - 1
+        self._count = count
+        self._make_value = make_value
+
+    def __len__(self):
+        return self._count
+
+    def get(self, key, default = None):
+        mm = self._mm
+        offset = self._offset
+        mask = self._mask
+        key_len = len(key)
+        slot = zlib.crc32(key) & mask
+        while True:
+            record = _OFFSET.unpack_from(mm, offset + 8 * slot)[0]
+            if not record:
+                return default
+            rec_key_len, count = _RECORD_HEADER.unpack_from(mm, record)
+            start = record + _RECORD_HEADER.size
+            if rec_key_len == key_len and mm[start:start + key_len] == key:
+                return self._make_value(mm, start + key_len, count)
+            slot = (slot + 1) & mask
+
+    def __getitem__(self, key):
+        res = self.get(key)
+        if res is None:
+            raise KeyError(key)
+        return res
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+
+def _table_slots(count):
+    slots = 16
+    while slots < 2 * count:
+        slots *= 2
+    return slots
+
+def _write_table(out, table, encode_value, value_size):
+    # writes the slots and then the records, starting at the current
+    # (8-byte aligned) position; returns the table's header entry
+    base = out.tell()
+    slots = _table_slots(len(table))
+    mask = slots - 1
+    offsets = [ 0 ] * slots
+    # the records go after the slots, which are filled in once all of
+    # the records are placed
+    position = base + 8 * slots
+    out.seek(position)
+    for key, val in table.iteritems():
+        slot = zlib.crc32(key) & mask
+        while offsets[slot]:
+            slot = (slot + 1) & mask
+        offsets[slot] = position
+        values = encode_value(val)
+        record = _RECORD_HEADER.pack(len(key), len(values) // value_size) + key + values
+        out.write(record)
+        position += len(record)
+    out.seek(base)
+    for start in xrange(0, slots, _PACK_CHUNK):
+        chunk = offsets[start:start + _PACK_CHUNK]
+        out.write(struct.pack('<{}Q'.format(len(chunk)), *chunk))
+    out.seek(position)
+    padding = (8 - position % 8) % 8
+    out.write('\0' * padding)
+    return { 'offset' : base, 'slots' : slots, 'count' : len(table) }
+
+
+def write_lookup_tables(path, targets):
+    """Writes the R1/R2 lookup tables currently built on targets (a
+    :class:`.target.Targets`) to path.
+    """
+    target_indices = { id(target) : idx for idx, target in enumerate(targets.targets) }
+
+    def encode_r1(entries):
+        return ''.join(_R1_VALUE.pack(target_indices[id(entry[0])], _encode(entry[1]), entry[2],
+                                      entry[3][0] if entry[3] else _NONE) for entry in entries)
+
+    def encode_r2(entry):
+        return _R2_VALUE.pack(entry[0], entry[1][0] if entry[1] else _NONE)
+
+    header = { 'version' : _VERSION,
+               'r1_lookup_length' : targets.r1_lookup_length,
+               'r1_aliases' : targets.r1_aliases,
+               'r2_match_lengths' : targets.r2_match_lengths }
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as out:
+        # the header size isn't known until the tables are written, so
+        # reserve its spot, write the tables, and then the header last
+        out.write(_MAGIC + _OFFSET.pack(0))
+        header['r1'] = _write_table(out, targets.r1_lookup, encode_r1, _R1_VALUE.size)
+        header['r2'] = { name : _write_table(out, table, encode_r2, _R2_VALUE.size)
+                         for name, table in targets.r2_lookup.iteritems() }
+        header_offset = out.tell()
+        out.write(json.dumps(header))
+        out.seek(len(_MAGIC))
+        out.write(_OFFSET.pack(header_offset))
+    os.rename(tmp_path, path)
+
+
+def map_lookup_tables(path, targets):
+    """Maps the lookup tables in path (from :func:`write_lookup_tables`)
+    and sets them up on targets. Returns ``False`` if the file isn't
+    usable (in which case targets is unchanged).
+    """
+    with open(path, 'rb') as infile:
+        if infile.read(len(_MAGIC)) != _MAGIC:
+            return False
+        mm = mmap.mmap(infile.fileno(), 0, access = mmap.ACCESS_READ)
+    header_offset = _OFFSET.unpack_from(mm, len(_MAGIC))[0]
+    if not header_offset:
+        return False
+    header = json.loads(mm[header_offset:])
+    if header.get('version') != _VERSION:
+        return False
+    tlist = targets.targets
+
+    def r1_value(mm, start, count):
+        res = []
+        for idx in xrange(count):
+            target, end, trim, mut = _R1_VALUE.unpack_from(mm, start + idx * _R1_VALUE.size)
+            res.append((tlist[target], _decode(end), trim, [] if mut == _NONE else [ mut ]))
+        return res
+
+    def r2_value(mm, start, count):
+        site, mut = _R2_VALUE.unpack_from(mm, start)
+        return (site, [] if mut == _NONE else [ mut ])
+
+    def table(info, make_value):
+        return _MappedTable(mm, info['offset'], info['slots'], info['count'], make_value)
+
+    # json gives back unicode, but the rest of the code expects str keys
+    aliases = header['r1_aliases']
+    targets.r1_lookup = table(header['r1'], r1_value)
+    targets.r1_aliases = { str(alias) : map(str, keys) for alias, keys in aliases.iteritems() } if aliases else None
+    targets.r1_lookup_length = header['r1_lookup_length']
+    targets.r2_lookup = { str(name) : table(info, r2_value) for name, info in header['r2'].iteritems() }
+    targets.r2_match_lengths = { str(name) : mlen for name, mlen in header['r2_match_lengths'].iteritems() }
+    return True
@@ -37,6 +37,9 @@ MASK_TO_TAG = { "RRRY": TAG_TREATED, "YYYR": TAG_UNTREATED, PLUS_PLACEHOLDER: TA
 
 class TagProcessor(PairProcessor):
 
+    # the base processor times the matching
+    _timed_stages = ( ('_find_tag_names', 'tags'), )
+
     def prepare(self):
         self.uses_tags = True
         self._base_processor = self._run._get_base_processor_class()(self._run, self._targets, self._masks)
@@ -1,6 +1,257 @@
 
+import hashlib
+import json
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import izip
+
 from mask import longest_match
-from util import reverse_complement, _debug, _warn
+from suffix import is_acgt, longest_repeat, TargetSuffixArray
+from table_cache import map_lookup_tables, write_lookup_tables
+from util import reverse_complement, _debug, _warn, _KMER_DIGITS
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# what build_lookups sets up; see Targets.lookup_tables()
+_LOOKUP_TABLE_ATTRS = ( 'r1_lookup', 'r1_aliases', 'r1_lookup_length', 'r2_lookup', 'r2_match_lengths', '_r1_short_keys' )
+
+
+class _PackedIndex(object):
+    # a compact alternative to the {kmer : [(target, index), ...]}
+    # dict: each k-mer is encoded as a 2-bit-per-nucleotide integer,
+    # and the (target, index) sites are kept in a pair of parallel
+    # arrays (target number, index), sorted by code. for short words,
+    # the sites for a code are found via a dense array of offsets;
+    # otherwise, by a binary search of the (sorted) codes. sites come
+    # back in the same order as from the dict index. k-mers with
+    # anything other than ACGT can't be encoded, so those (rare) ones
+    # are kept in a dict.
+    #
+    # a lookup itself is slower than the dict's, which hands back a
+    # list it already has, whereas here the (target, index) pairs have
+    # to be built each time (hence zip/map, not a comprehension); but
+    # that's a small part of matching. what does matter is that the
+    # site arrays are signed ('i'/'l'), so indexes come back as ints
+    # rather than longs, which would slow down everything that does
+    # arithmetic with them afterwards (longest_match in particular).
+
+    _MAX_DENSE_WORD_LENGTH = 10
+
+    def __init__(self, targets, word_len):
+        self._targets = targets
+        self._word_len = word_len
+        codes = array('L')
+        site_targets = array('i')
+        site_indexes = array('i')
+        other = {}
+        for t, target in enumerate(targets):
+            seq = target.seq
+            digits = seq.translate(_KMER_DIGITS)
+            for i in xrange(target.n - word_len + 1):
+                try:
+                    code = int(digits[i:(i + word_len)], 4)
+                except ValueError:
+                    other.setdefault(seq[i:(i + word_len)], []).append((target, i))
+                    continue
+                codes.append(code)
+                site_targets.append(t)
+                site_indexes.append(i)
+        self._other = other
+        if word_len <= self._MAX_DENSE_WORD_LENGTH:
+            # counting sort, which keeps sites for the same code in target/index order
+            offsets = array('l', [ 0 ]) * ((1 << (2 * word_len)) + 1)
+            for code in codes:
+                offsets[code + 1] += 1
+            for code in xrange(1, len(offsets)):
+                offsets[code] += offsets[code - 1]
+            cursor = array('l', offsets)
+            self._site_targets = array('i', [ 0 ]) * len(codes)
+            self._site_indexes = array('i', [ 0 ]) * len(codes)
+            for code, t, i in izip(codes, site_targets, site_indexes):
+                j = cursor[code]
+                self._site_targets[j] = t
+                self._site_indexes[j] = i
+                cursor[code] = j + 1
+            self._offsets = offsets
+            self._codes = None
+        else:
+            # a stable sort by code keeps them in target/index order
+            order = sorted(xrange(len(codes)), key = codes.__getitem__)
+            self._codes = array('L', (codes[j] for j in order))
+            self._site_targets = array('i', (site_targets[j] for j in order))
+            self._site_indexes = array('i', (site_indexes[j] for j in order))
+            self._offsets = None
+
+    def get(self, key, default = None):
+        try:
+            if len(key) != self._word_len:
+                raise ValueError()
+            code = int(key.translate(_KMER_DIGITS), 4)
+        except ValueError:
+            return self._other.get(key, default)
+        if self._offsets is not None:
+            start, end = self._offsets[code], self._offsets[code + 1]
+        else:
+            codes = self._codes
+            start = bisect_left(codes, code)
+            end = bisect_right(codes, code, start)
+        if start == end:
+            return default
+        return zip(map(self._targets.__getitem__, self._site_targets[start:end]), self._site_indexes[start:end])
+
+
+# keys longer than this many nucleotides don't fit in a word, so are hashed
+_MAX_EXACT_KEY_LENGTH = 32
+# the first prime after 2**64 / golden ratio. the packed code is reduced
+# by a prime (rather than truncated) so that sequences which differ by a
+# few substitutions don't collide; and it's not near a power of 2, so
+# that powers of 4 don't reduce to small numbers, which would make a
+# change near the start look like a change near the end.
+_KEY_PRIME = 0x9e3779b97f4a804b
+
+
+def _neighbors(code, length, positions, errors):
+    # returns (codes, first positions, second positions) for every
+    # sequence within `errors` (at most 2) substitutions of the packed
+    # sequence code, changing only the given positions (-1 for no
+    # second position). working on the packed code means none of the
+    # variants have to be built as strings; the order is the same as
+    # toggling each position to each other nucleotide in turn.
+    if errors < 1:
+        return [], [], []
+    per_position = []
+    for pos in positions:
+        shift = 2 * (length - 1 - pos)
+        digit = (code >> shift) & 3
+        per_position.append([ (nt - digit) << shift for nt in xrange(4) if nt != digit ])
+    codes = [ code + delta for deltas in per_position for delta in deltas ]
+    first = [ pos for pos in positions for nt in xrange(3) ]
+    second = [ -1 ] * len(codes)
+    if errors >= 2:
+        count = len(positions)
+        codes += [ code + delta + delta2 for idx in xrange(count) for idx2 in xrange(idx + 1, count)
+                                         for delta in per_position[idx] for delta2 in per_position[idx2] ]
+        first += [ positions[idx] for idx in xrange(count) for idx2 in xrange(idx + 1, count) for nt in xrange(9) ]
+        second += [ positions[idx2] for idx in xrange(count) for idx2 in xrange(idx + 1, count) for nt in xrange(9) ]
+    return codes, first, second
+
+def _stable_order(keys):
+    if numpy is not None:
+        return numpy.argsort(numpy.frombuffer(keys, dtype = numpy.uint64), kind = 'mergesort')
+    return sorted(xrange(len(keys)), key = keys.__getitem__)
+
+def _permuted(values, order):
+    if numpy is not None:
+        dtype = numpy.uint64 if values.typecode == 'L' else numpy.int32
+        res = array(values.typecode)
+        res.fromstring(numpy.frombuffer(values, dtype = dtype)[order].tostring())
+        return res
+    return array(values.typecode, (values[j] for j in order))
+
+def _equal_runs(keys):
+    # (start, end) for each run of more than one equal key in the sorted keys
+    if numpy is not None:
+        npkeys = numpy.frombuffer(keys, dtype = numpy.uint64)
+        same = numpy.flatnonzero(npkeys[1:] == npkeys[:-1]).tolist()
+    else:
+        same = [ idx for idx in xrange(len(keys) - 1) if keys[idx] == keys[idx + 1] ]
+    start = None
+    for idx, next_idx in izip(same, same[1:] + [ None ]):
+        if start is None:
+            start = idx
+        if next_idx != idx + 1:
+            yield start, idx + 2
+            start = None
+
+
+class _CompactLookupTable(object):
+    # a compact alternative to the {sequence : entries} R1/R2 lookup
+    # dicts, small enough to hold the neighborhoods for two
+    # substitutions. all keys are the same length; each is packed 2
+    # bits per nucleotide into a word (or, if it doesn't fit, reduced
+    # to one by _KEY_PRIME), and kept in an array sorted by key, with
+    # the entries' (32-bit) int fields in parallel arrays. so a lookup packs the
+    # sequence once and bisects. hashed keys could in principle
+    # collide; but a false R2 hit still has to pass the R2 match check,
+    # and the chance for R1 is about (table size / 2**64) per read.
+
+    NONE = -(1 << 31)
+
+    def __init__(self, key_length, fields, make_value):
+        self.key_length = key_length
+        self._hashed = key_length > _MAX_EXACT_KEY_LENGTH
+        self._keys = array('L')
+        self._fields = [ array('i') for idx in xrange(fields) ]
+        self._count = 0
+        self._make_value = make_value
+
+    @staticmethod
+    def code(seq):
+        """Raises ValueError if seq has anything other than ACGT."""
+        return int(seq.translate(_KMER_DIGITS), 4)
+
+    def __len__(self):
+        return self._count
+
+    def add(self, codes, *fields):
+        """Adds an entry for each of codes, with the corresponding
+        values of each field. Entries for the same key are kept in the
+        order they're added. :meth:`finish` must be called before
+        looking anything up.
+        """
+        if self._hashed:
+            self._keys.extend([ code % _KEY_PRIME for code in codes ])
+        else:
+            self._keys.extend(codes)
+        for values, field_values in izip(self._fields, fields):
+            values.extend(field_values)
+
+    def finish(self, resolve = None):
+        """Sorts the entries by key. If given, resolve(fields, start,
+        end) is called for each run of entries with the same key, and
+        returns the index of the one to keep.
+        """
+        if not self._keys:
+            return
+        order = _stable_order(self._keys)
+        keys = _permuted(self._keys, order)
+        fields = [ _permuted(values, order) for values in self._fields ]
+        if resolve:
+            drop = set()
+            for start, end in _equal_runs(keys):
+                keep = resolve(fields, start, end)
+                drop.update(idx for idx in xrange(start, end) if idx != keep)
+            if drop:
+                kept = [ idx for idx in xrange(len(keys)) if idx not in drop ]
+                keys = array('L', (keys[idx] for idx in kept))
+                fields = [ array('i', (values[idx] for idx in kept)) for values in fields ]
+        self._keys = keys
+        self._fields = fields
+        self._count = len(keys) - sum(end - start - 1 for start, end in _equal_runs(keys))
+
+    def get_code(self, code):
+        keys = self._keys
+        key = code % _KEY_PRIME if self._hashed else code
+        start = bisect_left(keys, key)
+        if start == len(keys) or keys[start] != key:
+            return None
+        return self._make_value(self._fields, start, bisect_right(keys, key, start))
+
+    def get(self, seq, default = None):
+        if len(seq) != self.key_length:
+            return default
+        try:
+            code = self.code(seq)
+        except ValueError:
+            return default
+        res = self.get_code(code)
+        return default if res is None else res
+
 
 class _Target(object):
 
@@ -15,6 +266,7 @@ class Targets(object):
 
     def __init__(self, index_word_length = 8):
         self._index = None
+        self._suffix_array = None
         self._index_word_length = index_word_length
         self._minimum_length = index_word_length
         self.targets = []
@@ -45,9 +297,13 @@ class Targets(object):
         if False and min_length - self._index_word_length < 4:
             print("Warning: minimum_length {} is not much longer than index length {}".format(min_len, word_len))
 
-    def index(self):
-        index = {}
+    def index(self, packed = False, suffix_array = False):
         word_len = self._index_word_length
+        self._suffix_array = TargetSuffixArray(self.targets, word_len) if suffix_array else None
+        if packed:
+            self._index = _PackedIndex(self.targets, word_len)
+            return
+        index = {}
         for target in self.targets:
             seq = target.seq
             n = target.n
@@ -60,6 +316,24 @@ class Targets(object):
                 sites.append((target, i))
         self._index = index
 
+    def unique_lengths(self, per_target = False):
+        """Returns { target name : array of, for each position, the
+        shortest length starting there that occurs only once in all of
+        the targets (or just in that target, if per_target is set) },
+        or ``None`` if the targets aren't all ACGT. See
+        :meth:`.suffix.TargetSuffixArray.unique_lengths`.
+        """
+        word_len = self._index_word_length
+        if per_target:
+            suffix_arrays = [ TargetSuffixArray([ target ], word_len) for target in self.targets ]
+            if not all(suffix_array.usable for suffix_array in suffix_arrays):
+                return None
+            return { target.name : suffix_array.unique_lengths()[0] for target, suffix_array in zip(self.targets, suffix_arrays) }
+        suffix_array = self._suffix_array or TargetSuffixArray(self.targets, word_len)
+        if not suffix_array.usable:
+            return None
+        return { target.name : lengths for target, lengths in zip(self.targets, suffix_array.unique_lengths()) }
+
     def longest_self_match(self, minimum_length = None):
         min_len = self._minimum_length
         candidate = (None, None, None)
@@ -84,32 +358,60 @@ class Targets(object):
         # so if we didn't find one, just return that
         return candidate[1] or min_len
 
-    def longest_target_self_matches(self, minimum_length = None):
+    def longest_target_self_matches(self, minimum_length = None, cache_dir = None):
+        """Returns { target name : the length of the longest sequence that
+        occurs more than once in the target }, or the minimum match
+        length if that's longer. If cache_dir is set, results are cached
+        there, keyed by a hash of the targets.
+        """
         min_len = self._minimum_length
+        cache_path = None
+        if cache_dir:
+            key = hashlib.sha1("self_matches:1:{}\n".format(min_len))
+            for target in self.targets:
+                key.update("{}\t{}\n".format(target.name, target.seq))
+            cache_path = os.path.join(cache_dir, "self_matches_{}.json".format(key.hexdigest()))
+            if os.path.exists(cache_path):
+                with open(cache_path, 'rb') as infile:
+                    return json.load(infile)
         matches = {}
         for target in self.targets:
-            seq = target.seq
-            seq_len = target.n
-            index = 0
-            candidate = (None, None, None)
-            while True:
-                query = seq[index:index+min_len]
-                match_target, match_index = self.find_exact(query, exclude = (target, index))
-                if match_target == target:
-                    assert(match_index != index)
-                    left, right = longest_match(seq, (index, min_len), match_target.seq, (match_index, min_len))
-                    total_len = min_len + left + right
-                    if not candidate[1] or total_len > candidate[1]:
-                        candidate = (index, total_len, match_index)
-                        #print("C {} {} matches {}".format(target.name, candidate, match_target.name))
-                index += 1
-                if index >= seq_len - max(min_len, candidate[1]):
-                    break
-            # note that we can't say there's no self-match below min_len,
-            # so if we didn't find one, just return that
-            matches[target.name] = candidate[1] or min_len
+            if is_acgt(target.seq):
+                matches[target.name] = max(longest_repeat(target.seq), min_len)
+            else:
+                # longest_match() allows for IUPAC codes, which the suffix automaton doesn't
+                matches[target.name] = self._scan_target_self_match(target, min_len)
+        if cache_path:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            tmp_path = "{}.{}".format(cache_path, os.getpid())
+            with open(tmp_path, 'wb') as outfile:
+                json.dump(matches, outfile)
+            os.rename(tmp_path, cache_path)
         return matches
 
+    def _scan_target_self_match(self, target, min_len):
+        seq = target.seq
+        seq_len = target.n
+        index = 0
+        candidate = (None, None, None)
+        while True:
+            query = seq[index:index+min_len]
+            match_target, match_index = self.find_exact(query, exclude = (target, index))
+            if match_target == target:
+                assert(match_index != index)
+                left, right = longest_match(seq, (index, min_len), match_target.seq, (match_index, min_len))
+                total_len = min_len + left + right
+                if not candidate[1] or total_len > candidate[1]:
+                    candidate = (index, total_len, match_index)
+                    #print("C {} {} matches {}".format(target.name, candidate, match_target.name))
+            index += 1
+            if index >= seq_len - max(min_len, candidate[1]):
+                break
+        # note that we can't say there's no self-match below min_len,
+        # so if we didn't find one, just return that
+        return candidate[1] or min_len
+
     def find_exact(self, query, exclude = (None, -1)):
         word_len = self._index_word_length
         query_len = len(query)
@@ -179,6 +481,11 @@ class Targets(object):
     #  match_len: the length of the match
     #  sequence_index: the index into the target sequence where the match starts
     def find_partial(self, query, force_target = None, min_length_override = 0):
+        if self._suffix_array and self._suffix_array.usable and not force_target:
+            candidate = self._suffix_array.find_partial(query, [ min_length_override or self._minimum_length * 2,
+                                                                 min_length_override or self._minimum_length ])
+            if candidate:
+                return candidate
         # it's much faster to search for longer partial matches, then fall back on the minimum
         candidate = self._find_partial(query, force_target, min_length_override, multiple = 2)
         return candidate if candidate[0] else self._find_partial(query, force_target, min_length_override, multiple = 1)
@@ -218,6 +525,10 @@ class Targets(object):
         return candidate
 
     def build_cotrans_lookups(self, run):
+        self._cached_lookups(run, "cotrans:{}:{}:{}:{}".format(run.adapter_b, run.cotrans_linker, run.pair_length, bool(run.count_mutations)),
+                             lambda : self._build_cotrans_lookups(run))
+
+    def _build_cotrans_lookups(self, run):
         # for cotrans experiments, R1 includes a linker and is relatively restricted
         # store RC in table so that we can directly lookup R1[4:]
 
@@ -272,16 +583,82 @@ class Targets(object):
 
         # we only need to build R2 lookups for full sequences (excepting linker)
         # trim cases are just tested against R1
-        self._build_R2_lookup(pair_len - linker_len - masklen, run.count_mutations)
+        self._build_R2_lookup(pair_len - linker_len - masklen, run.count_mutations, cache_dir = run.cache_dir)
 
 
-    def build_lookups(self, run, length = None, end_only = True):
+    def build_lookups(self, run, length = None, end_only = True, mutations = None):
         use_length = length or 35
         if use_length < 0:
             raise Exception('Cannot build lookups on variable-length inputs. Use find_partial processor.')
         masklen = 4  # TODO
-        self._build_R1_lookup(run.adapter_b, use_length - masklen, end_only, run.count_mutations, run.dumbbell)
-        self._build_R2_lookup(use_length - masklen, run.count_mutations, run.dumbbell)
+        # mutations defaults to run.count_mutations; False builds exact-match tables only
+        if mutations is None:
+            mutations = run.count_mutations
+
+        if run.compact_lookup_tables:
+            errors = min(run.allowed_target_errors, 2) if mutations else 0
+            self._build_compact_R1_lookup(run.adapter_b, use_length - masklen, errors, run.dumbbell)
+            self._build_compact_R2_lookup(use_length - masklen, errors, run.dumbbell, cache_dir = run.cache_dir)
+            return
+
+        def build():
+            self._build_R1_lookup(run.adapter_b, use_length - masklen, end_only, mutations, run.dumbbell)
+            self._build_R2_lookup(use_length - masklen, mutations, run.dumbbell, cache_dir = run.cache_dir)
+
+        self._cached_lookups(run, "lookup:{}:{}:{}:{}:{}".format(run.adapter_b, use_length, end_only, bool(mutations), run.dumbbell),
+                             build)
+
+    def minimum_lookup_length(self, run, mutations = None):
+        """Returns the shortest read length :meth:`build_lookups` can
+        build tables for (with the same run and mutations).
+        """
+        masklen = 4  # TODO
+        if mutations is None:
+            mutations = run.count_mutations
+        # R2 is looked up by just enough of it to be unique in the target.
+        # with mutations, that's the whole read, and no two spots in the
+        # target may be within two substitutions of each other -- which
+        # they can't be once any 3 equal-length pieces of them (one of
+        # which has to be an exact match) are longer than the longest
+        # self-match.
+        longest = max(self.longest_target_self_matches(cache_dir = run.cache_dir).values())
+        dumbbell_len = len(run.dumbbell) if run.dumbbell else 0
+        return masklen + dumbbell_len + (3 * (longest + 1) if mutations else longest + 1)
+
+    def lookup_tables(self):
+        """Returns the tables last set up by :meth:`build_lookups`, for
+        :meth:`set_lookup_tables`.
+        """
+        return tuple(getattr(self, attr, None) for attr in _LOOKUP_TABLE_ATTRS)
+
+    def set_lookup_tables(self, tables):
+        """Switches back to tables from :meth:`lookup_tables`, without
+        rebuilding them.
+        """
+        for attr, table in izip(_LOOKUP_TABLE_ATTRS, tables):
+            setattr(self, attr, table)
+
+    def _cached_lookups(self, run, settings, build):
+        # with mmap_lookup_tables, the tables are built once and written to
+        # the cache_dir, keyed by the targets and the settings they depend
+        # on; later runs (and all workers) then share the mapped file.
+        if not run.mmap_lookup_tables:
+            build()
+            return
+        if not run.cache_dir:
+            raise Exception("mmap_lookup_tables requires cache_dir to be set")
+        key = hashlib.sha1("lookup_tables:1:{}\n".format(settings))
+        for target in self.targets:
+            key.update("{}\t{}\n".format(target.name, target.seq))
+        cache_path = os.path.join(run.cache_dir, "lookup_tables_{}.lut".format(key.hexdigest()))
+        if os.path.exists(cache_path) and map_lookup_tables(cache_path, self):
+            return
+        build()
+        if not os.path.exists(run.cache_dir):
+            os.makedirs(run.cache_dir)
+        write_lookup_tables(cache_path, self)
+        if not map_lookup_tables(cache_path, self):
+            raise Exception("unable to map lookup tables from {}".format(cache_path))
 
     def _build_R1_lookup(self, adapter_b, length = 31, end_only = True, mutations = False, dumbbell = None):
         # we can pre-build the set of all possible (error-free) R1, b/c:
@@ -313,7 +690,8 @@ class Targets(object):
                     r1_table[r1_candidate] = [ res ]
                 tcandidates += 1
                 if mutations:
-                    for toggle_idx in xrange(i):
+                    # (reads can be longer than short targets)
+                    for toggle_idx in xrange(min(i, tlen)):
                         for nt in [ 'A', 'C', 'G', 'T' ]:
                             if r1_candidate[toggle_idx] == nt:
                                 continue
@@ -332,6 +710,115 @@ class Targets(object):
         self._build_R1_aliases(adapter_b, length)
 
 
+    def _build_compact_R1_lookup(self, adapter_b, length, errors, dumbbell = None):
+        # the same candidates as _build_R1_lookup, with up to `errors`
+        # substitutions in the target part of each one. keys shorter than
+        # length (without enough adapter_b) go in their own tables.
+        tlist = self.targets
+        no_end = _CompactLookupTable.NONE
+
+        def make_value(fields, start, end):
+            targets, ends, trims, muts, muts2 = fields
+            return [ (tlist[targets[idx]], None if ends[idx] == no_end else ends[idx], trims[idx],
+                      [ mut for mut in (muts[idx], muts2[idx]) if mut ]) for idx in xrange(start, end) ]
+
+        tables = { length : _CompactLookupTable(length, 5, make_value) }
+        adapter_lengths = set()
+        other_lengths = set()
+        rc_dumbbell = reverse_complement(dumbbell) if dumbbell else None
+        for t, target in enumerate(tlist):
+            tlen = target.n
+            rc_tgt = reverse_complement(target.seq)
+            tcandidates = 0
+            for i in xrange(1, length + 1):
+                if rc_dumbbell:
+                    if length - i <= len(rc_dumbbell):
+                        r1_candidate = rc_tgt[:i] + rc_dumbbell[:length - i]
+                    else:
+                        r1_candidate = rc_tgt[:i] + rc_dumbbell + adapter_b[:length - len(rc_dumbbell) - i]
+                else:
+                    r1_candidate = rc_tgt[:i] + adapter_b[:length - i]
+                try:
+                    code = _CompactLookupTable.code(r1_candidate)
+                except ValueError:
+                    continue    # reads with non-ACGT nucleotides aren't looked up
+                candidate_len = len(r1_candidate)
+                if candidate_len < length:
+                    (adapter_lengths if r1_candidate.endswith(adapter_b) else other_lengths).add(candidate_len)
+                    if candidate_len not in tables:
+                        tables[candidate_len] = _CompactLookupTable(candidate_len, 5, make_value)
+                codes, first, second = _neighbors(code, candidate_len, range(min(i, tlen)), errors)
+                count = 1 + len(codes)
+                tables[candidate_len].add([ code ] + codes, [ t ] * count, [ no_end if i == length else tlen - i ] * count,
+                                          [ length - i ] * count, [ 0 ] + [ tlen - pos for pos in first ],
+                                          [ 0 ] + [ tlen - pos if pos >= 0 else 0 for pos in second ])
+                tcandidates += 1
+
+            if 0 == tcandidates:
+                _warn("!! No R1 match candidates for {}".format(target.name))
+
+        for table in tables.itervalues():
+            table.finish()
+        self.r1_lookup = tables.pop(length)
+        self.r1_aliases = None
+        self.r1_lookup_length = length
+        # short keys are found by looking up prefixes of the read; see _lookup_compact_r1
+        self._r1_short_keys = (adapter_b, tables, adapter_lengths, sorted(other_lengths, reverse = True))
+
+    def _build_compact_R2_lookup(self, length, errors, dumbbell = None, cache_dir = None):
+        # the same candidates as _build_R2_lookup, with up to `errors`
+        # substitutions. two candidates can't share a key where that
+        # would have been an error for the single-substitution table;
+        # past that, a key belongs to the closest candidate, or to none
+        # if that's a tie.
+        self_matches = self.longest_target_self_matches(cache_dir = cache_dir)
+
+        def make_value(fields, start, end):
+            sites, muts, muts2 = fields
+            site = sites[start]
+            return None if site < 0 else (site, [ mut for mut in (muts[start], muts2[start]) if mut ])
+
+        def resolve(fields, start, end):
+            sites, muts, muts2 = fields
+            distances = [ bool(muts[idx]) + bool(muts2[idx]) for idx in xrange(start, end) ]
+            closest = min(distances)
+            if closest + sorted(distances)[1] <= 2:
+                raise Exception("indeterminate R2 candidate at {} in target?".format(sorted(sites[start:end])))
+            keep = [ start + idx for idx, distance in enumerate(distances) if distance == closest ]
+            if len(keep) > 1:
+                sites[keep[0]] = -1
+            return keep[0]
+
+        r2_full_table = {}
+        r2_match_lengths = {}
+        for target in self.targets:
+            mlen = length if errors else self_matches[target.name] + 1
+            if dumbbell:
+                mlen += len(dumbbell)
+            if length < mlen:
+                raise Exception("R2 length not long enough for target self-match ({} / {})".format(length, mlen))
+            table = _CompactLookupTable(mlen, 3, make_value)
+            r2_full_table[target.name] = table
+            r2_match_lengths[target.name] = mlen
+            tgt_seq = target.seq
+            for i in xrange(target.n - mlen + 1):
+                if dumbbell:
+                    r2_candidate = dumbbell + tgt_seq[i:i+mlen-len(dumbbell)]
+                else:
+                    r2_candidate = tgt_seq[i:i+mlen]
+                try:
+                    code = _CompactLookupTable.code(r2_candidate)
+                except ValueError:
+                    continue
+                codes, first, second = _neighbors(code, mlen, range(mlen), errors)
+                count = 1 + len(codes)
+                table.add([ code ] + codes, [ i ] * count, [ 0 ] + [ i + pos + 1 for pos in first ],
+                          [ 0 ] + [ i + pos + 1 if pos >= 0 else 0 for pos in second ])
+            table.finish(resolve)
+
+        self.r2_lookup = r2_full_table
+        self.r2_match_lengths = r2_match_lengths
+
     # if we don't have enough adapter_b, then make aliases for short lookup keys
     def _build_R1_aliases(self, adapter_b, length):
 
@@ -361,10 +848,10 @@ class Targets(object):
             self.r1_lookup_length = minimum_length
 
 
-    def _build_R2_lookup(self, length = 35, mutations = False, dumbbell = None):
+    def _build_R2_lookup(self, length = 35, mutations = False, dumbbell = None, cache_dir = None):
         # for the R2 table, we only care about R2's that are in the sequence
         # when R2 needs adapter trimming, R1 will determine that
-        self_matches = self.longest_target_self_matches()
+        self_matches = self.longest_target_self_matches(cache_dir = cache_dir)
         #for tname in self_matches.keys():
         #    print("{} : {}".format(tname, self_matches[tname]))
         r2_full_table = {}
@@ -404,6 +891,8 @@ class Targets(object):
         self.r2_match_lengths = r2_match_lengths
 
     def lookup_r1(self, seq):
+        if isinstance(self.r1_lookup, _CompactLookupTable):
+            return self._lookup_compact_r1(seq)
         res = self.r1_lookup.get(seq)
         if not res and self.r1_aliases:
             keylist = self.r1_aliases.get(seq[:self.r1_lookup_length])
@@ -414,6 +903,35 @@ class Targets(object):
                         break
         return res
 
+    def _lookup_compact_r1(self, seq):
+        try:
+            code = _CompactLookupTable.code(seq)
+        except ValueError:
+            code = None
+        res = None if code is None else self.r1_lookup.get_code(code)
+        adapter_b, tables, adapter_lengths, other_lengths = self._r1_short_keys
+        if res or not tables:
+            return res
+        # a short key ending with adapter_b can only be a prefix of the
+        # read up to the end of an occurrence of adapter_b
+        seq_len = len(seq)
+        key_lengths = []
+        pos = seq.find(adapter_b, 1) if adapter_b else -1
+        while pos >= 0:
+            if pos + len(adapter_b) in adapter_lengths:
+                key_lengths.append(pos + len(adapter_b))
+            pos = seq.find(adapter_b, pos + 1)
+        for key_len in key_lengths + other_lengths:
+            if key_len >= seq_len:
+                continue
+            if code is not None:
+                res = tables[key_len].get_code(code >> (2 * (seq_len - key_len)))
+            else:
+                res = tables[key_len].get(seq[:key_len])
+            if res:
+                return res
+        return None
+
     def lookup_r2(self, target_name, seq):
         lookup = self.r2_lookup[target_name]
         r2_match_len = self.r2_match_lengths[target_name]
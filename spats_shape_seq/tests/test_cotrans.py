@@ -1,7 +1,13 @@
+import nose
+import os
+import shutil
+import tempfile
 import unittest
 
 from spats_shape_seq import Spats
+from spats_shape_seq.native import NativeEngine
 from spats_shape_seq.pair import Pair
+from spats_shape_seq.tests.test_pairs import write_case_fastqs
 
 
 # [ id, r1, r2, end, site ]
@@ -177,6 +183,73 @@ class TestPairsNative(TestPairsPartial):
     def setup_processor(self):
         self.spats.run.algorithm = "native"
 
+
+# 2x50 pairs, longer than the native engine supports: [ id, r1, r2, end, site ]
+long_cases = [
+    [ "120_90", "AGGTGTCCTTGGTGCCCGAGTCAGGAAAAGTTCTTCTCCTTTGCTCATAG", "GGATCTATGAGCAAAGGAGAAGAACTTTTCCTGACTCGGGCACCAAGGAC", 120, 90 ],
+    [ "120_95", "CTTAGTCCTTGGTGCCCGAGTCAGGAAAAGTTCTTCTCCTTTGCTCATAA", "TATGAGCAAAGGAGAAGAACTTTTCCTGACTCGGGCACCAAGGACTAAGA", 120, 95 ],
+    [ "100_60", "AGGTGTCCTTGGTGCCCGAGTCAGTCATAGATCCTTCCTCCTAAAAAAAT", "ACTGGTAGGAGTCTATTTTTTTAGGAGGAAGGATCTATGACTGACTCGGG", 100, 60 ],
+    [ "131_110", "CTTAGTCCTTGGTGCCCGAGTCAGACAACTCCAGTGAAAAGTTCTAGATC", "AGAACTTTTCACTGGAGTTGTCTGACTCGGGCACCAAGGACTAAGAGATC", 131, 110 ],
+    [ "90_70", "AGGTGTCCTTGGTGCCCGAGTCAGTTCCTCCTAAAAAAATAGACAGATCG", "GTCTATTTTTTTAGGAGGAACTGACTCGGGCACCAAGGACACCTAGATCG", 90, 70 ],
+]
+
+
+class TestNativeEngineBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _run(self, algorithm, r1_path, r2_path):
+        spats = Spats(cotrans = True)
+        spats.run.quiet = True
+        spats.run.num_workers = 1
+        spats.run.cotrans_linker = 'CTGACTCGGGCACCAAGGAC'
+        spats.run.algorithm = algorithm
+        spats.addTargets("test/cotrans/cotrans_single.fa")
+        spats.process_pair_data(r1_path, r2_path)
+        return spats.counters
+
+    def test_batch(self):
+        if not NativeEngine.available():
+            raise nose.SkipTest()
+        r1_path, r2_path = write_case_fastqs(self.tmpdir, 3, cases)
+        expected = self._run("lookup", r1_path, r2_path)
+        native = self._run("native", r1_path, r2_path)
+        self.assertTrue(native.registered_pairs > 0)
+        self.assertEqual(expected.registered_pairs, native.registered_pairs)
+        self.assertEqual(expected.total_pairs, native.total_pairs)
+        self.assertEqual(expected.registered_dict(), native.registered_dict())
+        self.assertEqual(expected.count_data()[1], native.count_data()[1])
+        for key in ("RRRY_kept", "YYYR_kept"):
+            self.assertEqual(getattr(expected, key), getattr(native, key))
+
+    def test_long_pairs(self):
+        self.assertTrue(NativeEngine.supports(36))
+        self.assertFalse(NativeEngine.supports(len(long_cases[0][1])))
+        if not NativeEngine.available():
+            raise nose.SkipTest()
+        from spats_shape_seq.tool import SpatsTool
+        r1_path, r2_path = write_case_fastqs(self.tmpdir, 3, long_cases)
+        with open(os.path.join(self.tmpdir, "spats.config"), 'wb') as config:
+            config.write("[spats]\ncotrans = True\ntarget = {}\nr1 = {}\nr2 = {}\n".format(os.path.abspath("test/cotrans/cotrans_single.fa"), r1_path, r2_path))
+        tool = SpatsTool(self.tmpdir)
+        tool._run([ "run" ])
+        self.assertTrue("skipping native engine due to unsupported pair length" in tool._notes)
+        spats = Spats()
+        spats.load(os.path.join(self.tmpdir, "run.spats"))
+        self.assertEqual(3 * len(long_cases), spats.counters.registered_pairs)
+        for case in long_cases:
+            for key, count in spats.counters.registered_dict().iteritems():
+                if key.endswith(":{}:{}".format(case[4], case[3])):
+                    self.assertEqual(3, count)
+                    break
+            else:
+                self.fail("no registered count for {}".format(case[0]))
+
+
 prefix_cases = [
     [ "p1", "AGGTGTCCTTGGTGCCCGAGTCAGGACAACTCCAGT", "TTATAGGCGATGGAGTTCGCCATAAACGCTGCTTAG", 132, 0, '' ],
     [ "p2", "AGGTGTCCTTGGTGCCCGAGTCAGGACAACTCCAGT", "TTTATAGGCGATGGAGTTCGCCATAAACGCTGCTTA", 132, 0, 'T' ],
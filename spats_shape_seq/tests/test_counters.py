@@ -0,0 +1,64 @@
+import unittest
+
+from spats_shape_seq.counters import Counters
+
+
+registered = { "0:RRRY:3:20" : 5,
+               "0:RRRY:0:20" : 2,
+               "0:RRRY:M7:20" : 4,
+               "0:RRRY:Mq3:20" : 1,
+               "0:YYYR:S4M5:20" : 3,
+               "0:YYYR:I9:20" : 1,
+               "1:YYYR:D10:12" : 6,
+               "1:YYYR:S4M7:12" : 2,     # doesn't fit the edge mut vector
+               "1:RRRY:-1:12" : 1 }
+
+depths = { "0:RRRY:20" : [ 2 ] * 3 + [ 7 ] * 18,
+           "1:YYYR:12" : [ 0 ] * 13 }
+
+
+class _Target(object):
+    def __init__(self, rowid):
+        self.rowid = rowid
+
+
+class TestCounters(unittest.TestCase):
+
+    def test_count_data_roundtrip(self):
+        c = Counters()
+        c.update_with_count_data(({ "RRRY_kept" : 7 }, registered), (depths, depths))
+        (counts, reg), (d, qd) = c.count_data()
+        self.assertEqual(registered, reg)
+        self.assertEqual(depths, d)
+        self.assertEqual(depths, qd)
+        self.assertEqual(7, c.RRRY_kept)
+        c.update_with_count_data(({ "RRRY_kept" : 7 }, registered), (depths, {}))
+        self.assertEqual({ key : 2 * val for key, val in registered.iteritems() }, c.registered_dict())
+        self.assertEqual(14, c.RRRY_kept)
+
+    def test_accessors(self):
+        c = Counters()
+        c.update_with_count_data(({}, registered), (depths, depths))
+        t0 = _Target(0)
+        counts = c.mask_counts(t0, "RRRY", 20)
+        self.assertEqual(21, len(counts))
+        self.assertEqual(5, counts[3])
+        self.assertEqual(4, c.mask_muts(t0, "RRRY", 20)[7])
+        self.assertEqual(1, c.mask_removed_muts(t0, "RRRY", 20)[3])
+        self.assertEqual(3, c.mask_edge_muts(t0, "YYYR", 20)[4])
+        self.assertEqual(1, c.mask_inserts(t0, "YYYR", 20)[9])
+        self.assertEqual(6, c.mask_deletes(_Target(1), "YYYR", 12)[10])
+        self.assertEqual([ 0 ] * 6, c.mask_counts(t0, "YYYR", 5))
+        self.assertEqual(depths["0:RRRY:20"], c.mask_depths(t0, "RRRY", 20))
+        self.assertEqual(5, c.site_count(0, "RRRY", 20, 3))
+        self.assertEqual(4, c.site_mut_count(0, "RRRY", 20, 7))
+        self.assertEqual(16, c.target_total(t0))
+        self.assertEqual(9, c.target_total(_Target(1)))
+
+    def test_load_from_db_data(self):
+        c = Counters()
+        c.load_from_db_data([ (0, "RRRY", 2, 5, 3), (0, "RRRY", 4, 5, 1), (0, "RRRY", 2, 5, 2) ])
+        t0 = _Target(0)
+        self.assertEqual([ 0, 0, 5, 0, 1, 0 ], c.mask_counts(t0, "RRRY", 5))
+        self.assertEqual([ 0, 0, 5, 5, 6, 6 ], c.mask_depths(t0, "RRRY", 5))
+        self.assertEqual([ 0, 0, 5, 5, 6, 6 ], c.mask_quality_depths(t0, "RRRY", 5))
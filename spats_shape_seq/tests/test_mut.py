@@ -1,6 +1,8 @@
+import nose
 import unittest
 
 from spats_shape_seq import Spats
+from spats_shape_seq.native import NativeLookupEngine
 from spats_shape_seq.pair import Pair
 
 # [ id, r1, r2, end, site, muts ]
@@ -202,6 +204,30 @@ class TestMutPairsLookup(TestMutPairs):
         self.spats.addTargets("test/mut/mut_single.fa")
 
 
+class TestMutPairsNative(TestMutPairs):
+
+    def setup_processor(self):
+        self.spats.run.algorithm = "native"
+        self.spats.addTargets("test/mut/mut_single.fa")
+
+    def test_batch(self):
+        if not NativeLookupEngine.available():
+            raise nose.SkipTest()
+        self.spats.run.pair_length = len(cases[0][1])
+        batch = []
+        for case in cases:
+            pair = self.run_case(case)
+            batch.append((1, case[1], case[2], case[0], pair.r1.quality, pair.r2.quality))
+        processor = self.spats._processor
+        expected = processor.counters
+        processor.reset_counts()
+        self.assertTrue(processor.process_pair_batch(batch))
+        self.assertTrue(expected.registered_pairs > 0)
+        self.assertEqual(expected.registered_dict(), processor.counters.registered_dict())
+        self.assertEqual(expected.counts_dict(), processor.counters.counts_dict())
+        self.assertEqual(expected.count_data()[1], processor.counters.count_data()[1])
+
+
 class TestMutPairsCotrans(TestMutPairs):
 
     def setup_processor(self):
@@ -1,6 +1,8 @@
+import os
 import unittest
 
 from spats_shape_seq.pair import Pair
+from spats_shape_seq.processor import Failures
 
 
 cases = [
@@ -60,6 +62,21 @@ cases = [
 ]
 
 
+def write_case_fastqs(tmpdir, copies = 10, pair_cases = None):
+    """Writes copies of each of the pair cases (default: cases above) to
+    R1.fastq and R2.fastq in tmpdir, and returns their paths.
+    """
+    r1_path = os.path.join(tmpdir, "R1.fastq")
+    r2_path = os.path.join(tmpdir, "R2.fastq")
+    with open(r1_path, 'wb') as r1_out, open(r2_path, 'wb') as r2_out:
+        for i in xrange(copies):
+            for case in (pair_cases or cases):
+                # quality lines starting with '@' make resynchronizing on record boundaries non-trivial
+                for out, seq, extra in ( (r1_out, case[1], '1'), (r2_out, case[2], '2') ):
+                    out.write("@{}_{} {}:N:0\n{}\n+\n{}\n".format(case[0], i, extra, seq, '@' * len(seq)))
+    return r1_path, r2_path
+
+
 class TestPairs(unittest.TestCase):
 
     def setUp(self):
@@ -120,6 +137,196 @@ class TestPairsWithU(TestPairs):
         self.spats.addTargets("test/5s/5su.fa")
 
 
+# and again through a (small, so that it evicts) pair cache
+class TestPairsCached(TestPairs):
+
+    def setUp(self):
+        from spats_shape_seq import Spats
+        self.spats = Spats()
+        self.spats.run.pair_cache_size = 4
+        self.spats.addTargets("test/5s/5s.fa")
+
+    def test_cache_replay(self):
+        from spats_shape_seq import Spats
+        uncached = Spats()
+        uncached.addTargets("test/5s/5s.fa")
+        for i in xrange(3):
+            for case in cases[:6] + cases[:2]:
+                for spats in (self.spats, uncached):
+                    pair = self.pair_for_case(case)
+                    pair.multiplicity = i + 1
+                    spats.process_pair(pair)
+                    self.assertEqual(case[3], pair.site)
+        counts = self.spats.counters.counts_dict()
+        self.assertTrue(counts.pop('pair_cache_hits') > 0)
+        self.assertTrue(counts.pop('pair_cache_misses') > 0)
+        self.assertEqual(uncached.counters.counts_dict(), counts)
+        self.assertEqual(uncached.counters.registered_dict(), self.spats.counters.registered_dict())
+        self.assertEqual(uncached.counters._depth_dicts(), self.spats.counters._depth_dicts())
+
+
+# and again the way a worker does it: one Pair, reset in place for each
+# case, going through the cache (whose entries the resets mustn't touch)
+class TestPairsReused(TestPairsCached):
+
+    def setUp(self):
+        TestPairsCached.setUp(self)
+        self.pair = Pair()
+
+    def pair_for_case(self, case):
+        self.pair.set_from_data(case[0], case[1], case[2])
+        return self.pair
+
+    def test_trimmed_strings(self):
+        pair = self.pair_for_case(cases[0])
+        pair.r1.quality = "ABCDEFGHIJKLMNOPQRSTUVWXYZ123456789"
+        self.assertEqual(cases[0][1], pair.r1.subsequence)
+        self.assertEqual("987654321", pair.r1.reverse_quality[:9])
+        pair.r1.ltrim = 4
+        pair.r1.rtrim = 9
+        self.assertEqual("GTCCTTGGTGCCCGAGTCAGAT", pair.r1.subsequence)
+        self.assertEqual("ATCTGACTCGGGCACCAAGGAC", pair.r1.reverse_complement)
+        self.assertEqual("ZYXWVUTSRQPONMLKJIHGFE", pair.r1.reverse_quality)
+        pair.r1.quality = "z" * 35
+        self.assertEqual("z" * 22, pair.r1.subquality)
+        pair = self.pair_for_case(cases[1])
+        self.assertEqual(None, pair.r1.quality)
+        self.assertEqual(0, pair.r1.ltrim)
+        self.assertEqual(cases[1][1], pair.r1.subsequence)
+
+
+# and again with the hybrid algorithm, which should count the same as find_partial
+class TestPairsHybrid(TestPairs):
+
+    def setUp(self):
+        from spats_shape_seq import Spats
+        self.spats = Spats()
+        self.spats.run.algorithm = "hybrid"
+        self.spats.addTargets("test/5s/5s.fa")
+
+    def test_tiers(self):
+        from spats_shape_seq import Spats
+        partial = Spats()
+        partial.run.algorithm = "find_partial"
+        partial.addTargets("test/5s/5s.fa")
+        for case in cases:
+            for spats in (self.spats, partial):
+                spats.process_pair(self.pair_for_case(case))
+        counts = self.spats.counters.counts_dict()
+        lookup_pairs = counts.pop('lookup_tier_pairs')
+        find_partial_pairs = counts.pop('find_partial_tier_pairs')
+        self.assertTrue(lookup_pairs > 0)
+        self.assertTrue(find_partial_pairs > 0)
+        # pairs that fail before the lookup don't go through either tier
+        self.assertEqual(len(cases), lookup_pairs + find_partial_pairs + counts.get('indeterminate', 0) + counts.get('mask_failure', 0))
+        self.assertEqual(partial.counters.counts_dict(), counts)
+        self.assertEqual(partial.counters.registered_dict(), self.spats.counters.registered_dict())
+
+
+# with handle_indels, a batch of pairs is aligned all together, which
+# should count the same as one pair at a time
+class TestIndelPairsBatch(unittest.TestCase):
+
+    def make_spats(self, algorithm):
+        from spats_shape_seq import Spats
+        spats = Spats()
+        spats.run.algorithm = algorithm
+        spats.run.handle_indels = True
+        spats.run.count_mutations = True
+        spats.addTargets("test/5s/5s.fa")
+        return spats
+
+    def check_batch(self, algorithm):
+        single = self.make_spats(algorithm)
+        batch = []
+        for idx, case in enumerate(cases * 2):
+            pair = Pair()
+            pair.set_from_data(case[0], case[1], case[2], idx + 1)
+            single.process_pair(pair)
+            batch.append((idx + 1, case[1], case[2], case[0], None, None))
+        processor = self.make_spats(algorithm)._processor
+        self.assertTrue(processor.process_pair_batch(batch))
+        self.assertTrue(single.counters.registered_pairs > 0)
+        self.assertEqual(single.counters.counts_dict(), processor.counters.counts_dict())
+        self.assertEqual(single.counters.registered_dict(), processor.counters.registered_dict())
+
+    def test_batch(self):
+        self.check_batch("find_partial")
+
+    def test_batch_hybrid(self):
+        self.check_batch("hybrid")
+
+
+# a band limits the alignment to near the main diagonal, which changes
+# which alignment wins -- not just which long indels are found -- so
+# the results can differ from the full alignment, either way
+class TestBandedIndelPairs(unittest.TestCase):
+
+    def process(self, band):
+        from spats_shape_seq import Spats
+        spats = Spats()
+        spats.run.handle_indels = True
+        spats.run.count_mutations = True
+        spats.run.indel_alignment_band = band
+        spats.addTargets("test/5s/5s.fa")
+        pair = Pair()
+        pair.set_from_data("banded", "TTCGGTCCTTGGTGCCCGAGTCAGATGCCTGGCAGTTCCCTACTCTCCGC", "ATGCGGAGAGTAGGGAACTGCCAGGCATCTGACTCGGGCACCAAGGACCG")
+        spats.process_pair(pair)
+        return pair
+
+    def test_divergent(self):
+        pair = self.process(None)
+        self.assertFalse(pair.has_site)
+        self.assertEqual(Failures.match_errors, pair.failure)
+        pair = self.process(4)
+        self.assertTrue(pair.has_site)
+        self.assertEqual((96, 143), (pair.site, pair.end))
+        # ...with a 1nt insert at 100
+        self.assertEqual([ 100 ], pair.r1.indels.keys())
+        self.assertTrue(pair.r1.indels[100].insert_type)
+        self.assertEqual(1, len(pair.r1.indels[100].seq))
+
+
+# pre-trimmed reads: the same cases with the adapters cut off, so that
+# the reads all have different lengths
+class TestTrimmedPairs(unittest.TestCase):
+
+    def setUp(self):
+        from spats_shape_seq import Spats
+        self.spats = Spats()
+        self.spats.run.algorithm = "lookup"
+        self.spats.addTargets("test/5s/5s.fa")
+
+    def tearDown(self):
+        self.spats = None
+
+    def trimmed(self, seq):
+        cut = seq.find("AGATCGG", 4)
+        return seq[:cut] if cut > 0 else seq
+
+    def test_lookup_trimmed_pairs(self):
+        lengths = set()
+        for case in cases:
+            if case[3] is None:
+                continue
+            pair = Pair()
+            pair.set_from_data(case[0], self.trimmed(case[1]), self.trimmed(case[2]))
+            self.spats.process_pair(pair)
+            self.assertEqual(case[3], pair.site, "res={} != {} ({})".format(pair.site, case[3], case[0]))
+            lengths.add(pair.r1.original_len)
+        self.assertTrue(len(lengths) > 2)
+
+    def test_lookup_too_short(self):
+        pair = Pair()
+        pair.set_from_data(*cases[0][:3])
+        self.spats.process_pair(pair)
+        pair = Pair()
+        pair.set_from_data("x", "AAACGTCCTTGG", "CCAAGGACGTTT")
+        self.spats.process_pair(pair)
+        self.assertEqual(None, pair.site)
+        self.assertEqual(Failures.nomatch, pair.failure)
+
+
 class TestPanelPairs(unittest.TestCase):
 
     def setUp(self):
@@ -140,6 +347,18 @@ class TestPanelPairs(unittest.TestCase):
         self.assertEqual(None, pair.target)
         self.assertEqual(1, self.spats.counters.multiple_R1_match)
 
+    def test_hybrid_falls_back_on_shared_target_ends(self):
+        # R1 is an exact match for the end of 5S, with adapter, but the
+        # same 18nt occur in other targets: so lookup registers it, and
+        # find_partial (and so hybrid) doesn't
+        case = [ "133", "GAACGTCCTTGGTGCCCGAGTGAAGATCGGAAGAGC", "TCACTCGGGCACCAAGGACGTTCAGATCGGAAGAGC" ]
+        self.spats.run.algorithm = "hybrid"
+        pair = Pair()
+        pair.set_from_data(*case)
+        self.spats.process_pair(pair)
+        self.assertEqual(None, pair.site)
+        self.assertEqual(1, self.spats.counters.find_partial_tier_pairs)
+
 
 prefix_cases = [
     [ "p1", "AAACGTCCTTGGTGCCCGAGTCAGATGCCTGGCAG", "GGATGCCTGGCGGCCGTAGCGCGGTGGTCCCACCT", 0, '' ],
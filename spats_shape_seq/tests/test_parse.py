@@ -0,0 +1,172 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from spats_shape_seq.parse import dedup_pair_batches, fastq_shards, FastFastqParser, GzipStreamReader, is_gzipped
+from spats_shape_seq.tests.test_pairs import write_case_fastqs
+
+
+R1_PATH = "test/profile/handmade_R1.fastq"
+R2_PATH = "test/profile/handmade_R2.fastq"
+
+
+def _gzip_members(src, dst, lines_per_member = 0):
+    # lines_per_member > 0 writes concatenated gzip members, as bgzip does
+    lines = open(src, 'rb').readlines()
+    step = lines_per_member or len(lines)
+    with open(dst, 'wb') as outfile:
+        for i in xrange(0, len(lines), step):
+            member = gzip.GzipFile(fileobj = outfile, mode = 'wb')
+            member.write(''.join(lines[i:i + step]))
+            member.close()
+
+
+class TestGzipInput(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _all_pairs(self, r1, r2):
+        with FastFastqParser(r1, r2, parse_quality = True) as parser:
+            return [ pair for batch in parser.iterator(7) for pair in batch ]
+
+    def _check(self, lines_per_member):
+        r1 = os.path.join(self.tmpdir, "R1.fastq.gz")
+        r2 = os.path.join(self.tmpdir, "R2.fastq.gz")
+        _gzip_members(R1_PATH, r1, lines_per_member)
+        _gzip_members(R2_PATH, r2, lines_per_member)
+        self.assertTrue(is_gzipped(r1))
+        self.assertFalse(is_gzipped(R1_PATH))
+        expected = self._all_pairs(R1_PATH, R2_PATH)
+        self.assertTrue(len(expected) > 0)
+        self.assertEqual(expected, self._all_pairs(r1, r2))
+        self.assertEqual(FastFastqParser(R1_PATH, R2_PATH).pair_length(), FastFastqParser(r1, r2).pair_length())
+
+    def test_gzip(self):
+        self._check(0)
+
+    def test_bgzip(self):
+        self._check(5)
+
+    def test_small_chunks(self):
+        r1 = os.path.join(self.tmpdir, "R1.fastq.gz")
+        _gzip_members(R1_PATH, r1, 3)
+        with GzipStreamReader(r1, chunk_size = 17, queue_depth = 2) as reader:
+            self.assertEqual(open(R1_PATH, 'rb').readlines(), list(reader))
+            self.assertEqual('', reader.readline())
+
+    def test_early_close(self):
+        r1 = os.path.join(self.tmpdir, "R1.fastq.gz")
+        _gzip_members(R1_PATH, r1, 1)
+        reader = GzipStreamReader(r1, chunk_size = 17, queue_depth = 1)
+        self.assertEqual(open(R1_PATH, 'rb').readline(), reader.readline())
+        reader.close()
+
+
+class TestShards(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.r1_path, self.r2_path = write_case_fastqs(self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _all_pairs(self, shard = None):
+        with FastFastqParser(self.r1_path, self.r2_path, parse_quality = True, shard = shard) as parser:
+            return [ pair for batch in parser.iterator(7) for pair in batch ]
+
+    def test_shards(self):
+        expected = self._all_pairs()
+        for num_shards in xrange(1, 40, 3):
+            shards = fastq_shards(self.r1_path, self.r2_path, num_shards)
+            self.assertTrue(0 < len(shards) <= num_shards)
+            self.assertEqual(expected, [ pair for shard in shards for pair in self._all_pairs(shard) ])
+
+    def _rewrite_r2_headers(self, header_fn):
+        lines = open(self.r2_path, 'rb').readlines()
+        for i in xrange(0, len(lines), 4):
+            lines[i] = header_fn(i / 4, lines[i])
+        open(self.r2_path, 'wb').write(''.join(lines))
+
+    def test_shards_drift(self):
+        # R2 records whose sizes vary differently from R1, so that the R2
+        # boundaries are well away from the proportional offsets
+        self._rewrite_r2_headers(lambda i, header: header.rstrip('\n') + ' ' + 'x' * (0 if i < 300 else 200) + '\n')
+        expected = self._all_pairs()
+        for num_shards in (2, 5, 17):
+            shards = fastq_shards(self.r1_path, self.r2_path, num_shards)
+            self.assertEqual(num_shards, len(shards))
+            self.assertEqual(expected, [ pair for shard in shards for pair in self._all_pairs(shard) ])
+
+    def test_shards_mismatch(self):
+        self._rewrite_r2_headers(lambda i, header: '@other_{}\n'.format(i))
+        self.assertRaises(Exception, fastq_shards, self.r1_path, self.r2_path, 4)
+
+    def test_sharded_run(self):
+        from spats_shape_seq import Spats
+        def run_spats(sharded):
+            spats = Spats()
+            spats.run.quiet = True
+            spats.run.num_workers = 2
+            spats.run.sharded_input = sharded
+            spats.addTargets("test/5s/5s.fa")
+            spats.process_pair_data(self.r1_path, self.r2_path)
+            return spats.counters
+        expected = run_spats(False)
+        sharded = run_spats(True)
+        self.assertTrue(expected.registered_pairs > 0)
+        self.assertEqual(expected.registered_dict(), sharded.registered_dict())
+        self.assertEqual(expected.counts_dict(), sharded.counts_dict())
+
+
+class TestDedup(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.r1_path, self.r2_path = write_case_fastqs(self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _pair_counts(self, batches):
+        counts = {}
+        for batch in batches:
+            for pair_info in batch:
+                key = (pair_info[1], pair_info[2])
+                counts[key] = counts.get(key, 0) + pair_info[0]
+        return counts
+
+    def test_dedup_batches(self):
+        with FastFastqParser(self.r1_path, self.r2_path) as parser:
+            expected = self._pair_counts(parser.iterator(7))
+        for max_unique in (1, 5, 1000):
+            with FastFastqParser(self.r1_path, self.r2_path) as parser:
+                batches = list(dedup_pair_batches(parser.iterator(7), max_unique, 4))
+            self.assertEqual(expected, self._pair_counts(batches))
+            self.assertTrue(all(0 < len(batch) <= 4 for batch in batches))
+            ids = [ pair_info[3] for batch in batches for pair_info in batch ]
+            self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(len(expected), sum(len(batch) for batch in batches))
+
+    def test_dedup_run(self):
+        from spats_shape_seq import Spats
+        def run_spats(dedup):
+            spats = Spats()
+            spats.run.quiet = True
+            spats.run.num_workers = 1
+            spats.run.dedup_pairs = dedup
+            spats.addTargets("test/5s/5s.fa")
+            spats.process_pair_data(self.r1_path, self.r2_path)
+            return spats.counters
+        expected = run_spats(False)
+        dedup = run_spats(True)
+        self.assertTrue(expected.registered_pairs > 0)
+        self.assertEqual(expected.total_pairs, dedup.total_pairs)
+        self.assertEqual(expected.registered_dict(), dedup.registered_dict())
+        self.assertEqual(expected.counts_dict(), dedup.counts_dict())
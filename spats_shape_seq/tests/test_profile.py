@@ -1,8 +1,11 @@
 import nose
 import os
+import random
 import subprocess
 import unittest
 
+from spats_shape_seq.profiles import TargetProfiles, _compute_vectorized, numpy
+from spats_shape_seq.run import Run
 from spats_shape_seq.tool import SpatsTool
 
 class TestProfile(unittest.TestCase):
@@ -21,3 +24,49 @@ class TestProfile(unittest.TestCase):
         finally:
             os.chdir(testdir)
 
+
+
+class _Owner(object):
+    def __init__(self, run):
+        self._run = run
+
+
+class TestVectorizedProfiles(unittest.TestCase):
+
+    def _profiles(self, owner, mutated):
+        rand = random.Random(17)
+        profiles = []
+        for n in range(0, 40) + [ 150 ] * 5:
+            def vect(hi, length = n + 1):
+                # mostly small values, so that zero depths, counts == depth, etc. are common
+                return [ rand.choice([ 0, 1, 2, rand.randint(0, hi) ]) for i in xrange(length) ]
+            depths = [ vect(6), vect(6), vect(6), vect(6) ]
+            p = TargetProfiles(owner, None, vect(3), vect(3), *depths)
+            if mutated:
+                p.treated_muts, p.untreated_muts = vect(2), vect(2)
+                p.treated_inserts, p.untreated_inserts = vect(1), vect(1)
+                if n % 3:
+                    p.treated_deletes, p.untreated_deletes = vect(1), vect(1)
+            profiles.append(p)
+        return profiles
+
+    def _results(self, profiles):
+        # repr() distinguishes int 0 from 0.0 and keeps all float bits
+        return [ repr((p.betas, p.thetas, p.rhos, p.z, p.c, p.c_thresh, getattr(p, 'mu', None), getattr(p, 'r_mut', None))) for p in profiles ]
+
+    def test_vectorized_matches_scalar(self):
+        if not numpy:
+            raise nose.SkipTest()
+        for allow_negative_values in (False, True):
+            for compute_z_reactivity in (False, True):
+                for mutated in (False, True):
+                    run = Run()
+                    run.allow_negative_values = allow_negative_values
+                    run.compute_z_reactivity = compute_z_reactivity
+                    owner = _Owner(run)
+                    scalar = self._profiles(owner, mutated)
+                    for p in scalar:
+                        p.compute()
+                    vectorized = self._profiles(owner, mutated)
+                    _compute_vectorized(vectorized, run)
+                    self.assertEqual(self._results(scalar), self._results(vectorized))
@@ -1,8 +1,8 @@
 
 import unittest
 
-from spats_shape_seq.util import reverse_complement, string_find_errors, string_match_errors, align_strings, AlignmentParams, string_find_with_overlap
-from spats_shape_seq.mask import longest_match, base_similarity_ind
+from spats_shape_seq.util import reverse_complement, string_find_errors, string_match_errors, string_edit_distance, string_edit_distance2, align_strings, align_strings_batch, AlignmentParams, string_find_with_overlap
+from spats_shape_seq.mask import longest_match, base_similarity_ind, match_mask_optimized, Mask, MaskClassifier
 
 
 class TestUtils(unittest.TestCase):
@@ -61,6 +61,29 @@ class TestUtils(unittest.TestCase):
         self.assertTrue(len(m) == 4  and  len(set(m) & set([9, 10, 11, 14, 16, 20, 23, 26])) == 4)
         m = string_find_errors("GCAT", "AAAACCCCGGGGTTTTATATACGTCAGCCC", 2, 8)
         self.assertTrue(len(m) == 8  and  len(set(m) & set([9, 10, 11, 14, 16, 20, 23, 26])) == 8)
+        self.assertEqual([9, 10, 11, 14, 16, 20, 23, 26], string_find_errors("GCAT", "AAAACCCCGGGGTTTTATATACGTCAGCCC", 2, 10))
+        self.assertEqual([], string_find_errors("GCATGCAT", "GCAT", 2))
+
+    def test_mask_classifier(self):
+        seqs = [ "AGGCTTAG", "CTTAGGAC", "AGGA", "NGGCTT", "AGUCTT", "CTTGAC", "GGA", "", "TTCGA", "ANGCAT" ]
+        masks = [ Mask("RRRY"), Mask("YYYR") ]
+        optimized = MaskClassifier(masks, optimized = True).classify(seqs)
+        self.assertEqual([ 0, 1, -1, -1, -1, 1, -1, -1, 1, -1 ], optimized)
+        for seq, idx in zip(seqs, optimized):
+            if idx >= 0:
+                self.assertEqual(masks[idx], match_mask_optimized(seq, masks))
+        # N matches anything with Mask.matches, and -1 leaves the rest (like the too-short ones) to the caller
+        masks = [ Mask("NNNA"), Mask("RY"), Mask("YYYR") ]
+        self.assertEqual([ -1, 0, 0, -1, -1, 2, -1, -1, 2, 1 ], MaskClassifier(masks).classify(seqs))
+        self.assertEqual([ 0, 0 ], MaskClassifier([ Mask("plus"), Mask("minus") ]).classify(seqs[:2]))
+
+    def test_string_edit_distance(self):
+        self.assertEqual((4, 8), string_edit_distance("GATTACA", "GCATGCU", 1))
+        self.assertEqual((6, 16), string_edit_distance("GATTACA", "GCATGCU", 2))
+        self.assertEqual((1, 11, 1), string_edit_distance2("ACGTACGTAC", "ACGTTCGTAC", 1))
+        self.assertEqual((2, 22, 2), string_edit_distance2("ACGTACGTAC", "ACGTTCGTAC", 2))
+        self.assertEqual((2, 22, 2), string_edit_distance2("ACGTACGTAC", "ACGACGTAAC", 2))
+        self.assertEqual((3, 5, 1), string_edit_distance2("", "ACG", 2))
 
     def test_align_strings(self):
         ## Note more testing of this is done in the json test suite.
@@ -155,3 +178,37 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(a.indels_as_dict(), { '2': { 'insert_type': True, 'seq': "XXX", "src_index": 2 } })
         self.assertEqual(a.indels_delta, 3)
         self.assertEqual(len(a.mismatched), 0)
+
+    def test_align_strings_banded(self):
+        simfn = lambda a,b: base_similarity_ind(a, b, 3, 2, 1.5)
+        R = "GGMCSCGATGCCGNACGATKTAAGTCCGAGCATCAACTATGCCCTACCTGCTTCGRCCGATAAAGCTTTCAAWAGACGAYAAT"
+        T = "GGACCCGATGCCGGACGAAAGTCCGCGCATCAACTATGCCTCTACCTGCTTCGGCCGATAAAGCCGACGATAATACTCCCAAAGCCCACCCAGATCGGAAGAGCGTCGTGTAG"
+        full = align_strings(R, T, AlignmentParams(simfn, 5, 1))
+        # the indels add up to a shift of 9, so a band that wide finds the same alignment
+        a = align_strings(R, T, AlignmentParams(simfn, 5, 1, band = 9))
+        self.assertEqual(full.indels_delta, 9)
+        for attr in ('score', 'target_match_start', 'target_match_end', 'src_match_start', 'src_match_end', 'mismatched', 'max_run'):
+            self.assertEqual(getattr(full, attr), getattr(a, attr))
+        self.assertEqual(full.indels_as_dict(), a.indels_as_dict())
+        # ...and a narrower one can't shift that far
+        a = align_strings(R, T, AlignmentParams(simfn, 5, 1, band = 3))
+        self.assertTrue(a.indels_delta <= 3)
+        self.assertTrue(a.score < full.score)
+
+    def test_align_strings_batch(self):
+        simfn = lambda a,b: base_similarity_ind(a, b, 3, 2, 1.5)
+        R = "GGMCSCGATGCCGNACGATKTAAGTCCGAGCATCAACTATGCCCTACCTGCTTCGRCCGATAAAGCTTTCAAWAGACGAYAAT"
+        T = "GGACCCGATGCCGGACGAAAGTCCGCGCATCAACTATGCCTCTACCTGCTTCGGCCGATAAAGCCGACGATAATACTCCCAAAGCCCACCCAGATCGGAAGAGCGTCGTGTAG"
+        # enough jobs, of assorted sizes, to be filled in together
+        jobs = [ (R[i:i + 10 + 3 * i], T[2 * i:]) for i in xrange(20) ] + [ None, (R[::-1], T[::-1]) ]
+        for ap in (AlignmentParams(simfn, 5, 1), AlignmentParams(simfn, 5, 1, band = 4), AlignmentParams(simfn, 6, 1, front_biased = False, penalize_ends = False)):
+            batch = align_strings_batch(jobs, ap)
+            self.assertEqual(len(jobs), len(batch))
+            self.assertEqual(None, batch[20])
+            for job, a in zip(jobs, batch):
+                if not job:
+                    continue
+                single = align_strings(job[0], job[1], ap)
+                for attr in ('score', 'target_match_start', 'target_match_end', 'src_match_start', 'src_match_end', 'mismatched', 'max_run'):
+                    self.assertEqual(getattr(single, attr), getattr(a, attr))
+                self.assertEqual(single.indels_as_dict(), a.indels_as_dict())
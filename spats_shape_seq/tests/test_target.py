@@ -1,4 +1,5 @@
 
+import os
 import unittest
 
 from spats_shape_seq.parse import fasta_parse
@@ -56,6 +57,180 @@ class TestTargetIndexing(unittest.TestCase):
         self.assertEqual([0, 8, 135], tgt.find_partial("CCAAGGACTGGAAGATCGGAAGAGCGTCGTGTAGG")[1:])
         self.assertEqual([11, 20, 123], tgt.find_partial("CGGGCACCAAGCTGACTCGGGCACCAAGGAC")[1:])
 
+    def test_packed_index(self):
+        import random
+        rand = random.Random(12)
+        targets = Targets()
+        for name, seq in fasta_parse("test/panel_RNAs/panel_RNAs_complete.fa"):
+            targets.addTarget(name, seq)
+        targets.addTarget("N", TARGET_5S[:40] + "NN" + TARGET_5S[40:])
+        queries = []
+        for i in xrange(300):
+            target = rand.choice(targets.targets)
+            start = rand.randrange(target.n - 20)
+            query = list(target.seq[start:start + rand.randrange(4, 40)])
+            for j in xrange(rand.randrange(3)):
+                query[rand.randrange(len(query))] = rand.choice("ACGTN")
+            queries.append(''.join(query))
+        def results(packed):
+            targets.index(packed = packed)
+            res = []
+            for query in queries:
+                if len(query) >= 8:
+                    res.append(targets.find_exact(query))
+                    res.append(targets.find_partial(query))
+                    res.append(targets.find_partial_all(query))
+                res.append(targets.find_partial_prefix(query))
+            return res
+        self.assertEqual(results(False), results(True))
+        # longs would compare equal, but slow down matching
+        target, index = targets._index.get(TARGET_5S[10:18])[0]
+        self.assertEqual(int, type(index))
+
+    def test_suffix_array(self):
+        import random
+        rand = random.Random(5)
+        targets = Targets()
+        for name, seq in fasta_parse("test/panel_RNAs/panel_RNAs_complete.fa"):
+            targets.addTarget(name, seq)
+        # similar targets, so that there are multiple-target ties
+        base = TARGET_SRP[20:100]
+        for i in xrange(6):
+            targets.addTarget("similar{}".format(i), TARGET_5S[i * 7:i * 7 + 20] + base[:i * 9] + "G" + base[i * 9 + 1:])
+        queries = []
+        for i in xrange(500):
+            target = rand.choice(targets.targets)
+            start = rand.randrange(target.n - 10)
+            query = list(target.seq[start:start + rand.randrange(10, 45)])
+            for j in xrange(rand.randrange(4)):
+                query[rand.randrange(len(query))] = rand.choice("ACGTN")
+            queries.append(''.join(query))
+        def results(suffix_array):
+            targets.index(suffix_array = suffix_array)
+            return [ targets.find_partial(query, min_length_override = override) for query in queries for override in (0, 9) ]
+        expected = results(False)
+        self.assertTrue(any(isinstance(res[0], list) for res in expected))
+        self.assertEqual(expected, results(True))
+
+    def test_target_self_matches(self):
+        import shutil, tempfile
+        from spats_shape_seq.suffix import longest_repeat
+        self.assertEqual(0, longest_repeat("ACGT"))
+        self.assertEqual(3, longest_repeat("AAAA"))
+        self.assertEqual(4, longest_repeat("GATCAAGATCT"))
+        self.assertEqual(9, longest_repeat(TARGET_SRP[:60] + TARGET_SRP[20:29] + "A"))
+        targets = Targets()
+        for name, seq in fasta_parse("test/panel_RNAs/panel_RNAs_complete.fa"):
+            targets.addTarget(name, seq)
+        targets.minimum_match_length = 10
+        targets.index()
+        matches = targets.longest_target_self_matches()
+        for target in targets.targets:
+            self.assertEqual(targets._scan_target_self_match(target, 10), matches[target.name])
+        repeats = Targets()
+        repeats.addTarget("repeat", TARGET_SRP[:50] + "T" + TARGET_SRP[10:30])
+        repeats.addTarget("indeterminate", TARGET_5S[:50] + "NT" + TARGET_5S[10:30])
+        repeats.minimum_match_length = 10
+        repeats.index()
+        self.assertEqual({ "repeat" : 21, "indeterminate" : 20 }, repeats.longest_target_self_matches())
+        cache_dir = tempfile.mkdtemp()
+        try:
+            self.assertEqual(matches, targets.longest_target_self_matches(cache_dir = cache_dir))
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+            self.assertEqual(matches, targets.longest_target_self_matches(cache_dir = cache_dir))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_mapped_lookup_tables(self):
+        import shutil, tempfile
+        from spats_shape_seq.run import Run
+        run = Run()
+        run.count_mutations = True
+        run.pair_length = 35
+        run.cotrans_linker = "CTGACTCGGGCACCAAGGAC"
+        run.cache_dir = tempfile.mkdtemp()
+        def tables(build, targets):
+            run.mmap_lookup_tables = False
+            build(targets)
+            expected = (targets.r1_lookup, targets.r1_aliases, targets.r1_lookup_length, targets.r2_lookup, targets.r2_match_lengths)
+            run.mmap_lookup_tables = True
+            build(targets)   # builds and writes
+            build(targets)   # maps the existing file
+            self.assertEqual(expected[1:3], (targets.r1_aliases, targets.r1_lookup_length))
+            self.assertEqual(expected[4], targets.r2_match_lengths)
+            self.assertEqual(len(expected[0]), len(targets.r1_lookup))
+            for key, val in expected[0].iteritems():
+                self.assertEqual(val, targets.r1_lookup.get(key))
+            for name, table in expected[3].iteritems():
+                self.assertEqual(len(table), len(targets.r2_lookup[name]))
+                for key, val in table.iteritems():
+                    self.assertEqual(val, targets.r2_lookup[name].get(key))
+            self.assertEqual(None, targets.r1_lookup.get("A" * 31))
+        try:
+            targets = Targets()
+            for name, seq in fasta_parse("test/panel_RNAs/panel_RNAs_complete.fa"):
+                targets.addTarget(name, seq)
+            targets.index()
+            tables(lambda t : t.build_lookups(run, length = run.pair_length), targets)
+            cotrans = Targets()
+            cotrans.addTarget("5S", TARGET_5S)
+            cotrans.index()
+            run.pair_length = 50
+            tables(lambda t : t.build_cotrans_lookups(run), cotrans)
+            self.assertEqual(2, len([ f for f in os.listdir(run.cache_dir) if f.endswith(".lut") ]))
+        finally:
+            shutil.rmtree(run.cache_dir)
+
+    def test_compact_lookup_tables(self):
+        import random
+        from spats_shape_seq.run import Run
+        rand = random.Random(16)
+        targets = Targets()
+        for name, seq in fasta_parse("test/panel_RNAs/panel_RNAs_complete.fa")[:6]:
+            if len(seq) >= 100:
+                targets.addTarget(name, seq)
+        targets.index()
+        run = Run()
+        run.count_mutations = True
+        run.allowed_target_errors = 1
+        for pair_length in (36, 80):
+            # 80 has hashed keys, and short R1 keys (not enough adapter_b)
+            run.pair_length = pair_length
+            run.compact_lookup_tables = False
+            targets.build_lookups(run, length = pair_length)
+            r1_legacy, r2_legacy = targets.r1_lookup, targets.r2_lookup
+            reads = [ key + ''.join(rand.choice("ACGT") for i in xrange(pair_length - 4 - len(key))) for key in r1_legacy.keys() ]
+            expected = [ targets.lookup_r1(read) for read in reads ]
+            run.compact_lookup_tables = True
+            targets.build_lookups(run, length = pair_length)
+            self.assertEqual(len(r1_legacy), len(targets.r1_lookup) + sum(map(len, targets._r1_short_keys[1].values())))
+            self.assertEqual(expected, [ targets.lookup_r1(read) for read in reads ])
+            for name, table in r2_legacy.iteritems():
+                self.assertEqual(len(table), len(targets.r2_lookup[name]))
+                for key, val in table.iteritems():
+                    self.assertEqual(val, targets.lookup_r2(name, key))
+        # two substitutions
+        run.allowed_target_errors = 2
+        targets.build_lookups(run, length = 36)
+        target = targets.targets[0]
+        r2 = list(target.seq[20:52])
+        r2[3] = "T" if r2[3] != "T" else "A"
+        r2[30] = "T" if r2[30] != "T" else "A"
+        self.assertEqual((20, [ 24, 51 ]), targets.lookup_r2(target.name, ''.join(r2) + "AAAA"))
+        r1 = list(reverse_complement(target.seq[-32:]))
+        r1[0] = "T" if r1[0] != "T" else "A"
+        r1[5] = "T" if r1[5] != "T" else "A"
+        self.assertEqual([ (target, None, 0, [ target.n, target.n - 5 ]) ], targets.lookup_r1(''.join(r1)))
+        self.assertEqual(None, targets.lookup_r1("N" * 32))
+        for compact, algorithm in ((False, "find_partial"), (True, "lookup")):
+            restricted = Run()
+            restricted.algorithm = "lookup"
+            restricted.count_mutations = True
+            restricted.allowed_target_errors = 2
+            restricted.compact_lookup_tables = compact
+            restricted.apply_config_restrictions()
+            self.assertEqual(algorithm, restricted.algorithm)
+
 class SRPTargetTest(unittest.TestCase):
     def setUp(self):
         self.target = Targets()
@@ -0,0 +1,149 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from spats_shape_seq import Spats
+from spats_shape_seq.db import PairDB
+from spats_shape_seq.parse import FastFastqParser
+from spats_shape_seq.worker import SpatsWorker
+from spats_shape_seq.tests.test_pairs import cases, write_case_fastqs
+
+
+class WorkerTestCase(unittest.TestCase):
+    # runs the pair cases through SpatsWorker, with the given run options
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.r1_path, self.r2_path = write_case_fastqs(self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _run(self, pair_db = None, progress_callback = None, **run_opts):
+        spats = Spats()
+        spats.run.quiet = True
+        spats.run.num_workers = 2
+        for key, value in run_opts.iteritems():
+            setattr(spats.run, key, value)
+        spats.progress_callback = progress_callback
+        spats.addTargets("test/5s/5s.fa")
+        if pair_db:
+            spats.run.writeback_results = True
+            spats.process_pair_db(pair_db, batch_size = 16)
+        else:
+            spats.process_pair_data(self.r1_path, self.r2_path)
+        return spats.counters
+
+    def assertSameCounts(self, expected, counters):
+        self.assertEqual(expected.registered_dict(), counters.registered_dict())
+        self.assertEqual(expected.counts_dict(), counters.counts_dict())
+
+
+class TestSharedMemoryBatches(WorkerTestCase):
+
+    def test_counts(self):
+        expected = self._run(shared_memory_batches = False)
+        shared = self._run(shared_memory_batches = True)
+        self.assertTrue(expected.registered_pairs > 0)
+        self.assertSameCounts(expected, shared)
+
+    def test_writeback(self):
+        pair_db = PairDB(os.path.join(self.tmpdir, "pairs.db"))
+        pair_db.show_progress_every = 0
+        pair_db.add_targets_table("test/5s/5s.fa")
+        pair_db.parse(self.r1_path, self.r2_path)
+        expected = self._run(pair_db, shared_memory_batches = False, result_set_name = "queue")
+        shared = self._run(pair_db, shared_memory_batches = True, result_set_name = "shared")
+        self.assertEqual(expected.registered_dict(), shared.registered_dict())
+        def results(name):
+            set_id = pair_db.result_set_id_for_name(name)
+            return list(pair_db.conn.execute("SELECT pair_id, target, mask, site, end, muts, multiplicity, failure FROM result WHERE set_id = ? ORDER BY pair_id", (set_id,)))
+        self.assertTrue(len(results("queue")) > 0)
+        self.assertEqual(results("queue"), results("shared"))
+
+    def _run_worker(self, batches, pair_db = None, result_set_id = None):
+        spats = Spats()
+        spats.run.quiet = True
+        spats.run.num_workers = 4
+        spats.run.shared_memory_batches = True
+        spats.addTargets("test/5s/5s.fa")
+        spats.run.apply_config_restrictions()
+        worker = SpatsWorker(spats.run, spats._processor, pair_db, result_set_id)
+        worker.run(iter(batches))
+        return worker._shared, spats.counters
+
+    def test_slots(self):
+        # many more batches than workers, which must all go through the
+        # slots rather than falling back to the queue
+        with FastFastqParser(self.r1_path, self.r2_path) as parser:
+            batches = list(parser.iterator(batch_size = 8))
+        self.assertTrue(len(batches) > 40)
+        shared, counters = self._run_worker(batches)
+        self.assertEqual((len(batches), 0), (shared.num_slot_batches, shared.num_queue_batches))
+        self.assertSameCounts(self._run(num_workers = 4, shared_memory_batches = False), counters)
+
+        pair_db = PairDB(os.path.join(self.tmpdir, "pairs.db"))
+        pair_db.show_progress_every = 0
+        pair_db.add_targets_table("test/5s/5s.fa")
+        pair_db.parse(self.r1_path, self.r2_path)
+        batches = list(pair_db.all_pairs(batch_size = 8))
+        set_id = pair_db.add_result_set("slots")
+        shared, counters = self._run_worker(batches, pair_db, set_id)
+        self.assertEqual((len(batches), 0), (shared.num_slot_batches, shared.num_queue_batches))
+        num_results = pair_db.conn.execute("SELECT COUNT(*) FROM result WHERE set_id = ?", (set_id,)).fetchone()[0]
+        self.assertEqual(10 * len(cases), num_results)
+
+
+class TestStageTiming(WorkerTestCase):
+
+    def test_timing(self):
+        npairs = 10 * len(cases)
+        for algorithm, num_workers, pair_cache_size in ( ("find_partial", 2, 0), ("lookup", 2, 0), ("find_partial", 1, 16) ):
+            opts = { "algorithm" : algorithm, "num_workers" : num_workers, "pair_cache_size" : pair_cache_size }
+            expected = self._run(**opts)
+            timed = self._run(stage_timing = True, **opts)
+            self.assertEqual({}, expected.stage_times())
+            self.assertSameCounts(expected, timed)
+            stage_times = timed.stage_times()
+            # merged across the workers
+            self.assertEqual(npairs, stage_times['pair'][1])
+            if pair_cache_size:
+                # cache hits replay their counts rather than registering them
+                self.assertTrue(timed.registered_pairs > stage_times['register'][1])
+            else:
+                self.assertEqual(timed.registered_pairs, stage_times['register'][1])
+            self.assertTrue(stage_times['pair'][0] > 0)
+            self.assertTrue(('find_in_targets' if algorithm == "find_partial" else 'lookup') in stage_times)
+
+
+class TestProgress(WorkerTestCase):
+
+    def test_progress(self):
+        total = 10 * len(cases)
+        for num_workers in (1, 2):
+            expected = self._run(num_workers = num_workers)
+            log_path = os.path.join(self.tmpdir, "progress{}.log".format(num_workers))
+            records = []
+            counters = self._run(progress_callback = records.append, num_workers = num_workers, progress_log = log_path, progress_interval = 0)
+            self.assertSameCounts(expected, counters)
+
+            with open(log_path) as log:
+                logged = [ json.loads(line) for line in log ]
+            self.assertEqual(len(records), len(logged))
+            self.assertEqual(records[-1]["pairs"], logged[-1]["pairs"])
+            final = records[-1]
+            self.assertTrue(final["done"])
+            self.assertFalse(any(r["done"] for r in records[:-1]))
+            self.assertEqual(total, final["pairs"])
+            # (approximate, from the size of the input)
+            self.assertTrue(0.9 * total < final["expected_pairs"] < 1.1 * total)
+            self.assertTrue(0.9 < final["fraction_done"] <= 1.0)
+            self.assertEqual(num_workers, final["num_workers"])
+            self.assertEqual(num_workers, len(final["workers"]))
+            self.assertEqual(total, sum(w["pairs"] for w in final["workers"]))
+            self.assertEqual(final["batches_queued"], sum(w["batches"] for w in final["workers"]))
+            for w in final["workers"]:
+                self.assertTrue(0.0 <= w["utilization"] <= 1.0)
+                self.assertTrue(w["max_batch_latency"] >= w["mean_batch_latency"])
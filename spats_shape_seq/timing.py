@@ -0,0 +1,52 @@
+
+#
+# per-stage timing of pair processing (run.stage_timing)
+#
+# general idea: to see where the time goes on a given library, each
+# processor lists its stage methods (mask matching, matching against
+# the targets, adapter trimming, alignment, quality checks, ...) in
+# _timed_stages, and when stage_timing is on, those methods are
+# replaced on the instance by wrappers that time every call. so there
+# is no cost at all when it's off.
+#
+# - the time (in ns) and number of calls for each stage are added to
+#   the counters, under keys starting with '_stage_', so that they're
+#   merged across workers and stored and loaded along with the rest
+#   of the counters (counts_dict() leaves them out). see
+#   Counters.add_stage_time() and stage_times().
+#
+# - 'pair' is the whole of process_pair() (including any pair cache
+#   lookup); the other stages happen within it and don't nest, so
+#   whatever 'pair' has left over is the untimed parts. registering
+#   the counts is timed by the Counters themselves ('register').
+#
+# - pairs processed a batch at a time (find_partial with handle_indels)
+#   don't go through process_pair(), so have no 'pair' time, and
+#   'mask' then includes the batch classify_masks() calls.
+#
+
+import time
+
+
+def timed(fn, stage, add_time):
+    """Returns fn wrapped so that each call adds its elapsed time to
+    stage, via add_time(stage, seconds).
+    """
+    clock = time.time
+    def timed_fn(*args, **kwargs):
+        start = clock()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            add_time(stage, clock() - start)
+    return timed_fn
+
+
+def time_stages(obj, stages, add_time):
+    """Replaces each of the (method name, stage) stages on obj with a
+    :func:`timed` version. Methods obj doesn't have are skipped.
+    """
+    for name, stage in stages:
+        fn = getattr(obj, name, None)
+        if fn:
+            object.__setattr__(obj, name, timed(fn, stage, add_time))
@@ -16,11 +16,12 @@ import ntpath
 
 import spats_shape_seq
 from spats_shape_seq import Spats
-from spats_shape_seq.parse import abif_parse, fastq_handle_filter, FastFastqParser
+from spats_shape_seq.parse import abif_parse, fastq_handle_filter, is_gzipped, FastFastqParser
 from spats_shape_seq.reads import ReadsData, ReadsAnalyzer
 from counters import Counters
 from util import objdict_to_dict
 from mask import PLUS_PLACEHOLDER, MINUS_PLACEHOLDER
+from native import NativeEngine
 
 
 class SpatsTool(object):
@@ -32,7 +33,6 @@ class SpatsTool(object):
         self._skip_log = False
         self._no_config_required_commands = [ "doc", "help", "init", "viz", "show", "extract_case", "add_case", "show_test_case" ]
         self._private_commands = [ "viz", "to_shapeware", "rerun" ]
-        self._temp_files = []
         self._r1 = None
         self._r2 = None
         self._r1_plus = None
@@ -75,22 +75,28 @@ class SpatsTool(object):
         print(":{}".format(note))
 
     def _load_r1_r2(self, suffix = ''):
-        def decomp(rx):
-            base, ext = os.path.splitext(os.path.basename(rx))
-            if ext.lower() == '.gz':
-                self._add_note("decompressing {}".format(rx))
-                out = os.path.join(self.path, base + ".tmp")
-                subprocess.check_call('gzip -d -c "{}" > "{}"'.format(rx, out), cwd = self.path, shell = True)
-                self._temp_files.append(out)
-                self._sentinel("decompress {}".format(rx))
-                return out
-            return rx
+        # note that gzip'd inputs are streamed directly by the parsers, no need to decompress here
         def singleOrList(rkey):
             # hack to keep r1_plus and r2_plus properties backwards compatible...
-            res = [ decomp(r.strip()) for r in self.config[rkey].split(',') ]
+            res = [ r.strip() for r in self.config[rkey].split(',') ]
             return res if len(res) > 1 else res[0]
         return singleOrList('r1' + suffix), singleOrList('r2' + suffix)
 
+    def _native_engine_supports_inputs(self):
+        if self.using_separate_channel_files:
+            inputs = [ (self.r1_minus, self.r2_minus) ] + self.plus_channels
+        else:
+            inputs = [ (self.r1, self.r2) ]
+        for r1, r2 in inputs:
+            with FastFastqParser(r1, r2) as parser:
+                if not NativeEngine.supports(parser.pair_length()):
+                    return False
+        return True
+
+    def _compressed_inputs(self):
+        # the native tools can only read uncompressed fastq
+        return is_gzipped(self.r1) or is_gzipped(self.r2)
+
     @property
     def r1(self):
         if not self._r1:
@@ -173,10 +179,6 @@ class SpatsTool(object):
             delta = self._sentinel("{} complete".format(command))
             self._log(command, delta)
 
-        for f in self._temp_files:
-            if os.path.exists(f):
-                os.remove(f)
-
     def _sentinel(self, label):
         delta = time.time() - self.start
         self._add_note("{} @ {:.2f}s".format(label, delta))
@@ -211,6 +213,9 @@ class SpatsTool(object):
             os.remove(db_name)
 
         native_tool = self._native_tool('reads')
+        if native_tool and self._compressed_inputs():
+            self._add_note("skipping native tool due to compressed input")
+            native_tool = None
         if native_tool:
             self._add_note("using native reads")
             subprocess.check_call([native_tool, self.config['target'], self.r1, self.r2, db_name], cwd = self.path)
@@ -250,6 +255,9 @@ class SpatsTool(object):
             raise Exception("spats_run file does not exist at path {}".format(spatsdb))
 
         native_tool = self._native_tool('reads')
+        if native_tool and self._compressed_inputs():
+            self._add_note("skipping native tool due to compressed input")
+            native_tool = None
         if native_tool:
             self._add_note("using native reads")
             subprocess.check_call([native_tool, self.config['target'], self.r1, self.r2, db_name], cwd = self.path)
@@ -345,20 +353,32 @@ class SpatsTool(object):
             os.remove(run_name)
 
         native_tool = self._native_tool('cotrans')
-        if native_tool and not self.cotrans:
+        native_engine = NativeEngine.available()
+        if (native_tool or native_engine) and not self.cotrans:
             self._add_note("skipping native tool due to non-cotrans run")
-            native_tool = None
+            native_tool = native_engine = None
 
         spats = Spats(cotrans = self.cotrans)
-        if self._update_run_config(spats.run) and native_tool:
+        if self._update_run_config(spats.run) and (native_tool or native_engine):
             self._add_note("skipping native tool due to custom config")
+            native_tool = native_engine = None
+        if native_engine and not self._native_engine_supports_inputs():
+            self._add_note("skipping native engine due to unsupported pair length")
+            native_engine = None
+        if native_engine:
+            self._add_note("using in-process native cotrans engine")
+            spats.run.algorithm = 'native'
+            native_tool = None
+        if native_tool and self._compressed_inputs():
+            self._add_note("skipping native tool due to compressed input")
             native_tool = None
 
         if native_tool:
             self._add_note("using native cotrans processor")
             subprocess.check_call([native_tool, self.config['target'], self.r1, self.r2, run_name], cwd = self.path)
         else:
-            self._add_note("using python processor")
+            if not native_engine:
+                self._add_note("using python processor")
             spats.addTargets(self.config['target'])
             if self.using_separate_channel_files:
                 self._add_note("using separate channel files.")
@@ -535,12 +555,12 @@ class SpatsTool(object):
             uiclient_worker.terminate()
 
     def dump(self):
-        """Dump data. Provide 'reads', 'run', 'prefixes', 'mut_counts' or 'indel_lens'
+        """Dump data. Provide 'reads', 'run', 'prefixes', 'mut_counts', 'indel_lens' or 'timing'
         as an argument to dump the indicated type of data.
         """
         self._skip_log = True
         if not self._command_args:
-            raise Exception("Dump requires a type ('reads', 'run', 'prefixes', 'mut_counts' or 'indel_lens').")
+            raise Exception("Dump requires a type ('reads', 'run', 'prefixes', 'mut_counts', 'indel_lens' or 'timing').")
         dump_type = self._command_args[0]
         handler = getattr(self, "_dump_" + dump_type, None)
         if not handler:
@@ -622,6 +642,17 @@ class SpatsTool(object):
         output_path = os.path.join(self.path, '{}mapped_indel_len_counts.csv'.format(prefix))
         self._write_csv(output_path, [ "Indel Length", "Reads" ], ilen_cnt)
 
+    def _dump_timing(self, spats, prefix = ""):
+        stage_times = spats.counters.stage_times()
+        if not stage_times:
+            raise Exception("No stage timing data; set stage_timing to record it.")
+        timing = []
+        for stage in sorted(stage_times.keys(), key = lambda s : stage_times[s][0], reverse = True):
+            seconds, calls = stage_times[stage]
+            timing.append((stage, seconds, calls, 1e6 * seconds / calls if calls else 0))
+        output_path = os.path.join(self.path, '{}timing.csv'.format(prefix))
+        self._write_csv(output_path, [ "Stage", "Seconds", "Calls", "Microseconds Per Call" ], timing)
+
     def _dump_run(self, spats, prefix = ""):
         profiles = spats.compute_profiles()
         mutations = spats.run.count_mutations
@@ -1027,7 +1058,7 @@ class SpatsTool(object):
         from spats_shape_seq.diagram import diagram
 
         alg = test_case.run_opts.get('algorithm')
-        algs = [ alg ] if alg else test_case.run_opts.get('algorithms', [ 'find_partial', 'lookup' ])
+        algs = [ alg ] if alg else test_case.run_opts.get('algorithms', [ 'find_partial', 'lookup', 'hybrid' ])
         for algorithm in algs:
             spats = Spats()
             spats.run.algorithm = algorithm
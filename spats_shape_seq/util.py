@@ -1,6 +1,11 @@
 
 import string
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 _debug_run = None
 
 def _set_debug(run):
@@ -24,6 +29,10 @@ rev_comp_complementor = string.maketrans("ATCGatcg", "TAGCtagc")
 def reverse_complement(seq):
     return str(seq).translate(rev_comp_complementor)[::-1]
 
+# maps nucleotides to base-4 digits, and anything else to a non-digit, for k-mer codes
+_KMER_DIGITS = string.maketrans('ACGT' + ''.join(chr(c) for c in xrange(256) if chr(c) not in 'ACGT'),
+                                '0123' + 'x' * 252)
+
 def string_find_with_overlap(needle, haystack):
     hlen = len(haystack)
     nlen = len(needle)
@@ -50,32 +59,61 @@ def string_match_errors(substr, target_str, max_errors = None):
                 return errors
     return errors
 
-def _slow_string_find_errors(substr, target_str, max_errors = 2, max_indices = 2):
+# bit-parallel matching: bit t of an int stands for position t of the
+# target string, so each step of a comparison is done for every
+# position at once, and costs O(len/w) machine words instead of a
+# python loop over the positions. _char_positions() gives the bits
+# where each character occurs; targets get searched over and over, so
+# those are cached.
+_char_positions_cache = {}
+_MAX_CACHED_CHAR_POSITIONS = 256
+
+def _char_positions(seq):
+    positions = _char_positions_cache.get(seq)
+    if positions is None:
+        positions = {}
+        for idx, c in enumerate(seq):
+            positions[c] = positions.get(c, 0) | (1 << idx)
+        if len(_char_positions_cache) >= _MAX_CACHED_CHAR_POSITIONS:
+            _char_positions_cache.clear()
+        _char_positions_cache[seq] = positions
+    return positions
+
+def _bitparallel_string_find_errors(substr, target_str, max_errors = 2, max_indices = 2):
+    # bit t of miss is set if substr[i] doesn't match at target_str[t + i];
+    # errors[d] is a (saturating, bit-sliced) count of the misses so far,
+    # with bit t set if the window at t has more than d of them.
+    # O(len(substr) * max_errors * len(target_str) / w).
     assert(max_errors > 1)
     assert(max_indices > 0)
     if max_errors >= len(substr):
         raise Exception("more errors allowed than len of substr being sought!")
+    windows = len(target_str) - len(substr) + 1
+    if windows <= 0:
+        return []
+    positions = _char_positions(target_str)
+    all_windows = (1 << windows) - 1
+    errors = [ 0 ] * (max_errors + 1)
+    for i, c in enumerate(substr):
+        miss = ~(positions.get(c, 0) >> i) & all_windows
+        for d in xrange(max_errors, 0, -1):
+            errors[d] |= errors[d - 1] & miss
+        errors[0] |= miss
+    hits = all_windows & ~errors[max_errors]
     result = []
-    ls = len(substr)
-    for t in xrange(len(target_str) - ls + 1):
-        num_errors = 0
-        s = 0
-        while s < ls:
-            if target_str[t + s] != substr[s]:
-                num_errors += 1
-                if num_errors > max_errors:
-                    s = ls
-            s += 1
-        if s == ls:
-            result.append(t)
-            if len(result) >= max_indices:
-                break
+    while hits  and  len(result) < max_indices:
+        lowest = hits & -hits
+        result.append(lowest.bit_length() - 1)
+        hits ^= lowest
     return result
 
 def string_find_errors(substr, target_str, max_errors = 0, max_indices = 2):
     assert(max_errors >= 0)
     assert(max_indices > 0)    # TAI:  consider using max_indices == -1 to return all
-    me = min(max_errors, 1)
+    if max_errors > 1:
+        # the split halves below would only find the matches with up to 1 error
+        return _bitparallel_string_find_errors(substr, target_str, max_errors, max_indices)
+    me = max_errors
 
     half_sublen = (len(substr) >> 1)
     first_half = substr[:half_sublen]
@@ -103,17 +141,63 @@ def string_find_errors(substr, target_str, max_errors = 0, max_indices = 2):
                 candidates.append(index - len(first_half))
         index += 1
 
-    result = sorted(list(set(candidates)))
-
-    if len(result) < max_indices  and  max_errors > 1:
-        result += _slow_string_find_errors(substr, target_str, max_errors, max_indices - len(result))
-
-    return result
+    return sorted(list(set(candidates)))
+
+def _bitparallel_edit_distances(s1, s2, substitution_cost):
+    # returns D(i, j), the edit distance between s1[:i] and s2[:j] with an
+    # insert/delete cost of 1 and the given substitution cost (1, or 2
+    # or more), from bit vectors over the positions in s1 for each column
+    # (prefix of s2): O(len(s2) * len(s1) / w) for all of them.
+    # for a substitution cost of 1, this is Myers' algorithm (as
+    # described by Hyyro), keeping the vertical deltas
+    # D(i, j) - D(i - 1, j) as bits that are +1 (plus) or -1 (minus).
+    # otherwise, substitutions never beat a delete and an insert, so
+    # D(i, j) = i + j - 2 * LCS(i, j), and the bit-parallel LCS (Allison
+    # and Dix) gives the LCS at each i from the cleared bits.
+    full = (1 << len(s1)) - 1
+    positions = _char_positions(s1)
+    popcount = lambda x: bin(x).count('1')
+    columns = []
+    if 1 == substitution_cost:
+        plus, minus = full, 0
+        columns.append((plus, minus))
+        for c in s2:
+            eq = positions.get(c, 0)
+            xv = eq | minus
+            xh = (((eq & plus) + plus) ^ plus) | eq
+            hplus = minus | (~(xh | plus) & full)
+            hminus = plus & xh
+            # the top row goes up by one in each column
+            hplus = ((hplus << 1) | 1) & full
+            hminus = (hminus << 1) & full
+            plus = hminus | (~(xv | hplus) & full)
+            minus = hplus & xv
+            columns.append((plus, minus))
+        def D(i, j):
+            low = (1 << i) - 1
+            plus, minus = columns[j]
+            return j + popcount(plus & low) - popcount(minus & low)
+    else:
+        v = full
+        columns.append(v)
+        for c in s2:
+            u = v & positions.get(c, 0)
+            v = ((v + u) | (v - u)) & full
+            columns.append(v)
+        def D(i, j):
+            lcs = i - popcount(columns[j] & ((1 << i) - 1))
+            return i + j - 2 * lcs
+    return D
+
+def _bitparallel_edit_distance_ok(substitution_cost, insert_delete_cost):
+    return 1 == insert_delete_cost  and  (1 == substitution_cost  or  substitution_cost >= 2)
 
 def string_edit_distance(s1, s2, substitution_cost = 2, insert_delete_cost = 1):
     '''
      Standard Levenshtein string edit distance if substitution cost is either 1x or 2x times insertion/deletion cost.
-     The algorithm runs in O(M*N) time (where M is the legnth of s1 and N is the length of S2) and O(max(M,N)) space.
+     With an insertion/deletion cost of 1 and a substitution cost of 1 or 2, the algorithm is bit-parallel, and runs
+     in O(N*M/w) time (where M is the legnth of s1, N is the length of S2, and w is the machine word size);
+     otherwise it runs in O(M*N) time and O(max(M,N)) space.
       @param  s1                     First string in the comparison
       @param  s2                     Second string in the comparison
       @param  substitution_cost      The amount to penalize a character substitution (usually 1 or 2)
@@ -128,6 +212,8 @@ def string_edit_distance(s1, s2, substitution_cost = 2, insert_delete_cost = 1):
     if 1 == max_possible:
         assert(False)
         return 0, max_possible
+    if _bitparallel_edit_distance_ok(substitution_cost, insert_delete_cost):
+        return _bitparallel_edit_distances(s1, s2, substitution_cost)(m - 1, n - 1), max_possible
     prev_row = [j for j in xrange(n)]
     cur_row = [0] * n
     for i in xrange(1, m):
@@ -142,7 +228,9 @@ def string_edit_distance2(s1, s2, substitution_cost = 2, insert_delete_cost = 1)
     '''
      Standard Levenshtein string edit distance if substitution cost is either 1x or 2x times insertion/deletion cost.
      This version keeps track of the operations required such that it can return the number of consecutive edits result.
-     The algorithm runs in O(M*N) time (where M is the legnth of s1 and N is the length of S2) and O(M*N) space.
+     With an insertion/deletion cost of 1 and a substitution cost of 1 or 2, the distances are found as in
+     string_edit_distance() and the operations from backtracking through them, in O(N*M/w) time and O(N*M/w) space;
+     otherwise, the algorithm runs in O(M*N) time (where M is the legnth of s1 and N is the length of S2) and O(M*N) space.
       @param  s1                     First string in the comparison
       @param  s2                     Second string in the comparison
       @param  substitution_cost      The amount to penalize a character substitution (usually 1 or 2)
@@ -158,6 +246,8 @@ def string_edit_distance2(s1, s2, substitution_cost = 2, insert_delete_cost = 1)
     if 1 == max_possible:
         assert(False)
         return 0, max_possible, 0
+    if _bitparallel_edit_distance_ok(substitution_cost, insert_delete_cost):
+        return _bitparallel_edit_distance2(s1, s2, substitution_cost, insert_delete_cost, max_possible)
 
     prev_row = [j for j in xrange(n)]
     cur_row = [0] * n
@@ -204,6 +294,42 @@ def string_edit_distance2(s1, s2, substitution_cost = 2, insert_delete_cost = 1)
 
 
 
+def _bitparallel_edit_distance2(s1, s2, substitution_cost, insert_delete_cost, max_possible):
+    # string_edit_distance2(), backtracking through the bit-parallel
+    # distances: the same operations are chosen as there, since only
+    # the cells along the path are needed and they have the same values
+    D = _bitparallel_edit_distances(s1, s2, substitution_cost)
+    num_consecutive_edits = 0
+    i = len(s1)
+    j = len(s2)
+    inOp = False
+    while i > 0  or  j > 0:
+        if i > 0  and  j > 0  and  s1[i-1] == s2[j-1]:
+            op = 0
+        elif 0 == i:
+            op = 2
+        elif 0 == j:
+            op = 1
+        else:
+            op, _ = min_element([ insert_delete_cost + D(i - 1, j), insert_delete_cost + D(i, j - 1), substitution_cost + D(i - 1, j - 1) ], 1)
+        if 0 == op:
+            i -= 1
+            j -= 1
+            inOp = False
+        else:
+            if not inOp:
+                num_consecutive_edits += 1
+                inOp = True
+            if op == 1:
+                i -= 1
+            elif op == 2:
+                j -= 1
+            else:
+                i -= 1
+                j -= 1
+    return D(len(s1), len(s2)), max_possible, num_consecutive_edits
+
+
 def objdict_to_dict(objdict):
     """ convenience for debugging/comparing dictionaries of objects """
     return dict(zip(map(str, objdict.keys()), map(vars, objdict.values())))
@@ -232,11 +358,13 @@ class AlignmentParams:
      @param  penalize_ends        If True, will penalize regions before/after alignment for mismatches
      @param  penalize_front_clip  If True and penalize_ends, will penalize front end if a clip is required
      @param  penalize_back_clip   If True and penalize_ends, will penalize back end if a clip is required
+     @param  band                 If set, only align within this many diagonals of the main one
     '''
     def __init__(self, simfn = lambda n1, n2: AlignmentParams.char_sim(n1, n2),
                        gap_open_cost = 6, gap_extend_cost = 1,
                        front_biased = True, penalize_ends = True,
-                       penalize_front_clip = True, penalize_back_clip = False):
+                       penalize_front_clip = True, penalize_back_clip = False,
+                       band = None):
         self.simfn = simfn
         self.gap_open_cost = gap_open_cost
         self.gap_extend_cost = gap_extend_cost
@@ -244,6 +372,7 @@ class AlignmentParams:
         self.penalize_ends = penalize_ends
         self.penalize_front_clip = penalize_front_clip
         self.penalize_back_clip = penalize_back_clip
+        self.band = band
 
     @staticmethod
     def char_sim(sc, tc, match_value = 2, mismatch_cost = 2):
@@ -322,6 +451,14 @@ def align_strings(source, target, params = AlignmentParams()):
      Insertions are indexed at the first spot in the target to be moved.
      NOTE: all indices returned are 0-based.
      Warning:  This function has not been optimized; use with care on long strings.
+     With params.band set, only cells within that many diagonals of the
+     main one (|i - j| <= band) are filled in and kept, the rest being
+     taken as 0, so the time and memory are proportional to the length
+     of the source rather than the size of the matrix. This is not just
+     a limit on the indels found: cells outside the band can't take
+     part, so a different alignment may win, and the result can differ
+     from the full alignment either way (e.g., a pair that fails to
+     match with the full alignment may match with a band, or vice versa).
      TAI:  Consider option to produce CIGAR format.
 
      @param  source  Source string
@@ -329,11 +466,29 @@ def align_strings(source, target, params = AlignmentParams()):
      @param  params  AlignmentParams object controlling alignment
      @return an Alignment object
     """
+    H, P, maxs = _align_fill(source, target, params)
+    band = params.band
+    if band is None:
+        return _align_backtrack(source, target, params, lambda i, j: H[i][j], lambda i, j: P[i][j], maxs)
+    width = 2 * band + 1
+    h = lambda i, j: H[i][j - i + band] if 0 <= j - i + band < width else 0.0
+    p = lambda i, j: P[i][j - i + band] if 0 <= j - i + band < width else (0, 0)
+    return _align_backtrack(source, target, params, h, p, maxs)
+
+
+def _align_fill(source, target, params):
+    # the dynamic-programming part of align_strings(): returns the
+    # H (score) and P (backtrack) matrices, and where the max H is.
+    # with a band, the matrices only keep the band, as in
+    # _align_fill_lanes(): cell (i, j) is at [i][j - i + band], so the
+    # diagonal neighbor is in the same column.
     m = len(source) + 1
     n = len(target) + 1
+    band = params.band
+    width = n if band is None else 2 * band + 1
 
-    H = [[0.0]*n for r in xrange(m)]
-    P = [[(0, 0)]*n for r in xrange(m)]
+    H = [[0.0]*width for r in xrange(m)]
+    P = [[(0, 0)]*width for r in xrange(m)]
 
     simfn = params.simfn
     gap_open_cost = params.gap_open_cost
@@ -347,30 +502,47 @@ def align_strings(source, target, params = AlignmentParams()):
     colmaxi = [0]*n
     for i in xrange(1, m):
         imo = i -1
-        Hi = H[i]
+        Hi, Pi, Himo = H[i], P[i], H[imo]
         rowmax, rowmaxj = 0.0, 0
-        for j in xrange(1, n):
+        if band is None:
+            # k is where cell (i, j) is kept, dk the offset of its diagonal neighbor from it
+            js, koff, dk = xrange(1, n), 0, -1
+        else:
+            js, koff, dk = xrange(max(1, i - band), min(n, i + band + 1)), band - i, 0
+        for j in js:
             jmo = j - 1
-            h = H[imo][jmo] + simfn(source[imo], target[jmo])
+            k = j + koff
+            h = Himo[k + dk] + simfn(source[imo], target[jmo])
             h2 = colmax[j] - gap_open_cost - gap_extend_cost * (imo - colmaxi[j])
             h3 = rowmax - gap_open_cost - gap_extend_cost * (jmo - rowmaxj)
-            P[i][j] = (imo, jmo)
+            Pi[k] = (imo, jmo)
             if h2 >= h:
                 h = h2
-                P[i][j] = (colmaxi[j], j)
+                Pi[k] = (colmaxi[j], j)
             if h3 >= h:
                 h = h3
-                P[i][j] = (i, rowmaxj)
-            Hi[j] = max(h, 0.0)    # omit the max0 (and backtrack from corner) for Needleman-Wunsch instead
+                Pi[k] = (i, rowmaxj)
+            Hi[k] = hk = max(h, 0.0)    # omit the max0 (and backtrack from corner) for Needleman-Wunsch instead
             if h >= maxH  and  (h > maxH  or  not front_biased  or  abs(i - j) < abs(maxs[0] - maxs[1])):
                 maxH = h
                 maxs = [i, j]
-            if Hi[j] > h2 + gap_open_cost - gap_extend_cost:
+            if hk > h2 + gap_open_cost - gap_extend_cost:
                 # above same as:  colmax[j] - gap_extend_cost * (i - colmaxi[j])
-                colmax[j], colmaxi[j] = Hi[j], i
-            if Hi[j] > h3 + gap_open_cost - gap_extend_cost:
+                colmax[j], colmaxi[j] = hk, i
+            if hk > h3 + gap_open_cost - gap_extend_cost:
                 # above same as:  rowmax - gap_extend_cost * (j - rowmaxj)
-                rowmax, rowmaxj = Hi[j], j
+                rowmax, rowmaxj = hk, j
+    return H, P, maxs
+
+
+def _align_backtrack(source, target, params, H, P, maxs):
+    # the rest of align_strings(), given H(i, j) and P(i, j) accessors
+    # for the matrices from the fill
+    m = len(source) + 1
+    n = len(target) + 1
+    simfn = params.simfn
+    gap_open_cost = params.gap_open_cost
+    gap_extend_cost = params.gap_extend_cost
 
     ## Now backtrack from max Hij...
     i, j = maxs
@@ -381,14 +553,14 @@ def align_strings(source, target, params = AlignmentParams()):
     max_run = 0
     score = 0.0
     penalize_ends = params.penalize_ends
-    while i > 0  and  j > 0  and  (H[i][j] > 0.0  or  penalize_ends):
+    while i > 0  and  j > 0  and  (H(i, j) > 0.0  or  penalize_ends):
         lasti, lastj = i, j
-        i, j = P[i][j]
+        i, j = P(i, j)
         deli, delj = lasti - i, lastj - j
         if deli and delj:
             #assert(deli == 1  and delj == 1)
             cur_indel = None
-            delscore = H[lasti][lastj] - H[i][j]
+            delscore = H(lasti, lastj) - H(i, j)
             if delscore <= 0.0:
                 mismatches.append(j)
                 if cur_run > max_run:
@@ -503,6 +675,186 @@ def align_strings(source, target, params = AlignmentParams()):
     return Alignment(params, score, n - 1, j, maxs[1] - 1, m - 1, i, maxs[0] - 1, indels, mismatches, max_run)
 
 
+# below this many jobs, align_strings_batch() just aligns them one at a time
+_MIN_ALIGNMENT_LANES = 16
+# limits on the jobs filled in together, to bound memory use
+_MAX_ALIGNMENT_LANES = 512
+_MAX_ALIGNMENT_CELLS = 1 << 21
+
+def align_strings_batch(jobs, params = AlignmentParams()):
+    """
+     Same as calling align_strings() on each of a list of jobs, but fills
+     in the alignment matrices for many jobs at once: one job per lane of
+     numpy arrays, so that each row of the fill is done for all of the
+     jobs together. The Alignments are identical to align_strings(); the
+     backtracking is still done job by job. Without numpy, for just a few
+     jobs, or if gap_extend_cost is more than gap_open_cost, simply calls
+     align_strings() on each.
+     @param  jobs    list of (source, target) tuples, or None for no job
+     @param  params  AlignmentParams object controlling alignment
+     @return a list with an Alignment object (or None) for each job
+    """
+    results = [ None ] * len(jobs)
+    todo = [ idx for idx, job in enumerate(jobs) if job ]
+    if numpy is None  or  len(todo) < _MIN_ALIGNMENT_LANES  or  params.gap_extend_cost > params.gap_open_cost:
+        for idx in todo:
+            results[idx] = align_strings(jobs[idx][0], jobs[idx][1], params)
+        return results
+
+    # jobs of similar sizes go together, since each lane costs as much as
+    # the biggest. without a band, the targets (typically the rest of the
+    # reference) are the bigger side.
+    band = params.band
+    if band is None:
+        todo.sort(key = lambda idx: (len(jobs[idx][1]), len(jobs[idx][0])))
+    else:
+        todo.sort(key = lambda idx: len(jobs[idx][0]))
+    chunk = []
+    chunk_m = chunk_w = 0
+    for idx in todo + [ None ]:
+        if idx is not None:
+            source, target = jobs[idx]
+            m = max(chunk_m, len(source) + 1)
+            w = max(chunk_w, len(target) + 1 if band is None else 2 * band + 1)
+            if len(chunk) < _MAX_ALIGNMENT_LANES  and  (len(chunk) + 1) * m * w <= _MAX_ALIGNMENT_CELLS:
+                chunk.append(idx)
+                chunk_m, chunk_w = m, w
+                continue
+        if len(chunk) < _MIN_ALIGNMENT_LANES:
+            for cidx in chunk:
+                results[cidx] = align_strings(jobs[cidx][0], jobs[cidx][1], params)
+        else:
+            chunk_jobs = [ jobs[cidx] for cidx in chunk ]
+            for cidx, job, fill in zip(chunk, chunk_jobs, _align_fill_lanes(chunk_jobs, params)):
+                results[cidx] = _align_backtrack(job[0], job[1], params, *fill)
+        if idx is not None:
+            source, target = jobs[idx]
+            chunk = [ idx ]
+            chunk_m = len(source) + 1
+            chunk_w = len(target) + 1 if band is None else 2 * band + 1
+    return results
+
+
+def _align_fill_lanes(jobs, params):
+    # _align_fill() for each of the jobs at once, lane l of each array
+    # being for jobs[l]; returns (H, P, maxs) for _align_backtrack() for
+    # each job. with a band, the matrices only keep the band: cell (i, j)
+    # is at [i][j - i + band] (so the diagonal neighbor is in the same
+    # column), and otherwise at [i][j].
+    #
+    # each row is done all at once, too. the diagonal and column (h2)
+    # candidates only depend on earlier rows; the row gap (h3) depends on
+    # rowmax, but rowmax only ever moves to a cell whose H + gap_extend_cost * j
+    # beats the one before -- and never to a cell that took the row gap
+    # itself, as long as gap_extend_cost <= gap_open_cost -- so it's a
+    # running max along the row of the H the cells would get without it.
+    # likewise, the max H of a row is found all at once, and kept if it
+    # would have won in cell order.
+    lanes = len(jobs)
+    band = params.band
+    gap_open_cost = params.gap_open_cost
+    gap_extend_cost = params.gap_extend_cost
+    front_biased = params.front_biased
+    ms = numpy.array([ len(source) + 1 for source, target in jobs ])
+    ns = numpy.array([ len(target) + 1 for source, target in jobs ])
+    m, n = ms.max(), ns.max()
+    width = n if band is None else 2 * band + 1
+
+    # simfn is only ever called on single characters, so tabulate it
+    # over the ones that occur, and translate the strings into indices
+    chars = sorted(set(''.join(source + target for source, target in jobs)))
+    codes = { c : k for k, c in enumerate(chars) }
+    sim = numpy.array([ [ params.simfn(c1, c2) for c2 in chars ] for c1 in chars ], dtype = float)
+    src = numpy.zeros((lanes, m), dtype = int)
+    tgt = numpy.zeros((lanes, n), dtype = int)
+    for lane, (source, target) in enumerate(jobs):
+        src[lane, 1:len(source) + 1] = [ codes[c] for c in source ]
+        tgt[lane, 1:len(target) + 1] = [ codes[c] for c in target ]
+
+    H = numpy.zeros((lanes, m, width))
+    PI = numpy.zeros((lanes, m, width), dtype = numpy.int32)
+    PJ = numpy.zeros((lanes, m, width), dtype = numpy.int32)
+    maxH = numpy.zeros(lanes)
+    maxs0 = numpy.zeros(lanes, dtype = int)
+    maxs1 = numpy.zeros(lanes, dtype = int)
+    colmax = numpy.zeros((lanes, n))
+    colmaxi = numpy.zeros((lanes, n), dtype = int)
+    where = numpy.where
+    lane_index = numpy.arange(lanes)
+    for i in xrange(1, m):
+        imo = i - 1
+        jlo, jhi = (1, n) if band is None else (max(1, i - band), min(n, i + band + 1))
+        if jlo >= jhi:
+            continue
+        klo = jlo if band is None else jlo - i + band
+        khi = klo + jhi - jlo
+        js = numpy.arange(jlo, jhi)
+        active = (ms > i)[:, None] & (ns[:, None] > js)
+
+        # the diagonal and column candidates
+        h = H[:, imo, klo - 1:khi - 1] if band is None else H[:, imo, klo:khi]
+        h = h + sim[src[:, i][:, None], tgt[:, jlo:jhi]]
+        cm, cmi = colmax[:, jlo:jhi], colmaxi[:, jlo:jhi]
+        h2 = cm - gap_open_cost - gap_extend_cost * (imo - cmi)
+        use2 = (h2 >= h)
+        h = where(use2, h2, h)
+        pi = where(use2, cmi, imo)
+        pj = where(use2, js, js - 1)
+
+        # where rowmax is before each cell: the last cell (or 0) to beat
+        # the running max of H + gap_extend_cost * j
+        hz = numpy.maximum(h, 0.0)
+        run = where(active, hz + gap_extend_cost * js, -numpy.inf)
+        run_before = numpy.zeros(run.shape)
+        numpy.maximum.accumulate(run[:, :-1], axis = 1, out = run_before[:, 1:])
+        numpy.maximum(run_before, 0.0, out = run_before)
+        moved = (run > run_before)
+        rowmaxj = numpy.zeros(run.shape, dtype = int)
+        numpy.maximum.accumulate(where(moved, js, 0)[:, :-1], axis = 1, out = rowmaxj[:, 1:])
+        rowmax = where(rowmaxj > 0, hz[lane_index[:, None], numpy.maximum(rowmaxj - jlo, 0)], 0.0)
+        h3 = rowmax - gap_open_cost - gap_extend_cost * (js - 1 - rowmaxj)
+        use3 = (h3 >= h)
+        h = where(use3, h3, h)
+        hij = numpy.maximum(h, 0.0)
+        H[:, i, klo:khi] = hij
+        PI[:, i, klo:khi] = where(use3, i, pi)
+        PJ[:, i, klo:khi] = where(use3, rowmaxj, pj)
+
+        update = active & (hij > h2 + gap_open_cost - gap_extend_cost)
+        colmax[:, jlo:jhi] = where(update, hij, cm)
+        colmaxi[:, jlo:jhi] = where(update, i, cmi)
+
+        # the cell that would end up as the max, going through the row in order
+        h = where(active, h, -numpy.inf)
+        row_best = h.max(axis = 1)
+        at_best = (h == row_best[:, None])
+        if front_biased:
+            k = numpy.argmin(where(at_best, numpy.abs(i - js), n + m), axis = 1)
+        else:
+            k = jhi - jlo - 1 - numpy.argmax(at_best[:, ::-1], axis = 1)
+        best_j = js[k]
+        better = (row_best >= maxH)
+        if front_biased:
+            better &= (row_best > maxH) | (numpy.abs(i - best_j) < numpy.abs(maxs0 - maxs1))
+        maxH = where(better, row_best, maxH)
+        maxs0 = where(better, i, maxs0)
+        maxs1 = where(better, best_j, maxs1)
+
+    # backtracking only visits a path through the matrices, so look the
+    # cells up as needed (item() gives back python numbers)
+    fills = []
+    H_at, PI_at, PJ_at = H.item, PI.item, PJ.item
+    for lane in xrange(lanes):
+        if band is None:
+            h = lambda i, j, lane = lane: H_at(lane, i, j)
+            p = lambda i, j, lane = lane: (PI_at(lane, i, j), PJ_at(lane, i, j))
+        else:
+            h = lambda i, j, lane = lane: H_at(lane, i, j - i + band)
+            p = lambda i, j, lane = lane: (PI_at(lane, i, j - i + band), PJ_at(lane, i, j - i + band))
+        fills.append((h, p, [ int(maxs0[lane]), int(maxs1[lane]) ]))
+    return fills
+
+
 class Colors(object):
 
     def __init__(self):
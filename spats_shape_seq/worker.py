@@ -1,10 +1,14 @@
 
+import itertools
 import multiprocessing
 import Queue
 import sys
+import time
 
 from pair import Pair
-from parse import FastqWriter, SamWriter
+from parse import FastFastqParser, FastqShard, FastqWriter, SamWriter
+from progress import ProgressMonitor, WorkerStats
+from shm import num_slots_for, SharedBatches
 from util import _debug, _warn
 from mask import PLUS_PLACEHOLDER, MINUS_PLACEHOLDER
 
@@ -13,13 +17,21 @@ class SpatsWorker(object):
     '''Manages multiprocessing aspects of Spats.
     '''
 
-    def __init__(self, run, processor, pair_db, result_set_id = None, force_mask = None):
+    def __init__(self, run, processor, pair_db, result_set_id = None, force_mask = None, progress_callback = None):
         self._run = run
         self._processor = processor
         self._pair_db = pair_db
         self._result_set_id = result_set_id
         self._force_mask = force_mask
+        self._progress_callback = progress_callback
         self._workers = []
+        self._shared = None
+        self._progress = None
+
+    def _make_monitor(self, num_workers, expected_pairs, queue_capacity = None):
+        if not (self._run.progress_log or self._progress_callback):
+            return None
+        return ProgressMonitor(self._run, num_workers, expected_pairs, queue_capacity, self._progress_callback)
 
     def _make_result(self, ident, pair, tagged = False):
         res = [ ident,
@@ -34,6 +46,53 @@ class SpatsWorker(object):
             res.append(pair.tags)
         return res
 
+    def _process_batch(self, processor, pair, pairs, writeback, tagged, use_quality, stats, slot_info = None):
+        start = time.time()
+        num_pairs = sum(lines[0] for lines in pairs)
+        shared = self._shared if slot_info else None
+        results = []
+        num_results = 0
+        masks = None
+        if not writeback and not self._force_mask:
+            if processor.process_pair_batch(pairs):
+                pairs = []
+            elif not processor.uses_tags:
+                masks = processor.classify_masks([ lines[1] for lines in pairs ])
+        for idx, lines in enumerate(pairs):
+            if not pair.set_from_data(lines[3], str(lines[1]), str(lines[2]), lines[0]):
+                print('\nskipping empty pair:  {}'.format(lines[3]))
+                continue
+            if use_quality:
+                pair.r1.quality = str(lines[4])
+                pair.r2.quality = str(lines[5])
+            if self._force_mask:
+                pair.set_mask(self._force_mask)
+            elif masks and masks[idx]:
+                pair.set_mask(masks[idx])
+            processor.process_pair(pair)
+            #if pair.failure:
+            #    print('FAIL: {}'.format(pair.failure))
+            if writeback:
+                if shared:
+                    shared.set_result(slot_info, num_results, lines[3], pair)
+                    num_results += 1
+                else:
+                    results.append(self._make_result(lines[3], pair, tagged))
+
+        if writeback:
+            # the parent frees the slot once it's read the results
+            self._results.put((slot_info[0], num_results) if shared else results)
+        elif shared:
+            shared.release(slot_info)
+
+        stats.add_batch(num_pairs, time.time() - start)
+        if self._progress and stats.due(self._run.progress_interval):
+            self._progress.put(stats.snapshot())
+
+        if not self._run.quiet:
+            sys.stdout.write('.')#str(worker_id))
+            sys.stdout.flush()
+
     def _worker(self, worker_id):
         try:
             processor = self._processor
@@ -44,34 +103,26 @@ class SpatsWorker(object):
             tagged = processor.uses_tags
             use_quality = self._run._parse_quality
             pair = Pair()
+            stats = WorkerStats(worker_id)
+            # number of pairs parsed here from shards (otherwise the parent counts them)
+            shard_total = 0
             while True:
+                start = time.time()
                 pairs = self._pairs_to_do.get()
+                stats.add_idle(time.time() - start)
                 if not pairs:
                     break
-                results = []
-                for lines in pairs:
-                    if not pair.set_from_data(lines[3], str(lines[1]), str(lines[2]), lines[0]):
-                        print('\nskipping empty pair:  {}'.format(lines[3]))
-                        continue
-                    if use_quality:
-                        pair.r1.quality = str(lines[4])
-                        pair.r2.quality = str(lines[5])
-                    if self._force_mask:
-                        pair.set_mask(self._force_mask)
-                    processor.process_pair(pair)
-                    #if pair.failure:
-                    #    print('FAIL: {}'.format(pair.failure))
-                    if writeback:
-                        results.append(self._make_result(lines[3], pair, tagged))
-
-                if writeback:
-                    self._results.put(results)
-
-                if not self._run.quiet:
-                    sys.stdout.write('.')#str(worker_id))
-                    sys.stdout.flush()
-
-            self._pairs_done.put(processor.counters.count_data())
+                if isinstance(pairs, FastqShard):
+                    with FastFastqParser(pairs.r1_path, pairs.r2_path, use_quality, shard = pairs) as parser:
+                        for batch in parser.iterator(batch_size = 16384):
+                            shard_total += len(batch)
+                            self._process_batch(processor, pair, batch, writeback, tagged, use_quality, stats)
+                elif isinstance(pairs, tuple):
+                    self._process_batch(processor, pair, self._shared.get(pairs), writeback, tagged, use_quality, stats, pairs)
+                else:
+                    self._process_batch(processor, pair, pairs, writeback, tagged, use_quality, stats)
+
+            self._pairs_done.put((processor.counters.count_data(), shard_total, stats.snapshot()))
         except:
             print("**** Worker exception, aborting...")
             raise
@@ -88,19 +139,32 @@ class SpatsWorker(object):
         for w in self._workers:
             w.join()
 
-    def run(self, pair_iterator):
+    def run(self, pair_iterator, expected_pairs = None):
 
         num_workers = max(1, self._run.num_workers or multiprocessing.cpu_count())
 
         if 1 == num_workers:
-            self.run_simple(pair_iterator)
+            self.run_simple(pair_iterator, expected_pairs)
             return
 
         self._pairs_to_do = multiprocessing.Queue(maxsize = 2 * num_workers)
         self._pairs_done = multiprocessing.Queue()
         self._results = multiprocessing.Queue()
+        monitor = self._make_monitor(num_workers, expected_pairs, 2 * num_workers)
+        if monitor:
+            # must exist before the workers are forked
+            self._progress = multiprocessing.Queue()
+
+        if self._run.shared_memory_batches and not self._processor.uses_tags:
+            # slots are sized based on the first batch, and must exist before the workers are forked
+            first_batch = next(pair_iterator, None)
+            if first_batch:
+                pair_iterator = itertools.chain([ first_batch ], pair_iterator)
+                if not isinstance(first_batch, FastqShard):
+                    self._shared = SharedBatches(first_batch, num_slots_for(num_workers), self._run._parse_quality, self._run.masks)
 
         self._createWorkers(num_workers)
+        shared = self._shared
 
         quiet = self._run.quiet
         more_pairs = True
@@ -111,12 +175,56 @@ class SpatsWorker(object):
         if writeback:
             result_set_id = self._result_set_id
 
+        def drain_progress():
+            try:
+                while True:
+                    monitor.update(self._progress.get_nowait())
+            except Queue.Empty:
+                pass
+
+        def poll_progress():
+            drain_progress()
+            try:
+                queued = self._pairs_to_do.qsize()
+            except NotImplementedError:
+                queued = None   # e.g., on macOS
+            monitor.poll(queued)
+
+        # result batches read by put_batch() while waiting for a slot
+        results_read = [ 0 ]
+
+        def put_shared(pair_info):
+            if not writeback:
+                return shared.put(pair_info)
+            # slots holding results are only freed as the results are
+            # read here, so keep reading them while waiting
+            while True:
+                try:
+                    return shared.put(pair_info, 0.01)
+                except Queue.Empty:
+                    results_read[0] += write_results()
+
         def put_batch():
-            pair_info = next(pair_iterator)
-            self._pairs_to_do.put(pair_info)
+            if not monitor:
+                pair_info = next(pair_iterator)
+                slot_info = put_shared(pair_info) if shared else None
+                self._pairs_to_do.put(slot_info or pair_info)
+            else:
+                # time spent waiting on the input, then on the workers (backpressure)
+                start = time.time()
+                pair_info = next(pair_iterator)
+                got = time.time()
+                monitor.input_wait += got - start
+                slot_info = put_shared(pair_info) if shared else None
+                self._pairs_to_do.put(slot_info or pair_info)
+                monitor.queue_wait += time.time() - got
+                monitor.batches_queued += 1
+                poll_progress()
             if not quiet:
                 sys.stdout.write('^')
                 sys.stdout.flush()
+            if isinstance(pair_info, FastqShard):
+                return 0    # workers will report how many pairs were in the shard
             return sum(p[0] for p in pair_info)   # need to take into account multiplicity for reads
 
         def write_results():
@@ -124,7 +232,10 @@ class SpatsWorker(object):
             num_batches = 0
             try:
                 while True:
-                    all_results.extend(self._results.get(True, 0.01))
+                    results = self._results.get(True, 0.01)
+                    if isinstance(results, tuple):
+                        results = shared.results(*results)
+                    all_results.extend(results)
                     num_batches += 1
                     if not quiet:
                         sys.stdout.write('v')
@@ -133,6 +244,8 @@ class SpatsWorker(object):
                 pass
             if all_results:
                 pair_db.add_results(self._result_set_id, all_results)
+            if monitor:
+                poll_progress()
             return num_batches
 
         while more_pairs:
@@ -140,7 +253,8 @@ class SpatsWorker(object):
                 cur_count = 0
                 while cur_count < num_workers or num_batches < 2 * num_workers:
                     total += put_batch()
-                    num_batches += 1
+                    num_batches += 1 - results_read[0]
+                    results_read[0] = 0
                     cur_count += 1
                 if writeback:
                     num_batches -= write_results()
@@ -160,13 +274,17 @@ class SpatsWorker(object):
         processor = self._processor
         targets = { t.name : t for t in processor._targets.targets }
         accumulated = 0
+        shard_totals = []
 
         def accumulate_counts():
             num_accumulated = 0
             try:
                 while 1 < num_workers:
-                    count_data, vect_data = self._pairs_done.get_nowait()
+                    (count_data, vect_data), shard_total, snapshot = self._pairs_done.get_nowait()
                     processor.counters.update_with_count_data(count_data, vect_data)
+                    shard_totals.append(shard_total)
+                    if monitor:
+                        monitor.update(snapshot)
                     num_accumulated += 1
                     if not quiet:
                         sys.stdout.write('x')
@@ -177,18 +295,25 @@ class SpatsWorker(object):
 
         while accumulated < num_workers:
             accumulated += accumulate_counts()
+            if monitor:
+                poll_progress()
+        if monitor:
+            # so that no worker is left waiting to flush it on exit
+            drain_progress()
 
         if not self._run.quiet:
             print("\nAggregating data...")
 
         self._joinWorkers()
 
-        processor.counters.total_pairs = total
+        processor.counters.total_pairs = total + sum(shard_totals)
+        if monitor:
+            monitor.finish()
         #if self._pair_db:
         #    processor.counters.unique_pairs = self._pair_db.unique_pairs()
 
 
-    def run_simple(self, pair_iterator):
+    def run_simple(self, pair_iterator, expected_pairs = None):
 
         quiet = self._run.quiet
         run_limit = self._run._run_limit
@@ -213,16 +338,34 @@ class SpatsWorker(object):
         if channel_reads:
             plus_writer = FastqWriter('R1_plus.fastq', 'R2_plus.fastq')
             minus_writer = FastqWriter('R1_minus.fastq', 'R2_minus.fastq')
+        batchable = not (writeback or sam or channel_reads or self._force_mask)
+        monitor = self._make_monitor(1, expected_pairs)
+        stats = WorkerStats(0)
 
         while more_pairs:
             try:
                 while True:
-                    pair_info = next(pair_iterator)
+                    if monitor:
+                        # no queue here, so waiting on the input is the only idle time
+                        start = time.time()
+                        pair_info = next(pair_iterator)
+                        batch_start = time.time()
+                        monitor.input_wait += batch_start - start
+                        stats.add_idle(batch_start - start)
+                        batch_total = total
+                    else:
+                        pair_info = next(pair_iterator)
                     if not quiet:
                         sys.stdout.write('^')
                         sys.stdout.flush()
                     results = []
-                    for lines in pair_info:
+                    masks = None
+                    if batchable and processor.process_pair_batch(pair_info):
+                        total += sum(lines[0] for lines in pair_info)
+                        pair_info = []
+                    elif batchable and not processor.uses_tags:
+                        masks = processor.classify_masks([ lines[1] for lines in pair_info ])
+                    for idx, lines in enumerate(pair_info):
                         if not pair.set_from_data(lines[3], str(lines[1]), str(lines[2]), lines[0]):
                             print('\nskipping empty pair:  {}'.format(lines[3]))
                             continue
@@ -231,6 +374,8 @@ class SpatsWorker(object):
                             pair.r2.quality = str(lines[5])
                         if self._force_mask:
                             pair.set_mask(self._force_mask)
+                        elif masks and masks[idx]:
+                            pair.set_mask(masks[idx])
 
                         try:
                             processor.process_pair(pair)
@@ -260,6 +405,12 @@ class SpatsWorker(object):
                             sys.stdout.write('.')
                             sys.stdout.flush()
 
+                    if monitor:
+                        stats.add_batch(total - batch_total, time.time() - batch_start)
+                        monitor.batches_queued += 1
+                        monitor.update(stats.snapshot())
+                        monitor.poll()
+
                     if run_limit and total > run_limit:
                         raise StopIteration()
 
@@ -272,3 +423,5 @@ class SpatsWorker(object):
         processor.counters.total_pairs = total
         if self._pair_db:
             processor.counters.unique_pairs = self._pair_db.unique_pairs()
+        if monitor:
+            monitor.finish()
@@ -0,0 +1,121 @@
+
+#
+# counts the objects and derived strings built per pair while processing
+#
+# general idea: a worker reuses one Pair for all of its pairs, so the
+# per-pair garbage is the Pair/Sequence objects that get built anyway,
+# plus the strings derived from the reads (subsequence, subquality,
+# reverse_quality, reverse_complement) each time they're rebuilt.
+#
+# - Pair/Sequence construction is counted by wrapping __init__.
+#
+# - a derived string counts as built when its getter returns a
+#   different object than last time for that Sequence; a memoized one
+#   returns the same object until it's invalidated. (so this works the
+#   same on revisions that don't memoize them.)
+#
+# - the pairs are the test cases in spats_shape_seq/tests/test_pairs.py
+#   (against test/5s/5s.fa) and test_cotrans.py (against
+#   test/cotrans/cotrans_single.fa), repeated, one worker, with
+#   count_mutations.
+#
+# usage, from the top of a checkout (run it from a checkout of another
+# revision to compare):
+#
+#   python tools/pair_allocs.py [copies]
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.getcwd())
+
+from spats_shape_seq import Spats
+from spats_shape_seq.pair import Pair
+from spats_shape_seq.sequence import Sequence
+from spats_shape_seq.tests import test_cotrans, test_pairs
+
+
+DERIVED = ( 'subsequence', 'subquality', 'reverse_quality', 'reverse_complement' )
+
+builds = {}
+_last = {}
+
+
+def _count_inits(cls):
+    init = cls.__init__
+    def counted_init(self, *args, **kwargs):
+        builds[cls.__name__] = builds.get(cls.__name__, 0) + 1
+        init(self, *args, **kwargs)
+    cls.__init__ = counted_init
+
+
+def _count_builds(name):
+    prop = getattr(Sequence, name)
+    def counted_get(self):
+        res = prop.fget(self)
+        key = (id(self), name)
+        if res is not None and res is not _last.get(key):
+            builds[name] = builds.get(name, 0) + 1
+            # (holding on to it also keeps its id from being reused)
+            _last[key] = res
+        return res
+    setattr(Sequence, name, property(counted_get, prop.fset))
+
+
+def write_fastqs(tmpdir, cases, copies):
+    r1_path = os.path.join(tmpdir, "R1.fastq")
+    r2_path = os.path.join(tmpdir, "R2.fastq")
+    with open(r1_path, 'wb') as r1_out, open(r2_path, 'wb') as r2_out:
+        for i in xrange(copies):
+            for case in cases:
+                for out, seq in ( (r1_out, case[1]), (r2_out, case[2]) ):
+                    out.write("@{}_{}\n{}\n+\n{}\n".format(case[0], i, seq, 'I' * len(seq)))
+    return r1_path, r2_path
+
+
+def run(target_path, r1_path, r2_path, algorithm, cotrans):
+    spats = Spats(cotrans = cotrans)
+    spats.run.quiet = True
+    spats.run.num_workers = 1
+    spats.run.algorithm = algorithm
+    spats.run.count_mutations = True
+    if cotrans:
+        spats.run.cotrans_linker = 'CTGACTCGGGCACCAAGGAC'
+    spats.addTargets(target_path)
+    builds.clear()
+    _last.clear()
+    start = time.time()
+    spats.process_pair_data(r1_path, r2_path)
+    return spats.counters, time.time() - start
+
+
+def main():
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    _count_inits(Pair)
+    _count_inits(Sequence)
+    for name in DERIVED:
+        _count_builds(name)
+    keys = [ 'Pair', 'Sequence' ] + list(DERIVED)
+    print("per pair:  " + "  ".join(keys) + "  total")
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for label, target_path, cases, cotrans in ( ("5s", "test/5s/5s.fa", test_pairs.cases, False),
+                                                    ("cotrans", "test/cotrans/cotrans_single.fa", test_cotrans.cases, True) ):
+            r1_path, r2_path = write_fastqs(tmpdir, cases, copies)
+            for algorithm in ("find_partial", "lookup"):
+                counters, secs = run(target_path, r1_path, r2_path, algorithm, cotrans)
+                n = float(counters.total_pairs)
+                print("{} {}:  {}  {:.2f}   ({} pairs, {} registered, {:.2f}s)".format(label, algorithm,
+                                                                                   "  ".join("{:.2f}".format(builds.get(k, 0) / n) for k in keys),
+                                                                                   sum(builds.values()) / n,
+                                                                                   counters.total_pairs, counters.registered_pairs, secs))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()